@@ -2,6 +2,10 @@
 ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Besides Django, it serves the rental event push channel (books/realtime.py):
+
+    /ws/rentals/           WebSocket
+    /api/events/rentals/   Server-Sent Events
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -13,4 +17,21 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from backend import startup  # noqa: E402
+from books import realtime  # noqa: E402  (needs the app registry loaded above)
+
+startup.warm()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket' and scope['path'] == '/ws/rentals/':
+        await realtime.websocket_app(scope, receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/api/events/rentals/':
+        await realtime.sse_app(scope, receive, send)
+    elif scope['type'] == 'websocket':
+        await receive()
+        await send({'type': 'websocket.close', 'code': 4404})
+    else:
+        await django_application(scope, receive, send)
@@ -0,0 +1,140 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+Picks the first of COMPRESSION_ENCODINGS ('zstd', 'br', 'gzip' by default) that
+the client accepts and this server can produce. zstd and br need the
+`zstandard` and `brotli` packages; without them those encodings are skipped.
+Responses smaller than COMPRESSION_MIN_BYTES, already encoded, or of a type
+that doesn't compress (images) are sent as they are. Streaming responses are
+compressed chunk by chunk, flushing after each one so the client still gets
+data as it is produced.
+"""
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', '+json', '+xml')
+
+
+def _gzip():
+    compressor = zlib.compressobj(getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6), zlib.DEFLATED, 31)
+    return (
+        compressor.compress,
+        lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+        compressor.flush,
+    )
+
+
+def _brotli():
+    import brotli
+    compressor = brotli.Compressor(quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5))
+    return compressor.process, compressor.flush, compressor.finish
+
+
+def _zstd():
+    import zstandard
+    compressor = zstandard.ZstdCompressor(level=getattr(settings, 'COMPRESSION_ZSTD_LEVEL', 3)).compressobj()
+    return (
+        compressor.compress,
+        lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+        compressor.flush,
+    )
+
+
+CODECS = {'zstd': _zstd, 'br': _brotli, 'gzip': _gzip}
+
+
+def _available():
+    available = []
+    for encoding in getattr(settings, 'COMPRESSION_ENCODINGS', ['zstd', 'br', 'gzip']):
+        try:
+            CODECS[encoding]()
+        except ImportError:
+            continue
+        available.append(encoding)
+    return available
+
+
+def accepted_encodings(header):
+    """{encoding: q} from an Accept-Encoding header."""
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+def negotiate(header, available):
+    """The encoding to use from `available` (in server preference order), or None."""
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _compressed(content, codec):
+    compress, _, finish = codec
+    return compress(content) + finish()
+
+
+def _compressed_stream(chunks, codec):
+    compress, flush, finish = codec
+    for chunk in chunks:
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+class CompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.available = _available()
+        self.min_bytes = getattr(settings, 'COMPRESSION_MIN_BYTES', 1024)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if (
+            response.has_header('Content-Encoding')
+            or not any(kind in content_type for kind in COMPRESSIBLE_TYPES)
+            or (not response.streaming and len(response.content) < self.min_bytes)
+        ):
+            return response
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''), self.available)
+        if encoding is None:
+            return response
+
+        codec = CODECS[encoding]()
+        if response.streaming:
+            response.streaming_content = _compressed_stream(response.streaming_content, codec)
+            del response['Content-Length']
+        else:
+            compressed = _compressed(response.content, codec)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # The representation changed, so a strong ETag no longer applies
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,24 @@
+"""
+MongoDB connection for mongoengine.
+
+connect() registers the default connection without opening it: pymongo
+connects on the first operation, so loading settings and the apps costs no
+round trip, and a pre-forking server can import the whole app in its master
+process. MongoClient must not be shared across a fork, so each worker calls
+reconnect() after forking to get its own client and pool.
+
+Indexes are not created on first use (auto_create_index is off on every
+Document); `manage.py ensure_indexes` creates them at deploy time.
+"""
+import mongoengine
+from django.conf import settings
+
+
+def connect():
+    return mongoengine.connect(host=settings.MONGODB_HOST, connect=False, **getattr(settings, 'MONGODB_OPTIONS', {}))
+
+
+def reconnect():
+    """Drop the client inherited from the parent process and register a fresh one."""
+    mongoengine.disconnect()
+    return connect()
@@ -0,0 +1,69 @@
+"""
+JSON rendering and parsing with orjson.
+
+Drop-in replacements for DRF's JSONRenderer and JSONParser that produce the
+same output for what our serializers return, several times faster on large
+lists. orjson encodes datetimes, dates, times, UUIDs and numpy arrays itself;
+everything else DRF's encoder knows about (Decimal, lazy strings, ObjectId,
+timedelta, querysets, generators) goes through _default().
+"""
+import datetime
+import decimal
+
+import orjson
+from bson import ObjectId
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(obj):
+    if isinstance(obj, decimal.Decimal):
+        # Serializers coerce decimals to strings; raw ones render as numbers like DRF's
+        return float(obj)
+    if isinstance(obj, (Promise, ObjectId)):
+        return force_str(obj)
+    if isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, '__getitem__'):
+        return list(obj) if isinstance(obj, tuple) else dict(obj)
+    if hasattr(obj, '__iter__'):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(data, indent=False):
+    ret = orjson.dumps(data, default=_default, option=OPTIONS | (orjson.OPT_INDENT_2 if indent else 0))
+    # Keep the output a strict JavaScript subset, as DRF's renderer does
+    if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+        ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return ret
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer on orjson. Any requested indent is rendered as two spaces."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data, indent=bool(self.get_indent(accepted_media_type, renderer_context or {})))
+
+
+class ORJSONParser(JSONParser):
+    """JSONParser on orjson. Request bodies must be UTF-8, as RFC 8259 requires."""
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            # orjson rejects NaN and Infinity, like the strict JSONParser
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {str(exc)}")
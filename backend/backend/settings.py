@@ -13,14 +13,14 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv
-import mongoengine
-
-# Load environment variables
-load_dotenv()
+from corsheaders.defaults import default_headers as default_cors_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Load environment variables (an explicit path skips the directory search)
+load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -51,10 +51,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'backend.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
+    'users.middleware.CSRFTokenHintMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -91,11 +93,12 @@ DATABASES = {
     }
 }
 
-# MongoDB connection
-MONGODB_HOST = 'MONGO_URI'
-
-# Connect to MongoDB
-mongoengine.connect(host=MONGODB_HOST)
+# MongoDB connection, registered lazily when the books app loads (backend/mongo.py)
+MONGODB_HOST = os.getenv('MONGO_URI', 'mongodb://localhost:27017/book_renting')
+MONGODB_OPTIONS = {
+    'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', '100')),
+    'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -115,6 +118,36 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing runs in a bounded process pool (see users/hashing.py) so a
+# burst of logins can't occupy every request thread.
+AUTHENTICATION_BACKENDS = ['users.backends.PooledModelBackend']
+PASSWORD_HASHERS = [
+    'users.hashing.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '260000'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '32'))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '5'))
+
+# Token-bucket limits for login/register: (tokens per second, burst capacity)
+AUTH_RATE_LIMITS = {
+    'ip': (float(os.getenv('AUTH_RATE_PER_IP', '1')), int(os.getenv('AUTH_BURST_PER_IP', '20'))),
+    'username': (float(os.getenv('AUTH_RATE_PER_USERNAME', '0.2')), int(os.getenv('AUTH_BURST_PER_USERNAME', '5'))),
+}
+AUTH_THROTTLE_CACHE = 'default'
+AUTH_THROTTLE_TRUST_X_FORWARDED_FOR = os.getenv('AUTH_THROTTLE_TRUST_X_FORWARDED_FOR', 'False') == 'True'
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'book-renting'),
+    }
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -138,6 +171,17 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploaded covers, content addressed (see books/covers.py)
+COVERS_ROOT = os.getenv('COVERS_ROOT', os.path.join(MEDIA_ROOT, 'covers'))
+COVERS_URL = MEDIA_URL + 'covers/'
+# Internal nginx location for X-Accel-Redirect, e.g. '/protected-covers/'; empty serves from Django
+COVERS_ACCEL_REDIRECT = os.getenv('COVERS_ACCEL_REDIRECT', '')
+COVER_THUMBNAIL_SIZES = {'sm': 160, 'md': 320, 'lg': 640}
+COVER_THUMBNAIL_WORKERS = int(os.getenv('COVER_THUMBNAIL_WORKERS', '2'))
+COVER_THUMBNAIL_TIMEOUT = float(os.getenv('COVER_THUMBNAIL_TIMEOUT', '10'))
+COVER_MAX_UPLOAD_BYTES = int(os.getenv('COVER_MAX_UPLOAD_BYTES', str(5 * 1024 * 1024)))
+COVER_MAX_PIXELS = int(os.getenv('COVER_MAX_PIXELS', str(40_000_000)))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -149,6 +193,8 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",  # React frontend
 ]
 CORS_ALLOW_CREDENTIALS = True
+CORS_EXPOSE_HEADERS = ['X-CSRFToken', 'Idempotent-Replayed']
+CORS_ALLOW_HEADERS = list(default_cors_headers) + ['idempotency-key']
 
 # Rest Framework settings
 REST_FRAMEWORK = {
@@ -158,10 +204,87 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'backend.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'backend.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# Response compression (backend/compression.py). 'zstd' and 'br' are used
+# when the zstandard / brotli packages are installed.
+COMPRESSION_ENCODINGS = os.getenv('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',')
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '5'))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', '3'))
+
+# Most copies one listing can have; each is an element of the book document
+BOOK_MAX_COPIES = int(os.getenv('BOOK_MAX_COPIES', '100'))
+
+# Longest rental a renter can request (books/booking.py)
+RENTAL_MAX_DAYS = int(os.getenv('RENTAL_MAX_DAYS', '90'))
+
+# Rankings (books/rankings.py)
+RANKING_HALF_LIFE_DAYS = float(os.getenv('RANKING_HALF_LIFE_DAYS', '7'))
+RANKING_RATING_PRIOR_WEIGHT = int(os.getenv('RANKING_RATING_PRIOR_WEIGHT', '10'))
+
+# Recommendations (books/recommendations.py)
+RECOMMENDATIONS_TOP_N = int(os.getenv('RECOMMENDATIONS_TOP_N', '20'))
+
 # Session settings
 SESSION_COOKIE_SAMESITE = 'Lax'
 CSRF_COOKIE_SAMESITE = 'Lax'
 SESSION_COOKIE_HTTPONLY = True
-CSRF_COOKIE_HTTPONLY = True
+# The client reads the token from the cookie (or the X-CSRFToken response
+# header) and reuses it, so the cookie must be readable and long-lived.
+CSRF_COOKIE_HTTPONLY = False
+CSRF_COOKIE_AGE = int(os.getenv('CSRF_COOKIE_AGE', str(60 * 60 * 24 * 365)))
+
+# In-process cache of shared book works (see books/works.py)
+WORKS_CACHE_SIZE = int(os.getenv('WORKS_CACHE_SIZE', '10000'))
+WORKS_CACHE_TTL = int(os.getenv('WORKS_CACHE_TTL', '300'))
+
+# Rental event push over WebSocket/SSE (books/realtime.py, served by backend/asgi.py).
+# Events are published by the outbox workers, so they must reach the ASGI
+# processes through MongoBroker; LocalBroker only delivers within one process.
+REALTIME_BROKER = os.getenv('REALTIME_BROKER', 'books.realtime.MongoBroker')
+REALTIME_QUEUE_SIZE = int(os.getenv('REALTIME_QUEUE_SIZE', '64'))
+REALTIME_MAX_CONNECTIONS_PER_USER = int(os.getenv('REALTIME_MAX_CONNECTIONS_PER_USER', '10'))
+REALTIME_HEARTBEAT_SECONDS = float(os.getenv('REALTIME_HEARTBEAT_SECONDS', '25'))
+REALTIME_MONGO_CAPPED_BYTES = int(os.getenv('REALTIME_MONGO_CAPPED_BYTES', str(64 * 1024 * 1024)))
+
+# Outbox workers (books/outbox.py, run with `manage.py run_outbox_workers`)
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '4'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '0.2'))
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', '60'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+OUTBOX_MAX_BACKOFF_SECONDS = int(os.getenv('OUTBOX_MAX_BACKOFF_SECONDS', '300'))
+
+# Hot/cold tiering (books/archive.py, run with `manage.py archive_sweep`).
+# Reviews are only archived when ARCHIVE_REVIEWS_AFTER_DAYS is set.
+ARCHIVE_RENTALS_AFTER_DAYS = int(os.getenv('ARCHIVE_RENTALS_AFTER_DAYS', '180'))
+ARCHIVE_REVIEWS_AFTER_DAYS = int(os.getenv('ARCHIVE_REVIEWS_AFTER_DAYS', '0'))
+ARCHIVE_COMPRESSION = os.getenv('ARCHIVE_COMPRESSION', '')  # '' or 'zstd'
+ARCHIVE_ZSTD_LEVEL = int(os.getenv('ARCHIVE_ZSTD_LEVEL', '6'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+
+# Write-behind view and impression counters (books/counters.py)
+COUNTERS_FLUSH_SECONDS = float(os.getenv('COUNTERS_FLUSH_SECONDS', '5'))
+COUNTERS_MAX_KEYS = int(os.getenv('COUNTERS_MAX_KEYS', '10000'))
+
+# Columnar analytics export (books/export.py, run with `manage.py export_analytics`).
+# A run only exports changes older than EXPORT_SETTLE_SECONDS, which must
+# exceed the secondaries' replication lag.
+EXPORT_SETTLE_SECONDS = int(os.getenv('EXPORT_SETTLE_SECONDS', '300'))
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_ROW_GROUP_SIZE = int(os.getenv('EXPORT_ROW_GROUP_SIZE', '50000'))
+EXPORT_PARQUET_COMPRESSION = os.getenv('EXPORT_PARQUET_COMPRESSION', 'zstd')
+
+# Import the URLconf and DRF classes when the server loads the app rather than
+# on the first request (backend/startup.py)
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP', 'True') == 'True'
@@ -0,0 +1,22 @@
+"""
+Work done once when a server process loads the app instead of on its first request.
+
+Django imports the URLconf (and with it every view, serializer and DRF
+module) and DRF imports its renderer and parser classes lazily, on the first
+request. warm() does that up front; under gunicorn with preload_app it runs
+once in the master and every forked worker inherits the loaded modules.
+"""
+from django.conf import settings
+
+
+def warm():
+    if not getattr(settings, 'STARTUP_WARMUP', True):
+        return
+    from django.urls import get_resolver
+    from rest_framework.settings import api_settings
+
+    get_resolver().url_patterns
+    api_settings.DEFAULT_RENDERER_CLASSES
+    api_settings.DEFAULT_PARSER_CLASSES
+    api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    api_settings.DEFAULT_PERMISSION_CLASSES
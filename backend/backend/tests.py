@@ -0,0 +1,86 @@
+import datetime
+import gzip
+import json
+from decimal import Decimal
+
+from bson import ObjectId
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+
+from backend import compression, renderers
+
+
+class NegotiationTests(SimpleTestCase):
+    available = ['zstd', 'br', 'gzip']
+
+    def test_server_preference_among_equal_q(self):
+        self.assertEqual(compression.negotiate('gzip, br, zstd', self.available), 'zstd')
+        self.assertEqual(compression.negotiate('gzip, br', self.available), 'br')
+
+    def test_q_values_and_wildcard(self):
+        self.assertEqual(compression.negotiate('br;q=0.5, gzip', self.available), 'gzip')
+        self.assertEqual(compression.negotiate('zstd;q=0, *;q=0.3', self.available), 'br')
+        self.assertEqual(compression.negotiate('br;q=bad, gzip;q=0', self.available), None)
+        self.assertEqual(compression.negotiate('identity', self.available), None)
+        self.assertEqual(compression.negotiate('', self.available), None)
+
+
+@override_settings(COMPRESSION_ENCODINGS=['gzip'], COMPRESSION_MIN_BYTES=100)
+class CompressionMiddlewareTests(SimpleTestCase):
+    body = json.dumps([{'title': 'Dune', 'author': 'Frank Herbert'}] * 20).encode()
+
+    def respond(self, response, accept='gzip'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+        return compression.CompressionMiddleware(lambda request: response)(request)
+
+    def test_large_json_is_compressed(self):
+        response = self.respond(HttpResponse(self.body, content_type='application/json'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+    def test_small_unaccepted_and_binary_responses_pass_through(self):
+        for response, accept in (
+            (HttpResponse(self.body[:99], content_type='application/json'), 'gzip'),
+            (HttpResponse(self.body, content_type='application/json'), 'br'),
+            (HttpResponse(self.body, content_type='image/png'), 'gzip'),
+        ):
+            response = self.respond(response, accept)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertIn(response.content, (self.body, self.body[:99]))
+
+    def test_streams_are_compressed_chunk_by_chunk(self):
+        chunks = [self.body[:500], self.body[500:]]
+        response = self.respond(StreamingHttpResponse(iter(chunks), content_type='application/json'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.body)
+
+    def test_strong_etag_becomes_weak(self):
+        response = HttpResponse(self.body, content_type='application/json')
+        response['ETag'] = '"abc"'
+        self.assertEqual(self.respond(response)['ETag'], 'W/"abc"')
+
+
+class RendererTests(SimpleTestCase):
+    def test_matches_drf_for_decimals_and_datetimes(self):
+        data = {
+            'price': Decimal('2.50'),
+            'created_at': datetime.datetime(2026, 1, 2, 3, 4, 5, 678000, tzinfo=datetime.timezone.utc),
+            'naive': datetime.datetime(2026, 1, 2, 3, 4, 5),
+            'day': datetime.date(2026, 1, 2),
+            'items': [1, 'two', None, True],
+            'title': 'Café \u2028',
+        }
+        self.assertEqual(
+            json.loads(renderers.ORJSONRenderer().render(data)),
+            json.loads(JSONRenderer().render(data)),
+        )
+
+    def test_object_ids_render_as_strings(self):
+        book_id = ObjectId()
+        self.assertEqual(json.loads(renderers.ORJSONRenderer().render({'id': book_id})), {'id': str(book_id)})
+
+    def test_line_separators_are_escaped(self):
+        self.assertIn(b'\\u2028', renderers.ORJSONRenderer().render({'title': '\u2028'}))
@@ -15,13 +15,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from books.views import serve_cover
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('books.urls')),
     path('api/auth/', include('users.urls')),
     path('api-auth/', include('rest_framework.urls')),
+    re_path(r'^%s(?P<path>.+)$' % settings.COVERS_URL.lstrip('/'), serve_cover, name='cover'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
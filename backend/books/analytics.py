@@ -0,0 +1,235 @@
+"""
+Owner earnings and rental analytics from daily rollups.
+
+Every rental state transition adds to one owner rollup and one book rollup for
+the day it happened, so dashboard queries read a few hundred small documents
+instead of scanning book_rentals.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.utils import timezone
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from . import archive
+from .models import BookDailyRollup, BookRental, OwnerDailyRollup
+from .outbox import guard
+
+logger = logging.getLogger(__name__)
+
+REQUESTED = 'requested'
+APPROVED = 'approved'
+REJECTED = 'rejected'
+RETURNED = 'returned'
+
+COUNTERS = ['requested', 'approved', 'rejected', 'returned', 'revenue_cents', 'booked_days', 'returned_days']
+
+
+def day_of(when):
+    """Midnight (naive UTC, as stored by mongoengine) of a date or datetime."""
+    if isinstance(when, datetime) and timezone.is_aware(when):
+        when = when.astimezone(dt_timezone.utc)
+    return datetime(when.year, when.month, when.day)
+
+
+def to_cents(amount):
+    return int((Decimal(str(amount or 0)) * 100).quantize(Decimal('1')))
+
+
+def _days_between(start, end):
+    if not start or not end:
+        return 0
+    return max((end - start).total_seconds(), 0) / 86400
+
+
+def increments(rental, event):
+    inc = {event: 1}
+    if event == APPROVED:
+        inc['revenue_cents'] = to_cents(rental.total_price)
+        inc['booked_days'] = _days_between(rental.rental_start_date, rental.rental_end_date)
+    elif event == RETURNED:
+        inc['returned_days'] = _days_between(rental.rental_start_date, rental.return_date)
+    return inc
+
+
+def record_transition(rental, event, when=None, event_id=None):
+    """
+    Add one rental `event` to the owner and book rollups for its day. With an
+    outbox `event_id`, replays of the same event are not counted twice.
+    """
+    day = day_of(when or timezone.now())
+    inc = increments(rental, event)
+    book_id = rental.to_mongo()['book']
+    updates = [
+        (OwnerDailyRollup, {'owner_id': rental.book_owner_id, 'day': day}, {'$inc': inc}),
+        (BookDailyRollup, {'book': book_id, 'day': day}, {
+            '$inc': inc, '$setOnInsert': {'owner_id': rental.book_owner_id}
+        }),
+    ]
+    for document, conditions, update in updates:
+        conditions, update = guard(conditions, update, event_id)
+        try:
+            document._get_collection().update_one(conditions, update, upsert=True)
+        except DuplicateKeyError:
+            pass  # the rollup exists and already counted this event
+
+
+def earnings(owner_id, start, end, granularity='day'):
+    """Revenue and rental counts per day or month for one owner."""
+    period = '%Y-%m-%d' if granularity == 'day' else '%Y-%m'
+    group = {'_id': {'$dateToString': {'format': period, 'date': '$day'}}}
+    group.update({name: {'$sum': f'${name}'} for name in COUNTERS})
+    rows = OwnerDailyRollup._get_collection().aggregate([
+        {'$match': {'owner_id': owner_id, 'day': {'$gte': day_of(start), '$lt': day_of(end)}}},
+        {'$group': group},
+        {'$sort': {'_id': 1}},
+    ])
+    series = []
+    for row in rows:
+        period_key = row.pop('_id')
+        row['period'] = period_key
+        row['revenue'] = str(Decimal(row.pop('revenue_cents')) / 100)
+        series.append(row)
+    return series
+
+
+def book_stats(owner_id, start, end):
+    """Utilization, average rental length, revenue, views and impressions per book for one owner."""
+    span_days = max((day_of(end) - day_of(start)).days, 1)
+    group = {'_id': '$book'}
+    group.update({name: {'$sum': f'${name}'} for name in COUNTERS + ['views', 'impressions']})
+    rows = BookDailyRollup._get_collection().aggregate([
+        {'$match': {'owner_id': owner_id, 'day': {'$gte': day_of(start), '$lt': day_of(end)}}},
+        {'$group': group},
+        {'$sort': {'revenue_cents': -1}},
+    ])
+    stats = []
+    for row in rows:
+        stats.append({
+            'book_id': str(row['_id']),
+            'approved': row['approved'],
+            'returned': row['returned'],
+            'revenue': str(Decimal(row['revenue_cents']) / 100),
+            'utilization': round(min(row['booked_days'] / span_days, 1.0), 4),
+            'average_rental_days': round(row['returned_days'] / row['returned'], 2) if row['returned'] else None,
+            'views': row['views'],
+            'impressions': row['impressions'],
+        })
+    return stats
+
+
+def _event_pipeline(start, end):
+    day_ms = 86400000
+    return [
+        {'$match': {'created_at': {'$gte': start, '$lt': end}}},
+        {'$project': {
+            'owner_id': '$book_owner_id',
+            'book': 1,
+            'events': {'$filter': {
+                'input': [
+                    {'k': REQUESTED, 'at': '$created_at'},
+                    {
+                        'k': APPROVED,
+                        # Live recording counts an approval on the day it happened;
+                        # rentals approved before approved_at existed fall back to
+                        # their last update while still active, else their start
+                        'at': {'$ifNull': ['$approved_at', {'$cond': [
+                            {'$eq': ['$status', 'ACTIVE']},
+                            '$updated_at',
+                            {'$ifNull': ['$rental_start_date', '$created_at']},
+                        ]}]},
+                        'on': {'$in': ['$status', ['ACTIVE', 'RETURNED']]},
+                        'revenue': {'$ifNull': ['$total_price', 0]},
+                        'days': {'$divide': [{'$subtract': ['$rental_end_date', '$rental_start_date']}, day_ms]},
+                    },
+                    {'k': REJECTED, 'at': '$updated_at', 'on': {'$eq': ['$status', 'REJECTED']}},
+                    {
+                        'k': RETURNED,
+                        'at': '$return_date',
+                        'on': {'$eq': ['$status', 'RETURNED']},
+                        'days': {'$divide': [{'$subtract': ['$return_date', '$rental_start_date']}, day_ms]},
+                    },
+                ],
+                'cond': {'$ne': ['$$this.on', False]},
+            }},
+        }},
+        {'$unwind': '$events'},
+        {'$group': {
+            '_id': {
+                'owner_id': '$owner_id',
+                'book': '$book',
+                'k': '$events.k',
+                'day': {'$dateFromParts': {
+                    'year': {'$year': '$events.at'},
+                    'month': {'$month': '$events.at'},
+                    'day': {'$dayOfMonth': '$events.at'},
+                }},
+            },
+            'count': {'$sum': 1},
+            'revenue': {'$sum': {'$ifNull': ['$events.revenue', 0]}},
+            'days': {'$sum': {'$ifNull': ['$events.days', 0]}},
+        }},
+    ]
+
+
+def _rollup_increments(row):
+    key = row['_id']
+    inc = {key['k']: row['count']}
+    if key['k'] == APPROVED:
+        inc['revenue_cents'] = to_cents(row['revenue'])
+        inc['booked_days'] = row['days']
+    elif key['k'] == RETURNED:
+        inc['returned_days'] = row['days']
+    return inc
+
+
+def backfill(start, end, batch_days=30, reset=False, log=None):
+    """
+    Rebuild rollups from book_rentals and its archive, one window of
+    `batch_days` at a time.
+
+    With `reset` the existing rental counters are cleared first, which is what
+    makes the $inc-based backfill exact; run it before live recording is enabled or during
+    a quiet period so live increments aren't counted twice.
+    """
+    owners = OwnerDailyRollup._get_collection()
+    books = BookDailyRollup._get_collection()
+    if reset:
+        owners.delete_many({})
+        # Keep the buffered view and impression counts, which can't be rebuilt
+        books.update_many({}, {'$set': {name: 0 for name in COUNTERS}})
+
+    window = timedelta(days=batch_days)
+    cursor = start
+    total = 0
+    while cursor < end:
+        window_end = min(cursor + window, end)
+        owner_ops, book_ops = [], []
+        rows = [
+            row
+            for collection in (BookRental._get_collection(), archive.RENTALS.cold)
+            for row in collection.aggregate(_event_pipeline(cursor, window_end), allowDiskUse=True)
+        ]
+        for row in rows:
+            key = row['_id']
+            if key['day'] is None:
+                continue
+            inc = _rollup_increments(row)
+            owner_ops.append(UpdateOne(
+                {'owner_id': key['owner_id'], 'day': key['day']}, {'$inc': inc}, upsert=True
+            ))
+            book_ops.append(UpdateOne(
+                {'book': key['book'], 'day': key['day']},
+                {'$inc': inc, '$setOnInsert': {'owner_id': key['owner_id']}},
+                upsert=True
+            ))
+        if owner_ops:
+            owners.bulk_write(owner_ops, ordered=False)
+            books.bulk_write(book_ops, ordered=False)
+        total += len(owner_ops)
+        if log:
+            log(f"{cursor:%Y-%m-%d}..{window_end:%Y-%m-%d}: {len(owner_ops)} rollup updates")
+        cursor = window_end
+    return total
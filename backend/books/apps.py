@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
+
+    def ready(self):
+        from backend import mongo
+        import books.handlers  # noqa  (registers the outbox handlers)
+
+        mongo.connect()
@@ -0,0 +1,234 @@
+"""
+Hot/cold tiering of finished rentals and old reviews.
+
+A sweep moves documents that will not change any more (terminal rentals, old
+reviews) out of the hot collection into `<collection>_archive`, oldest first
+and in batches. Each archived document keeps the fields queries filter and
+sort on at the top level, with their own indexes, and the full document in
+`d`, or zstd-compressed BSON in `z` when ARCHIVE_COMPRESSION is 'zstd'.
+
+A batch is inserted into the archive before it is deleted from the hot
+collection, so an interrupted sweep just runs again. A document with outbox
+events not yet applied, embedded or relayed, stays hot: their handlers read it. A document briefly
+present in both tiers is read from the hot one.
+
+Readers that pass include_archived use find(), which runs the same query and
+sort on both tiers and merges the results.
+"""
+import heapq
+from datetime import timedelta
+
+from bson import BSON
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+
+from . import outbox
+from .models import BookRental, BookReview
+
+TERMINAL_RENTAL_STATUSES = ['RETURNED', 'REJECTED']
+
+
+class Tier:
+    def __init__(self, name, document, payload_key, summary_fields, indexes, eligible, age_setting, default_days):
+        self.name = name
+        self.document = document
+        self.payload_key = payload_key  # names the document in its outbox events
+        self.summary_fields = summary_fields
+        self.indexes = indexes
+        self._eligible = eligible
+        self.age_setting = age_setting
+        self.default_days = default_days
+
+    @property
+    def hot(self):
+        return self.document._get_collection()
+
+    @property
+    def cold(self):
+        return self.hot.database[f'{self.hot.name}_archive']
+
+    def age(self):
+        days = getattr(settings, self.age_setting, self.default_days)
+        return timedelta(days=days) if days else None
+
+    def eligible(self, cutoff):
+        # Documents with outbox events still waiting to be relayed stay hot
+        return dict(self._eligible(cutoff), **{'outbox.id': {'$exists': False}})
+
+    def ensure_indexes(self):
+        for keys in self.indexes:
+            self.cold.create_index(keys)
+
+
+RENTALS = Tier(
+    'rentals', BookRental, 'rental_id',
+    summary_fields=[
+        'legacy_id', 'book', 'renter_id', 'book_owner_id', 'status', 'total_price',
+        'rental_start_date', 'rental_end_date', 'return_date', 'approved_at', 'created_at', 'updated_at',
+    ],
+    indexes=[
+        [('renter_id', ASCENDING), ('created_at', DESCENDING)],
+        [('book_owner_id', ASCENDING), ('created_at', DESCENDING)],
+        [('book', ASCENDING)],
+        [('created_at', ASCENDING)],
+        [('updated_at', ASCENDING)],
+    ],
+    eligible=lambda cutoff: {'status': {'$in': TERMINAL_RENTAL_STATUSES}, 'updated_at': {'$lt': cutoff}},
+    age_setting='ARCHIVE_RENTALS_AFTER_DAYS',
+    default_days=180,
+)
+
+REVIEWS = Tier(
+    'reviews', BookReview, 'review_id',
+    summary_fields=[
+        'legacy_id', 'book', 'reviewer_id', 'rating', 'helpful_votes', 'reported', 'hidden', 'created_at', 'updated_at',
+    ],
+    indexes=[
+        [('book', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+        [('book', ASCENDING), ('helpful_votes', DESCENDING), ('_id', DESCENDING)],
+        [('book', ASCENDING), ('rating', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+        [('book', ASCENDING), ('rating', ASCENDING), ('helpful_votes', DESCENDING), ('_id', DESCENDING)],
+        [('reviewer_id', ASCENDING)],
+        [('updated_at', ASCENDING)],
+    ],
+    # Reported reviews stay hot until they are moderated
+    eligible=lambda cutoff: {'created_at': {'$lt': cutoff}, 'reported': {'$ne': True}},
+    age_setting='ARCHIVE_REVIEWS_AFTER_DAYS',
+    default_days=0,  # disabled unless configured
+)
+
+TIERS = {tier.name: tier for tier in (RENTALS, REVIEWS)}
+
+
+def _compressor():
+    if getattr(settings, 'ARCHIVE_COMPRESSION', '') != 'zstd':
+        return None
+    import zstandard
+    return zstandard.ZstdCompressor(level=getattr(settings, 'ARCHIVE_ZSTD_LEVEL', 6))
+
+
+def pack(tier, doc, compressor=None):
+    packed = {field: doc[field] for field in tier.summary_fields if field in doc}
+    packed['_id'] = doc['_id']
+    packed['archived_at'] = timezone.now()
+    if compressor is not None:
+        packed['z'] = compressor.compress(BSON.encode(doc))
+    else:
+        packed['d'] = doc
+    return packed
+
+
+def unpack(packed):
+    if 'z' in packed:
+        import zstandard
+        return BSON(zstandard.ZstdDecompressor().decompress(packed['z'])).decode()
+    return packed['d']
+
+
+def sweep(tier, older_than=None, batch_size=500, log=None):
+    """Move eligible documents to the archive. Returns how many moved."""
+    older_than = older_than or tier.age()
+    if older_than is None:
+        return 0
+    cutoff = timezone.now() - older_than
+    compressor = _compressor()
+    tier.ensure_indexes()
+    moved = 0
+    last_id = None
+    while True:
+        query = tier.eligible(cutoff)
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        batch = list(tier.hot.find(query).sort('_id', ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+        # Events already relayed but not applied still need the hot document
+        waiting = outbox.unsettled(tier.payload_key, [doc['_id'] for doc in batch])
+        batch = [doc for doc in batch if doc['_id'] not in waiting]
+        if not batch:
+            continue
+        try:
+            tier.cold.insert_many([pack(tier, doc, compressor) for doc in batch], ordered=False)
+        except BulkWriteError as e:
+            # Archived by an interrupted sweep that didn't get to the delete
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+        # Re-check eligibility so a document changed since the read stays hot
+        ids = [doc['_id'] for doc in batch]
+        deleted = tier.hot.delete_many(dict(tier.eligible(cutoff), _id={'$in': ids})).deleted_count
+        if deleted < len(ids):
+            still_hot = [doc['_id'] for doc in tier.hot.find({'_id': {'$in': ids}}, {'_id': 1})]
+            tier.cold.delete_many({'_id': {'$in': still_hot}})
+        moved += deleted
+        if log:
+            log(f"{tier.name}: {moved} archived")
+    return moved
+
+
+def _sortable(value):
+    # Missing and null values sort before any other, as in MongoDB
+    return (0, None) if value is None else (1, value)
+
+
+def _sort_key(sort):
+    def key(doc):
+        return tuple(
+            _Reversed(_sortable(doc.get(field))) if direction == DESCENDING else _sortable(doc.get(field))
+            for field, direction in sort
+        )
+    return key
+
+
+class _Reversed:
+    """Sort wrapper that inverts the order of a value, for descending keys."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def find(tier, query, sort, limit=None, include_archived=True):
+    """
+    Raw documents matching `query` in `sort` order from the hot tier and, with
+    `include_archived`, the archive. `query` and `sort` may only use the
+    tier's summary fields and _id.
+    """
+    hot = tier.hot.find(query).sort(sort)
+    if limit:
+        hot = hot.limit(limit)
+    if not include_archived:
+        return list(hot)
+
+    cold = tier.cold.find(query).sort(sort)
+    if limit:
+        cold = cold.limit(limit)
+    hot = list(hot)
+    seen = {doc['_id'] for doc in hot}
+    cold = (unpack(packed) for packed in cold if packed['_id'] not in seen)
+    merged = heapq.merge(hot, cold, key=_sort_key(sort))
+    return [doc for _, doc in zip(range(limit), merged)] if limit else list(merged)
+
+
+def get(tier, query):
+    """One archived document matching `query`, or None."""
+    packed = tier.cold.find_one(query)
+    return unpack(packed) if packed else None
+
+
+def collection_report(tier):
+    stats = tier.hot.database.command('collStats', tier.hot.name)
+    return {
+        'count': stats.get('count', 0),
+        'size': stats.get('size', 0),
+        'total_index_size': stats.get('totalIndexSize', 0),
+        'index_sizes': stats.get('indexSizes', {}),
+    }
@@ -0,0 +1,180 @@
+"""
+Per-book booking calendar for date-range availability search.
+
+Each book carries, per month with open rentals, how many PENDING or ACTIVE
+rentals cover each day and a bitmask of the days that are fully booked
+(as many rentals as the book has copies):
+
+    calendar: {'m202611': {'c': [0, 0, 1, 1, ...31 counts], 'f': 0b1100}}
+
+The outbox handlers add a rental's days when it is requested and take them
+away when it is rejected or returned, in one pipeline update of the book
+that also recomputes the masks. A window search is then one clause per
+month, `calendar.<month>.f` having none of the window's bits set, applied
+next to the other catalog filters on the same index scan, so its cost
+follows the books the catalog filters match rather than the rentals.
+
+Days are UTC dates. A rental occupies the days from its start up to, not
+including, its end instant, so a rental ending at midnight on the 10th
+leaves the 10th free.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from pymongo import UpdateOne
+
+from .models import Book
+from .outbox import guard_pipeline
+
+DAYS = 31
+
+OPEN_STATUSES = ['PENDING', 'ACTIVE']
+
+
+def month_key(day):
+    return f"m{day.year}{day.month:02d}"
+
+
+def _utc_date(when):
+    if isinstance(when, datetime):
+        if when.tzinfo is not None:
+            when = when.astimezone(dt_timezone.utc)
+        return when.date()
+    return when
+
+
+def occupied_days(start, end):
+    """First and last day (inclusive) occupied by a rental from `start` to `end`."""
+    first = _utc_date(start)
+    if isinstance(end, datetime):
+        last = _utc_date(end - timedelta(microseconds=1))
+    else:
+        last = end - timedelta(days=1)
+    return first, last
+
+
+def month_spans(first, last):
+    """{month key: (first day index, last day index)} for the days first..last."""
+    spans = {}
+    day = first
+    while day <= last:
+        next_month = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+        span_last = min(last, next_month - timedelta(days=1))
+        spans[month_key(day)] = (day.day - 1, span_last.day - 1)
+        day = next_month
+    return spans
+
+
+def _mask_expression(counts):
+    """Bitmask of the days in `counts` booked to capacity."""
+    return {'$reduce': {
+        'input': {'$range': [0, DAYS]},
+        'initialValue': 0,
+        'in': {'$add': ['$$value', {'$cond': [
+            {'$gte': [{'$arrayElemAt': [counts, '$$this']}, {'$ifNull': ['$total_copies', 1]}]},
+            {'$pow': [2, '$$this']},
+            0
+        ]}]},
+    }}
+
+
+def _change_pipeline(spans, delta):
+    counts = {}
+    for key, (first, last) in spans.items():
+        current = {'$ifNull': [f'$calendar.{key}.c', [0] * DAYS]}
+        counts[f'calendar.{key}.c'] = {'$map': {
+            'input': {'$range': [0, DAYS]},
+            'in': {'$max': [0, {'$add': [
+                {'$arrayElemAt': [current, '$$this']},
+                {'$cond': [{'$and': [{'$gte': ['$$this', first]}, {'$lte': ['$$this', last]}]}, delta, 0]},
+            ]}]},
+        }}
+    masks = {f'calendar.{key}.f': _mask_expression(f'$calendar.{key}.c') for key in spans}
+    return [{'$set': counts}, {'$set': masks}]
+
+
+def change(book_id, owner_id, start, end, delta, event_id=None):
+    """Add (delta=1) or remove (delta=-1) one rental's days from a book's calendar."""
+    first, last = occupied_days(start, end)
+    if last < first:
+        return
+    conditions, pipeline = guard_pipeline(
+        {'_id': book_id, 'owner_id': owner_id}, _change_pipeline(month_spans(first, last), delta), event_id
+    )
+    Book._get_collection().update_one(conditions, pipeline)
+
+
+def refresh_masks(book_id, owner_id):
+    """Recompute a book's fully-booked masks, after its number of copies changed."""
+    Book._get_collection().update_one({'_id': book_id, 'owner_id': owner_id, 'calendar': {'$exists': True}}, [
+        {'$set': {'calendar': {'$arrayToObject': {'$map': {
+            'input': {'$objectToArray': '$calendar'},
+            'as': 'month',
+            'in': {'k': '$$month.k', 'v': {'c': '$$month.v.c', 'f': _mask_expression('$$month.v.c')}},
+        }}}}}
+    ])
+
+
+def _window_masks(first, last):
+    """{month key: bitmask of the days first..last in it}."""
+    return {
+        key: sum(1 << day for day in range(start, end + 1))
+        for key, (start, end) in month_spans(first, last).items()
+    }
+
+
+def window_filter(first, last):
+    """Raw query matching books with a free copy on every day first..last."""
+    clauses = [
+        {f'calendar.{key}.f': {'$not': {'$bitsAnySet': mask}}}
+        for key, mask in _window_masks(first, last).items()
+    ]
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+def is_free(calendar, first, last):
+    """window_filter() for a calendar already read: a free copy on every day first..last."""
+    calendar = calendar or {}
+    return not any(calendar.get(key, {}).get('f', 0) & mask for key, mask in _window_masks(first, last).items())
+
+
+def prune(today=None):
+    """Drop calendar months that have ended. Returns the number of books changed."""
+    today = today or datetime.now(dt_timezone.utc).date()
+    current = month_key(today)
+    return Book._get_collection().update_many({'calendar': {'$exists': True}}, [
+        {'$set': {'calendar': {'$arrayToObject': {'$filter': {
+            'input': {'$objectToArray': '$calendar'},
+            'cond': {'$gte': ['$$this.k', current]},
+        }}}}}
+    ]).modified_count
+
+
+def rebuild(rental_collection, batch_size=1000, log=None):
+    """Recompute every calendar from the open rentals. Returns the number of rentals applied."""
+    books = Book._get_collection()
+    books.update_many({'calendar': {'$exists': True}}, {'$unset': {'calendar': ''}})
+    cursor = rental_collection.find(
+        {'status': {'$in': OPEN_STATUSES}, 'rental_end_date': {'$gt': datetime.now(dt_timezone.utc)}},
+        {'book': 1, 'book_owner_id': 1, 'rental_start_date': 1, 'rental_end_date': 1},
+        batch_size=batch_size
+    )
+    operations, applied = [], 0
+    for rental in cursor:
+        first, last = occupied_days(rental['rental_start_date'], rental['rental_end_date'])
+        if last < first:
+            continue
+        operations.append(UpdateOne(
+            {'_id': rental['book'], 'owner_id': rental['book_owner_id']},
+            _change_pipeline(month_spans(first, last), 1)
+        ))
+        if len(operations) >= batch_size:
+            # Ordered: several rentals of one book must each apply on top of the last
+            books.bulk_write(operations)
+            applied += len(operations)
+            operations = []
+            if log:
+                log(f"{applied} rentals applied")
+    if operations:
+        books.bulk_write(operations)
+        applied += len(operations)
+    return applied
@@ -0,0 +1,86 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo.errors import DuplicateKeyError
+from rest_framework import status
+
+from . import availability, handlers, outbox
+from .ids import lookup
+from .models import Book, BookRental
+
+
+class BookingError(Exception):
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def rental_price(price_per_day, start, end):
+    days = Decimal((end - start).total_seconds()) / Decimal(86400)
+    return (Decimal(str(price_per_day or 0)) * days).quantize(Decimal('0.01'))
+
+
+def request_rental(book_id, renter_id, start, end):
+    """
+    Create a PENDING rental of `book_id` for `renter_id`.
+
+    One read of the book for validation and pricing, then one conditional
+    upsert that only inserts if the renter has no open request for the book
+    (backed by the pending_request_per_renter partial unique index).
+    Copies are reserved later, when the owner approves, so a request is only
+    checked against the booking calendar read here: days already booked to
+    capacity are rejected up front. The rental.requested outbox event is
+    inserted with the rental.
+    """
+    if end <= start:
+        raise BookingError("End date must be after start date")
+    if end - start > timedelta(days=getattr(settings, 'RENTAL_MAX_DAYS', 90)):
+        raise BookingError("Rental period is too long")
+    first, last = availability.occupied_days(start, end)
+    if first < timezone.now().date():
+        raise BookingError("Start date is in the past")
+
+    book = Book.objects(**lookup(book_id)).first()
+    if book is None:
+        raise BookingError("Book not found", status.HTTP_404_NOT_FOUND)
+    if str(book.owner_id) == str(renter_id):
+        raise BookingError("You cannot rent your own book")
+    if not book.available_for_rent or not book.copies_available:
+        raise BookingError("This book is not available for rent", status.HTTP_409_CONFLICT)
+    if not availability.is_free(book.calendar, first, last):
+        raise BookingError("This book is fully booked for those dates", status.HTTP_409_CONFLICT)
+
+    now = timezone.now()
+    rental = BookRental(
+        book=book,
+        renter_id=int(renter_id),
+        book_owner_id=book.owner_id,
+        rental_start_date=start,
+        rental_end_date=end,
+        status='PENDING',
+        total_price=rental_price(book.price_per_day, start, end),
+        created_at=now,
+        updated_at=now
+    )
+    rental.outbox = [outbox.event(handlers.RENTAL_REQUESTED, rental_id=rental.pk, renter_id=rental.renter_id)]
+    rental.validate()
+    try:
+        result = BookRental._get_collection().update_one(
+            {'book': book.pk, 'renter_id': rental.renter_id, 'status': 'PENDING'},
+            {'$setOnInsert': rental.to_mongo()},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        result = None
+    if result is None or result.upserted_id is None:
+        raise BookingError("You already have a pending request for this book", status.HTTP_409_CONFLICT)
+
+    return rental
+
+
+def request_rental_for_days(book_id, renter_id, days, start=None):
+    start = start or timezone.now()
+    return request_rental(book_id, renter_id, start, start + timedelta(days=days))
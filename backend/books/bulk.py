@@ -0,0 +1,34 @@
+from django.utils import timezone
+from pymongo import UpdateOne
+
+
+def write_stamp():
+    """A timestamp at the millisecond precision MongoDB stores."""
+    now = timezone.now()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def apply_conditional_updates(collection, updates, stamp, stamp_field='updated_at'):
+    """
+    Apply many conditional updates with one unordered bulk_write.
+
+    `updates` maps _id -> (conditions, update); every update must $set
+    `stamp_field` to `stamp`. bulk_write only reports totals, so when fewer
+    documents changed than requested, one $in read on the stamp tells which
+    conditions held. Returns the set of ids that were updated.
+    """
+    if not updates:
+        return set()
+    operations = [
+        UpdateOne(dict(conditions, _id=pk), update)
+        for pk, (conditions, update) in updates.items()
+    ]
+    result = collection.bulk_write(operations, ordered=False)
+    if result.modified_count == len(operations):
+        return set(updates)
+    return {
+        doc['_id'] for doc in collection.find(
+            {'_id': {'$in': list(updates)}, stamp_field: stamp},
+            {'_id': 1}
+        )
+    }
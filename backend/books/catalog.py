@@ -0,0 +1,198 @@
+"""
+Catalog filtering with an explicit index choice.
+
+Filters are parsed from query parameters and matched against the catalog
+indexes declared on Book. Each index is scored by the equality-then-range rule:
+every leading key with an equality filter counts one, and a range filter on
+the key right after them counts half. The best index is passed as a hint so
+the plan doesn't depend on the server's plan cache.
+
+Title/author search and the publication year range are properties of the
+shared work. Each listing keeps a copy of them (works.listing_fields), so they
+filter listings directly: every search word must be the prefix of a word of
+the title or author (`search_terms`), and the year range applies to
+`work_year`. An anchored prefix is a range on an index, like a price bound.
+
+available_from/available_to select books with a free copy for the whole
+window, from the booking calendar kept on each book (books/availability.py).
+That filter is checked on the documents the chosen index yields.
+"""
+import re
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from . import availability, works
+from .models import Book
+
+# (index name, keys) as declared in Book.meta['indexes']
+CATALOG_INDEXES = [
+    ('catalog_category_price', ('category', 'price_per_day')),
+    ('catalog_language_condition_price', ('language', 'condition', 'price_per_day')),
+    ('catalog_condition_price', ('condition', 'price_per_day')),
+    ('catalog_tags_price', ('tags', 'price_per_day')),
+    ('catalog_price', ('price_per_day',)),
+    ('catalog_terms_price', ('search_terms', 'price_per_day')),
+    ('catalog_work_year_price', ('work_year', 'price_per_day')),
+]
+
+ORDERINGS = {'price_per_day', 'rating', 'created_at'}
+
+
+class CatalogQuery:
+    def __init__(self):
+        self.equality = {}
+        self.ranges = {}
+        self.tags = []
+        self.search = None
+        self.ordering = None
+        self.window = None  # (first day, last day), both booked
+
+    @classmethod
+    def from_params(cls, params):
+        query = cls()
+        for field in ('category', 'language', 'condition'):
+            if params.get(field):
+                query.equality[field] = params[field]
+        if params.get('tags'):
+            query.tags = [t.strip() for t in params['tags'].split(',') if t.strip()]
+
+        price = {}
+        if params.get('min_price'):
+            price['gte'] = cls._decimal('min_price', params['min_price'])
+        if params.get('max_price'):
+            price['lte'] = cls._decimal('max_price', params['max_price'])
+        if price:
+            query.ranges['price_per_day'] = price
+
+        years = {}
+        if params.get('min_year'):
+            years['gte'] = cls._int('min_year', params['min_year'])
+        if params.get('max_year'):
+            years['lte'] = cls._int('max_year', params['max_year'])
+        if years:
+            query.ranges['work_year'] = years
+
+        if params.get('available_from') or params.get('available_to'):
+            query.window = cls._window(params.get('available_from'), params.get('available_to'))
+
+        query.search = params.get('search') or None
+        ordering = params.get('ordering')
+        if ordering:
+            if ordering.lstrip('-') not in ORDERINGS:
+                raise ValidationError({'ordering': f"Must be one of {', '.join(sorted(ORDERINGS))}"})
+            query.ordering = ordering
+        return query
+
+    @staticmethod
+    def _decimal(name, value):
+        try:
+            number = Decimal(value)
+        except InvalidOperation:
+            raise ValidationError({name: 'Must be a number'})
+        # NaN and Infinity parse, but can't be compared with stored prices
+        if not number.is_finite():
+            raise ValidationError({name: 'Must be a number'})
+        return number
+
+    @staticmethod
+    def _window(start, end):
+        """Days occupied by a rental from `start` up to `end` (YYYY-MM-DD, end exclusive)."""
+        days = {}
+        for name, value in (('available_from', start), ('available_to', end)):
+            try:
+                days[name] = parse_date(value or '')
+            except ValueError:
+                days[name] = None
+            if days[name] is None:
+                raise ValidationError({name: 'Must be a date (YYYY-MM-DD)'})
+        first, end = days['available_from'], days['available_to']
+        if end <= first:
+            raise ValidationError({'available_to': 'Must be after available_from'})
+        if end - first > timedelta(days=getattr(settings, 'RENTAL_MAX_DAYS', 90)):
+            raise ValidationError({'available_to': 'Rental period is too long'})
+        return first, end - timedelta(days=1)
+
+    @staticmethod
+    def _int(name, value):
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: 'Must be an integer'})
+
+    def _filters(self):
+        filters = dict(self.equality)
+        if self.tags:
+            filters['tags__all'] = self.tags
+        for field, bounds in self.ranges.items():
+            for op, value in bounds.items():
+                filters[f'{field}__{op}'] = value
+        return filters
+
+    def _search_filter(self):
+        prefixes = [re.compile('^' + re.escape(term)) for term in works.search_terms(self.search)]
+        return {'search_terms': {'$all': prefixes}}
+
+    def plan(self):
+        """Name of the catalog index that serves this query best, or None."""
+        equality_fields = set(self.equality)
+        if self.tags:
+            equality_fields.add('tags')
+        range_fields = set(self.ranges)
+        if self.search:
+            range_fields.add('search_terms')
+        best, best_score = None, 0
+        for name, keys in CATALOG_INDEXES:
+            score = 0
+            for key in keys:
+                if key in equality_fields:
+                    score += 1
+                    continue
+                if key in range_fields:
+                    score += 0.5
+                break
+            if score > best_score:
+                best, best_score = name, score
+        return best
+
+    def apply(self, queryset, hint=True):
+        """
+        `queryset` with the catalog filters and ordering. With `hint`, it also
+        runs on the planned index; leave it off when the caller adds filters
+        of its own, which another index may serve better.
+        """
+        queryset = queryset.filter(**self._filters())
+        if self.search:
+            queryset = queryset.filter(__raw__=self._search_filter())
+        if self.window:
+            queryset = queryset.filter(__raw__=availability.window_filter(*self.window), available_for_rent=True)
+        index = self.plan() if hint else None
+        if index:
+            queryset = queryset.hint(index)
+        if self.ordering:
+            queryset = queryset.order_by(self.ordering)
+        return queryset
+
+    def price_histogram(self, queryset, buckets=10):
+        """Price distribution of the matching books from one $bucketAuto aggregation."""
+        options = {}
+        index = self.plan()
+        if index:
+            options['hint'] = index
+        rows = Book._get_collection().aggregate([
+            {'$match': queryset._query},
+            {'$bucketAuto': {'groupBy': '$price_cents', 'buckets': buckets}},
+        ], **options)
+        cents = Book._fields['price_per_day']
+        return [
+            {
+                'min_price': str(cents.to_python(row['_id']['min'])),
+                'max_price': str(cents.to_python(row['_id']['max'])),
+                'count': row['count'],
+            }
+            for row in rows
+            if row['_id']['min'] is not None
+        ]
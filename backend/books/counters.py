@@ -0,0 +1,211 @@
+"""
+Write-behind counters for book views and list impressions.
+
+Counting with a $inc per request would add a write to the hottest book
+documents on every page load. Instead each process adds increments to an
+in-memory buffer keyed by (book, day) and a background thread writes the
+buffer out every COUNTERS_FLUSH_SECONDS: one unordered bulk_write of $inc
+upserts into the book's daily rollup, and one into its ranking score.
+
+Memory is bounded: reaching COUNTERS_MAX_KEYS wakes the flusher early, and
+while a slow database keeps the buffer at twice that, increments for new
+keys are dropped (and counted) instead of queued. A flush that fails puts
+its increments back to be retried. The buffer is flushed one last time at
+interpreter exit, so a worker that shuts down cleanly loses nothing; a
+killed one loses at most one interval.
+
+Counts are approximate by design: they are not deduplicated per visitor and
+a crashed process loses its buffer.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from . import analytics, rankings
+from .models import BookDailyRollup, BookScore
+
+logger = logging.getLogger(__name__)
+
+VIEWS = 'views'
+IMPRESSIONS = 'impressions'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class _Entry:
+    __slots__ = ('owner_id', 'category', 'views', 'impressions')
+
+    def __init__(self, owner_id, category):
+        self.owner_id = owner_id
+        self.category = category
+        self.views = 0
+        self.impressions = 0
+
+
+class CounterBuffer:
+    """Per-process buffer of (book id, day) -> pending view and impression counts."""
+
+    def __init__(self, flush_seconds, max_keys):
+        self.flush_seconds = flush_seconds
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}
+        self._oldest = None  # monotonic time of the oldest unflushed increment
+        self._pid = None
+        self.flushed = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.last_flush_at = None
+        self.last_flush_seconds = None
+
+    def _ensure_started(self):
+        # The flusher thread doesn't survive a fork; start one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending = {}
+            self._oldest = None
+            threading.Thread(target=self._run, daemon=True, name='counter-flush').start()
+
+    def add(self, book, kind, count=1):
+        """Count `count` views or impressions of `book` (needs pk, owner_id, category)."""
+        self._ensure_started()
+        key = (book.pk, analytics.day_of(timezone.now()))
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                if len(self._pending) >= 2 * self.max_keys:
+                    self.dropped += count
+                    return
+                entry = self._pending[key] = _Entry(book.owner_id, book.category or '')
+                if len(self._pending) >= self.max_keys:
+                    self._wake.set()
+            setattr(entry, kind, getattr(entry, kind) + count)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def _take(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._oldest = None
+        return pending
+
+    def _restore(self, pending):
+        """Put back the increments of a failed flush, as far as the bound allows."""
+        with self._lock:
+            for key, failed in pending.items():
+                entry = self._pending.get(key)
+                if entry is None:
+                    if len(self._pending) >= 2 * self.max_keys:
+                        self.dropped += failed.views + failed.impressions
+                        continue
+                    entry = self._pending[key] = _Entry(failed.owner_id, failed.category)
+                entry.views += failed.views
+                entry.impressions += failed.impressions
+            if self._pending and self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def flush(self):
+        """Write out everything buffered so far. Returns how many increments were written."""
+        with self._flush_lock:
+            pending = self._take()
+            if not pending:
+                return 0
+            started = time.monotonic()
+            try:
+                _write(BookDailyRollup._get_collection(), [
+                    UpdateOne(
+                        {'book': book_id, 'day': day},
+                        {
+                            '$inc': {VIEWS: entry.views, IMPRESSIONS: entry.impressions},
+                            '$setOnInsert': {'owner_id': entry.owner_id},
+                        },
+                        upsert=True
+                    )
+                    for (book_id, day), entry in pending.items()
+                ])
+            except Exception as e:
+                logger.error(f"Error flushing {len(pending)} buffered book counters: {str(e)}")
+                self.failed_flushes += 1
+                self._restore(pending)
+                return 0
+            scores = [
+                rankings.score_update(book_id, entry.category, 'view', entry.views)
+                for (book_id, _), entry in pending.items() if entry.views
+            ]
+            try:
+                if scores:
+                    _write(BookScore._get_collection(), scores)
+            except Exception as e:
+                # Not retried: the rollups are written, and popularity is approximate anyway
+                logger.error(f"Error adding buffered views to {len(scores)} book scores: {str(e)}")
+                self.failed_flushes += 1
+            written = sum(entry.views + entry.impressions for entry in pending.values())
+            self.flushed += written
+            self.last_flush_at = timezone.now()
+            self.last_flush_seconds = time.monotonic() - started
+            return written
+
+    def stats(self):
+        with self._lock:
+            pending_keys = len(self._pending)
+            pending = sum(entry.views + entry.impressions for entry in self._pending.values())
+            lag = time.monotonic() - self._oldest if self._oldest is not None else 0.0
+        return {
+            'pid': os.getpid(),
+            'pending_keys': pending_keys,
+            'pending_increments': pending,
+            'lag_seconds': round(lag, 3),
+            'flushed_increments': self.flushed,
+            'dropped_increments': self.dropped,
+            'failed_flushes': self.failed_flushes,
+            'last_flush_at': self.last_flush_at,
+            'last_flush_seconds': self.last_flush_seconds,
+        }
+
+
+def _write(collection, operations):
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Two processes upserting the same new (book, day): the loser retries as an update
+        errors = e.details['writeErrors']
+        if any(error['code'] != 11000 for error in errors):
+            raise
+        collection.bulk_write([operations[error['index']] for error in errors], ordered=False)
+
+
+buffer = CounterBuffer(
+    flush_seconds=_setting('COUNTERS_FLUSH_SECONDS', 5),
+    max_keys=_setting('COUNTERS_MAX_KEYS', 10000),
+)
+atexit.register(buffer.flush)
+
+
+def record_view(book):
+    buffer.add(book, VIEWS)
+
+
+def record_impressions(books):
+    for book in books:
+        buffer.add(book, IMPRESSIONS)
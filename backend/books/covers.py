@@ -0,0 +1,227 @@
+"""
+Cover image storage.
+
+Uploaded covers are stored under COVERS_ROOT by the SHA-256 of their bytes, so a
+file's URL never changes meaning and can be cached forever, and the same cover
+uploaded for many listings is stored once. Thumbnails are JPEGs rendered next to
+the original in a background process pool:
+
+    covers/ab/cd/abcd...ef.png      original
+    covers/ab/cd/abcd...ef-sm.jpg   thumbnail for COVER_THUMBNAIL_SIZES['sm']
+"""
+import atexit
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+COVER_PATH = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})(?:-(?P<size>[a-z]+))?\.(?P<ext>[a-z]+)$')
+
+
+class InvalidCover(Exception):
+    pass
+
+
+def thumbnail_sizes():
+    return getattr(settings, 'COVER_THUMBNAIL_SIZES', {'sm': 160, 'md': 320, 'lg': 640})
+
+
+def covers_root():
+    return getattr(settings, 'COVERS_ROOT', os.path.join(settings.MEDIA_ROOT, 'covers'))
+
+
+def covers_url():
+    return getattr(settings, 'COVERS_URL', settings.MEDIA_URL + 'covers/')
+
+
+def relative_path(digest, ext, size=None):
+    name = f"{digest}-{size}.jpg" if size else f"{digest}.{ext}"
+    return f"{digest[:2]}/{digest[2:4]}/{name}"
+
+
+def url_for(digest, ext, size=None):
+    return covers_url() + relative_path(digest, ext, size)
+
+
+def thumbnail_urls(digest, ext):
+    return {size: url_for(digest, ext, size) for size in thumbnail_sizes()}
+
+
+def parse_cover_url(url):
+    """(digest, ext) of a stored cover's URL, or None for external covers."""
+    prefix = covers_url()
+    if not url or not url.startswith(prefix):
+        return None
+    match = COVER_PATH.match(url[len(prefix):])
+    if not match or match.group('size'):
+        return None
+    return match.group('digest'), match.group('ext')
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def render_thumbnails(source, sizes):
+    """Write missing thumbnails of `source` for {name: max_edge}. Runs in a worker process."""
+    from PIL import Image
+
+    base = source.rsplit('.', 1)[0]
+    with Image.open(source) as image:
+        image = image.convert('RGB')
+        for name, edge in sizes.items():
+            target = f"{base}-{name}.jpg"
+            if os.path.exists(target):
+                continue
+            thumbnail = image.copy()
+            thumbnail.thumbnail((edge, edge * 3 // 2), Image.LANCZOS)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    thumbnail.save(f, 'JPEG', quality=82, optimize=True, progressive=True)
+                os.replace(tmp, target)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+
+class ThumbnailPool:
+    """Process pool that renders thumbnails off the request path."""
+
+    def __init__(self, workers, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def submit(self, source, sizes):
+        future = self._get_executor().submit(render_thumbnails, source, sizes)
+        future.add_done_callback(_log_failure)
+        return future
+
+    def render(self, source, sizes):
+        """Render now and wait, for a thumbnail requested before the background job ran."""
+        try:
+            self.submit(source, sizes).result(timeout=self.timeout)
+            return True
+        except TimeoutError:
+            logger.error(f"Thumbnail rendering timed out for {source}")
+        except Exception:
+            pass  # already logged by the done callback
+        return False
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Error rendering thumbnails: {str(future.exception())}")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThumbnailPool(
+                    workers=getattr(settings, 'COVER_THUMBNAIL_WORKERS', 2),
+                    timeout=getattr(settings, 'COVER_THUMBNAIL_TIMEOUT', 10),
+                )
+                atexit.register(_pool.shutdown)
+    return _pool
+
+
+def store(upload):
+    """
+    Store an uploaded cover and queue its thumbnails.
+
+    Returns (digest, ext). Raises InvalidCover for files that are too large,
+    images of more than COVER_MAX_PIXELS pixels, or files that aren't an image
+    in one of FORMATS.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    max_bytes = getattr(settings, 'COVER_MAX_UPLOAD_BYTES', 5 * 1024 * 1024)
+    if upload.size > max_bytes:
+        raise InvalidCover(f"Cover images must be at most {max_bytes // (1024 * 1024)} MB")
+
+    max_pixels = getattr(settings, 'COVER_MAX_PIXELS', 40_000_000)
+    too_large = InvalidCover(f"Cover images must be at most {max_pixels // 1_000_000} megapixels")
+    data = upload.read()
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+            ext = FORMATS.get(image.format)
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise too_large
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        ext = None
+    if ext is None:
+        raise InvalidCover(f"Cover must be one of: {', '.join(sorted(FORMATS))}")
+    # Only the header has been read; a small file can still decode to a huge image
+    if width * height > max_pixels:
+        raise too_large
+
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.join(covers_root(), relative_path(digest, ext))
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    get_pool().submit(path, thumbnail_sizes())
+    return digest, ext
+
+
+def resolve(relative):
+    """
+    Absolute path of a stored cover or thumbnail, rendering a missing thumbnail
+    on the spot. None if it doesn't exist.
+    """
+    match = COVER_PATH.match(relative)
+    if not match:
+        return None
+    path = os.path.join(covers_root(), relative)
+    if os.path.exists(path):
+        return path
+    size = match.group('size')
+    if size not in thumbnail_sizes():
+        return None
+    directory = os.path.dirname(path)
+    originals = [
+        name for name in (os.listdir(directory) if os.path.isdir(directory) else [])
+        if name.startswith(match.group('digest') + '.')
+    ]
+    if not originals or not get_pool().render(os.path.join(directory, originals[0]), thumbnail_sizes()):
+        return None
+    return path if os.path.exists(path) else None
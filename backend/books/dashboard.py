@@ -0,0 +1,84 @@
+"""
+Rental dashboard: every rentals view a user needs in one aggregation.
+
+The user's rentals are matched once (renter_id or book_owner_id, both indexed)
+and split into buckets with $facet, each with its own keyset cursor and limit.
+"""
+from django.utils import timezone
+
+from .models import Book, BookRental
+from .pagination import after, decode_cursor, encode_cursor
+
+BUCKETS = ('my_rentals', 'rental_requests', 'active', 'overdue')
+
+
+def _bucket_match(bucket, user_id, now):
+    return {
+        'my_rentals': {'renter_id': user_id},
+        'rental_requests': {'book_owner_id': user_id, 'status': 'PENDING'},
+        'active': {'status': 'ACTIVE'},
+        'overdue': {'status': 'ACTIVE', 'rental_end_date': {'$lt': now}},
+    }[bucket]
+
+
+def _bucket_pipeline(match, cursor, limit):
+    stages = [{'$match': match}]
+    if cursor:
+        created_at, last_id = decode_cursor(cursor, 2)
+        stages.append({'$match': after('created_at', created_at, last_id)})
+    stages += [
+        {'$sort': {'created_at': -1, '_id': -1}},
+        {'$limit': limit + 1},
+        {'$lookup': {'from': Book._get_collection_name(), 'localField': 'book', 'foreignField': '_id', 'as': '_book'}},
+    ]
+    return stages
+
+
+def _bucket_condition(bucket, user_id, now):
+    """The same test as _bucket_match, as an expression for counting."""
+    return {
+        'my_rentals': {'$eq': ['$renter_id', user_id]},
+        'rental_requests': {'$and': [{'$eq': ['$book_owner_id', user_id]}, {'$eq': ['$status', 'PENDING']}]},
+        'active': {'$eq': ['$status', 'ACTIVE']},
+        'overdue': {'$and': [{'$eq': ['$status', 'ACTIVE']}, {'$lt': ['$rental_end_date', now]}]},
+    }[bucket]
+
+
+def _load(doc):
+    book_docs = doc.pop('_book', [])
+    rental = BookRental._from_son(doc)
+    if book_docs:
+        rental.book = Book._from_son(book_docs[0])
+    return rental
+
+
+def build(user_id, cursors, limit, buckets=BUCKETS):
+    now = timezone.now()
+    facets = {
+        bucket: _bucket_pipeline(_bucket_match(bucket, user_id, now), cursors.get(bucket), limit)
+        for bucket in buckets
+    }
+    counts = {'_id': None}
+    counts.update({
+        bucket: {'$sum': {'$cond': [_bucket_condition(bucket, user_id, now), 1, 0]}}
+        for bucket in buckets
+    })
+    facets['counts'] = [{'$group': counts}]
+
+    result = next(BookRental._get_collection().aggregate([
+        {'$match': {'$or': [{'renter_id': user_id}, {'book_owner_id': user_id}]}},
+        {'$facet': facets},
+    ]))
+
+    totals = result['counts'][0] if result['counts'] else {}
+    dashboard = {}
+    for bucket in buckets:
+        docs = result[bucket]
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        dashboard[bucket] = {
+            'count': totals.get(bucket, 0),
+            'results': [_load(doc) for doc in docs],
+            'next_cursor': encode_cursor(docs[-1]['created_at'], docs[-1]['_id']) if has_more else None,
+        }
+    return dashboard
@@ -0,0 +1,318 @@
+"""
+Columnar export of rentals, reviews and listings for offline analytics.
+
+Each dataset is streamed from a raw pymongo cursor with a projection of the
+exported fields and written as Parquet, one file per month of `updated_at`
+and run:
+
+    <output>/<dataset>/month=YYYY-MM/part-<run>.parquet
+
+Reads go to a secondary when the deployment has one (secondaryPreferred)
+and walk the `updated_at` index, so every month is one index range and
+months are exported in parallel by a process pool. Memory per process is
+bounded by the row group size: rows are converted and written a row group
+at a time.
+
+Exports are incremental. `<output>/_watermarks.json` holds, per dataset, the
+`updated_at` up to which everything has been exported; a run exports what
+changed after it and moves it forward only once every month has been
+written. A document changed since the last run is exported again, so
+readers keep the row with the latest updated_at per id. The upper bound of
+a run trails the clock by EXPORT_SETTLE_SECONDS so writes in flight and
+replication lag can't slip under the watermark.
+
+Only writes that set updated_at are picked up: counters maintained in
+place (helpful votes, ratings, copies, views) are refreshed by a full run.
+A full run, or one whose watermark is older than the archive age, also
+reads the archive tiers.
+
+pyarrow is imported on use, so web processes don't load it.
+"""
+import glob
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from pymongo import ASCENDING, ReadPreference
+
+from . import archive
+from .models import Book, BookRental, BookReview
+
+WATERMARKS = '_watermarks.json'
+
+
+class Dataset:
+    def __init__(self, name, document, columns, tier=None):
+        self.name = name
+        self.document = document
+        self.columns = columns  # [(field in MongoDB, column type)]
+        self.tier = tier
+
+    def collection(self):
+        return self.document._get_collection().with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    def cold(self):
+        return self.tier.cold.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    def projection(self):
+        return {field: 1 for field, _ in self.columns}
+
+
+# Column types: 'id' (ObjectId or legacy string), 'str', 'int', 'float', 'bool', 'time', 'strings'
+DATASETS = {dataset.name: dataset for dataset in (
+    Dataset('rentals', BookRental, [
+        ('_id', 'id'), ('legacy_id', 'str'), ('book', 'id'), ('renter_id', 'int'), ('book_owner_id', 'int'),
+        ('status', 'str'), ('payment_status', 'str'), ('owner_approval', 'bool'), ('total_price', 'float'),
+        ('rental_start_date', 'time'), ('rental_end_date', 'time'), ('return_date', 'time'),
+        ('created_at', 'time'), ('updated_at', 'time'),
+    ], tier=archive.RENTALS),
+    Dataset('reviews', BookReview, [
+        ('_id', 'id'), ('legacy_id', 'str'), ('book', 'id'), ('reviewer_id', 'int'), ('rating', 'int'),
+        ('review_text', 'str'), ('helpful_votes', 'int'), ('reported', 'bool'), ('hidden', 'bool'),
+        ('reported_at', 'time'), ('created_at', 'time'), ('updated_at', 'time'),
+    ], tier=archive.REVIEWS),
+    Dataset('books', Book, [
+        ('_id', 'id'), ('legacy_id', 'str'), ('isbn', 'str'), ('owner_id', 'int'), ('category', 'str'),
+        ('language', 'str'), ('condition', 'str'), ('tags', 'strings'), ('price_cents', 'int'),
+        ('total_copies', 'int'), ('copies_available', 'int'), ('available_for_rent', 'bool'),
+        ('rating', 'float'), ('total_ratings', 'int'), ('created_at', 'time'), ('updated_at', 'time'),
+    ]),
+)}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _arrow_type(kind):
+    import pyarrow as pa
+    return {
+        'id': pa.string(),
+        'str': pa.string(),
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'bool': pa.bool_(),
+        'time': pa.timestamp('ms', tz='UTC'),
+        'strings': pa.list_(pa.string()),
+    }[kind]
+
+
+def schema(dataset):
+    import pyarrow as pa
+    return pa.schema([(field.lstrip('_'), _arrow_type(kind)) for field, kind in dataset.columns])
+
+
+def _convert(kind, value):
+    """One MongoDB value as its column type; None for missing or malformed values."""
+    if value is None:
+        return None
+    try:
+        if kind in ('id', 'str'):
+            return str(value)
+        if kind == 'int':
+            return int(value)
+        if kind == 'float':
+            return float(value)
+        if kind == 'bool':
+            return bool(value)
+        if kind == 'time':
+            # pymongo returns naive UTC datetimes
+            return value if value.tzinfo else value.replace(tzinfo=dt_timezone.utc)
+        return [str(item) for item in value]
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def read_watermarks(output):
+    try:
+        with open(os.path.join(output, WATERMARKS)) as f:
+            return {name: datetime.fromisoformat(value) for name, value in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def write_watermark(output, name, value):
+    watermarks = read_watermarks(output)
+    watermarks[name] = value
+    path = os.path.join(output, WATERMARKS)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({key: when.isoformat() for key, when in watermarks.items()}, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def _month_start(when):
+    return when.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(when):
+    return _month_start(_month_start(when) + timedelta(days=32))
+
+
+def _naive(when):
+    return when.astimezone(dt_timezone.utc).replace(tzinfo=None) if when.tzinfo else when
+
+
+def _range(since, until):
+    query = {'$lte': _naive(until)}
+    if since is not None:
+        query['$gt'] = _naive(since)
+    return query
+
+
+def partitions(dataset, since, until, include_archive):
+    """
+    First days of the months of updated_at in (since, until], from the oldest
+    change on, found on the updated_at indexes.
+    """
+    query = {'updated_at': _range(since, until)}
+    collections = [dataset.collection()] + ([dataset.cold()] if include_archive else [])
+    oldest = [
+        doc['updated_at'] for doc in (
+            collection.find_one(query, {'updated_at': 1}, sort=[('updated_at', ASCENDING)])
+            for collection in collections
+        ) if doc is not None
+    ]
+    if not oldest:
+        return []
+    month = _month_start(min(oldest).replace(tzinfo=dt_timezone.utc))
+    months = []
+    while month <= until:
+        months.append(month)
+        month = _next_month(month)
+    return months
+
+
+def includes_archive(dataset, since, until):
+    if dataset.tier is None:
+        return False
+    if since is None:
+        return True
+    age = dataset.tier.age()
+    # Anything archived since the last run had been exported while hot
+    return age is not None and since < until - age
+
+
+def _rows(dataset, query, include_archive, batch_size):
+    yield from dataset.collection().find(
+        query, dataset.projection(), batch_size=batch_size
+    ).hint([('updated_at', ASCENDING)])
+    if include_archive:
+        for packed in dataset.cold().find(query, batch_size=batch_size):
+            yield archive.unpack(packed)
+
+
+def _table(dataset, rows, arrow_schema):
+    import pyarrow as pa
+    columns = [[_convert(kind, row.get(field)) for row in rows] for field, kind in dataset.columns]
+    return pa.Table.from_arrays(
+        [pa.array(values, type=column.type) for values, column in zip(columns, arrow_schema)],
+        schema=arrow_schema
+    )
+
+
+def export_month(name, month, since, until, output, run, include_archive, batch_size, row_group_size):
+    """
+    Write the documents of dataset `name` changed in `month` and in
+    (since, until] to one Parquet file. Returns (rows written, path or None
+    when there were none).
+    """
+    import pyarrow.parquet as pq
+
+    dataset = DATASETS[name]
+    query = {'$and': [
+        {'updated_at': {'$gte': _naive(month), '$lt': _naive(_next_month(month))}},
+        {'updated_at': _range(since, until)},
+    ]}
+    directory = os.path.join(output, name, f"month={month:%Y-%m}")
+    path = os.path.join(directory, f"part-{run}.parquet")
+    arrow_schema = schema(dataset)
+    writer = None
+    written = 0
+    rows = []
+    try:
+        for row in _rows(dataset, query, include_archive, batch_size):
+            rows.append(row)
+            if len(rows) >= row_group_size:
+                writer = writer or _writer(pq, directory, path, arrow_schema)
+                writer.write_table(_table(dataset, rows, arrow_schema))
+                written += len(rows)
+                rows = []
+        if rows:
+            writer = writer or _writer(pq, directory, path, arrow_schema)
+            writer.write_table(_table(dataset, rows, arrow_schema))
+            written += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        return 0, None
+    os.replace(path + '.tmp', path)
+    return written, path
+
+
+def _writer(pq, directory, path, arrow_schema):
+    os.makedirs(directory, exist_ok=True)
+    return pq.ParquetWriter(
+        path + '.tmp', arrow_schema, compression=_setting('EXPORT_PARQUET_COMPRESSION', 'zstd')
+    )
+
+
+def _remove_run(output, name, run):
+    for path in glob.glob(os.path.join(output, name, 'month=*', f"part-{run}.parquet*")):
+        os.remove(path)
+
+
+def _init_worker():
+    # The parent's MongoClient must not be used across the fork
+    from backend import mongo
+    mongo.reconnect()
+
+
+def export(name, output, full=False, workers=None, batch_size=None, row_group_size=None, log=None):
+    """
+    Export the documents of dataset `name` changed since its watermark (all
+    of them when `full`). Returns (rows written, [paths]).
+    """
+    log = log or (lambda message: None)
+    dataset = DATASETS[name]
+    os.makedirs(output, exist_ok=True)
+    since = None if full else read_watermarks(output).get(name)
+    until = datetime.now(dt_timezone.utc) - timedelta(seconds=_setting('EXPORT_SETTLE_SECONDS', 300))
+    if since is not None and since >= until:
+        return 0, []
+    include_archive = includes_archive(dataset, since, until)
+    run = f"{until:%Y%m%dT%H%M%S}"
+    months = partitions(dataset, since, until, include_archive)
+    arguments = [
+        (name, month, since, until, output, run, include_archive,
+         batch_size or _setting('EXPORT_BATCH_SIZE', 1000),
+         row_group_size or _setting('EXPORT_ROW_GROUP_SIZE', 50000))
+        for month in months
+    ]
+
+    try:
+        if (workers or 1) > 1 and len(arguments) > 1:
+            # Forked workers inherit the configured Django settings
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('fork'), initializer=_init_worker
+            )
+            with pool:
+                results = list(pool.map(export_month, *zip(*arguments)))
+        else:
+            results = [export_month(*args) for args in arguments]
+    except BaseException:
+        # Leave no part of a failed run behind; the next one exports the same range
+        _remove_run(output, name, run)
+        raise
+
+    total, paths = 0, []
+    for month, (written, path) in zip(months, results):
+        if path is not None:
+            log(f"{name} {month:%Y-%m}: {written} rows")
+            total += written
+            paths.append(path)
+    write_watermark(output, name, until)
+    return total, paths
@@ -0,0 +1,45 @@
+from decimal import Decimal, InvalidOperation
+
+from mongoengine import IntField
+
+CENT = Decimal('0.01')
+
+
+class CentsField(IntField):
+    """
+    A money amount exposed as a Decimal and stored as integer cents.
+
+    Integers compare exactly and index compactly, so price range scans have no
+    float rounding at the boundaries. Query values are converted the same way.
+    """
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        if isinstance(value, int):
+            return (Decimal(value) * CENT).quantize(CENT)
+        try:
+            return Decimal(str(value)).quantize(CENT)
+        except InvalidOperation:
+            return value
+
+    def to_mongo(self, value):
+        if value is None:
+            return None
+        return int((Decimal(str(value)) / CENT).to_integral_value())
+
+    def validate(self, value):
+        try:
+            value = Decimal(str(value))
+        except InvalidOperation:
+            self.error(f"{value} could not be converted to a decimal")
+        if self.min_value is not None and value < self.min_value:
+            self.error("Amount value is too small")
+        if self.max_value is not None and value > self.max_value:
+            self.error("Amount value is too large")
+
+    def prepare_query_value(self, op, value):
+        if value is None:
+            return value
+        if isinstance(value, (list, tuple)):
+            return [self.to_mongo(v) for v in value]
+        return self.to_mongo(value)
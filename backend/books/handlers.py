@@ -0,0 +1,117 @@
+"""
+Outbox handlers: the derived updates that follow a rental or review change.
+
+Each receives the outbox event document and must be safe to run more than once.
+Counters go through outbox.guard() via `event_id`; inventory release is keyed by
+the rental holding the copy; realtime pushes may repeat and carry the rental's
+current status, so clients treat them as hints to refresh. Recommendation
+co-occurrences are approximate between full rebuilds anyway. Booking calendar
+changes are guarded like the counters.
+"""
+from datetime import timezone as dt_timezone
+
+from . import analytics, availability, inventory, rankings, ratings, realtime, recommendations
+from .models import Book, BookRental, BookReview
+from .outbox import handler
+
+RENTAL_REQUESTED = 'rental.requested'
+RENTAL_APPROVED = 'rental.approved'
+RENTAL_REJECTED = 'rental.rejected'
+RENTAL_RETURNED = 'rental.returned'
+REVIEW_CREATED = 'review.created'
+REVIEW_HELPFUL_VOTE = 'review.helpful_vote'
+REVIEW_HIDDEN = 'review.hidden'
+REVIEW_RESTORED = 'review.restored'
+
+
+def _when(event):
+    # pymongo returns naive UTC datetimes
+    return event['created_at'].replace(tzinfo=dt_timezone.utc)
+
+
+def _rental(event):
+    payload = event['payload']
+    query = {'id': payload['rental_id']}
+    if 'renter_id' in payload:
+        query['renter_id'] = payload['renter_id']  # shard key; older events lack it
+    return BookRental.objects(**query).first()
+
+
+def _transition(event, kind):
+    rental = _rental(event)
+    if rental is None:
+        return None
+    analytics.record_transition(rental, kind, when=_when(event), event_id=event['_id'])
+    realtime.publish(rental, kind)
+    return rental
+
+
+def _calendar(rental, delta, event):
+    availability.change(
+        rental.to_mongo()['book'], rental.book_owner_id, rental.rental_start_date, rental.rental_end_date, delta,
+        event_id=event['_id']
+    )
+
+
+@handler(RENTAL_REQUESTED)
+def rental_requested(event):
+    rental = _transition(event, analytics.REQUESTED)
+    if rental is not None:
+        _calendar(rental, 1, event)
+
+
+@handler(RENTAL_APPROVED)
+def rental_approved(event):
+    rental = _transition(event, analytics.APPROVED)
+    if rental is not None:
+        rankings.record_event(rental.book, 'rental', when=_when(event), event_id=event['_id'])
+
+
+@handler(RENTAL_REJECTED)
+def rental_rejected(event):
+    rental = _transition(event, analytics.REJECTED)
+    if rental is not None:
+        _calendar(rental, -1, event)
+
+
+@handler(RENTAL_RETURNED)
+def rental_returned(event):
+    rental = _rental(event)
+    if rental is None:
+        return
+    inventory.release_copy(event['payload']['book_id'], rental.pk, rental.book_owner_id)
+    _calendar(rental, -1, event)
+    recommendations.record_completed_rental(rental.renter_id, rental.book, event_id=event['_id'])
+    analytics.record_transition(rental, analytics.RETURNED, when=_when(event), event_id=event['_id'])
+    realtime.publish(rental, analytics.RETURNED)
+
+
+@handler(REVIEW_CREATED)
+def review_created(event):
+    payload = event['payload']
+    ratings.adjust(payload['book_id'], payload['rating'], event_id=event['_id'])
+    book = Book.objects(id=payload['book_id']).only('category').first()
+    if book is not None:
+        rankings.record_event(book, 'review', when=_when(event), event_id=event['_id'])
+
+
+@handler(REVIEW_HELPFUL_VOTE)
+def review_helpful_vote(event):
+    review = BookReview._get_collection().find_one({'_id': event['payload']['review_id']}, {'book': 1})
+    if review is None:
+        return
+    book = Book.objects(id=review['book']).only('category').first()
+    if book is not None:
+        rankings.record_event(book, 'helpful_vote', when=_when(event), event_id=event['_id'])
+
+
+@handler(REVIEW_HIDDEN)
+def review_hidden(event):
+    payload = event['payload']
+    ratings.adjust(payload['book_id'], payload['rating'], -1, event_id=event['_id'])
+
+
+@handler(REVIEW_RESTORED)
+def review_restored(event):
+    payload = event['payload']
+    ratings.adjust(payload['book_id'], payload['rating'], event_id=event['_id'])
@@ -0,0 +1,99 @@
+"""
+Idempotency-Key support for create and state-transition endpoints.
+
+The first request with a key claims it by inserting a record; retries with the
+same key and payload get the stored response back from a single _id lookup
+without running the view again. Records expire through a TTL index.
+"""
+import functools
+import hashlib
+import json
+import logging
+
+import orjson
+from pymongo.errors import DuplicateKeyError
+from rest_framework import status
+from rest_framework.response import Response
+
+from backend.renderers import dumps
+
+from .models import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, default=str) if request.data else ''
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.path}\n".encode('utf-8'))
+    digest.update(payload.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _replay(record):
+    response = Response(record.body.get('data'), status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """Make a viewset method safe to retry when the client sends an Idempotency-Key."""
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        record_key = f"{request.user.id or 'anonymous'}:{key}"
+        request_fingerprint = fingerprint(request)
+        collection = IdempotencyRecord._get_collection()
+        try:
+            collection.insert_one(
+                IdempotencyRecord(key=record_key, fingerprint=request_fingerprint).to_mongo()
+            )
+        except DuplicateKeyError:
+            record = IdempotencyRecord.objects(key=record_key).first()
+            if record is None:
+                # Expired between the insert and the read; run normally
+                return view_method(self, request, *args, **kwargs)
+            if record.fingerprint != request_fingerprint:
+                return Response(
+                    {'error': f'{HEADER} was already used with a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if record.state != 'done':
+                return Response(
+                    {'error': 'A request with this key is still being processed'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            return _replay(record)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            collection.delete_one({'_id': record_key})
+            raise
+
+        if response.status_code >= 500:
+            # Let the client retry failures for real
+            collection.delete_one({'_id': record_key})
+            return response
+        try:
+            data = orjson.loads(dumps(response.data))
+            collection.update_one(
+                {'_id': record_key},
+                {'$set': {'state': 'done', 'status_code': response.status_code, 'body': {'data': data}}}
+            )
+        except Exception as e:
+            logger.error(f"Error storing idempotent response: {str(e)}")
+            collection.delete_one({'_id': record_key})
+        return response
+    return wrapper
@@ -0,0 +1,52 @@
+"""
+Public ids.
+
+Documents are keyed by 12-byte, time-ordered ObjectIds and exposed in URLs as
+their 24-character hex form. Documents migrated from the old UUID string keys
+keep that string in `legacy_id`, so old links still resolve. Until
+`manage.py migrate_compact_ids` has finished, unmigrated documents still have
+the UUID as their _id, so a non-hex id matches either.
+"""
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+def parse_id(value):
+    """ObjectId for a hex id, or None if `value` isn't one."""
+    if isinstance(value, ObjectId):
+        return value
+    try:
+        return ObjectId(str(value))
+    except (InvalidId, TypeError):
+        return None
+
+
+def query(value):
+    """Raw filter that finds a document by its public id."""
+    object_id = parse_id(value)
+    if object_id is not None:
+        return {'_id': object_id}
+    return {'$or': [{'_id': str(value)}, {'legacy_id': str(value)}]}
+
+
+def lookup(value):
+    """Query kwargs that find a document by its public id."""
+    object_id = parse_id(value)
+    if object_id is not None:
+        return {'id': object_id}
+    return {'__raw__': query(value)}
+
+
+def parse_ids(values):
+    """ObjectIds for the values that are valid ids, in order."""
+    return [object_id for object_id in map(parse_id, values) if object_id is not None]
+
+
+def query_many(values):
+    """Raw filter that finds the documents with any of these public ids."""
+    values = [str(value) for value in values]
+    legacy = [value for value in values if parse_id(value) is None]
+    object_ids = parse_ids(values)
+    if not legacy:
+        return {'_id': {'$in': object_ids}}
+    return {'$or': [{'_id': {'$in': object_ids + legacy}}, {'legacy_id': {'$in': legacy}}]}
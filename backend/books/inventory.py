@@ -0,0 +1,100 @@
+from django.utils import timezone
+
+from . import availability
+from .models import Book, BookCopy
+
+
+class InventoryConflict(Exception):
+    """Raised when an inventory change raced with another writer."""
+
+
+def build_copies(count, start=1):
+    return [BookCopy(number=n) for n in range(start, start + count)]
+
+
+def _book(book_id, owner_id):
+    # owner_id is the books shard key: with it the update goes to one shard
+    return Book.objects(id=book_id) if owner_id is None else Book.objects(id=book_id, owner_id=owner_id)
+
+
+def reserve_copy(book_id, rental_id, owner_id=None):
+    """
+    Claim one available copy of `book_id` for `rental_id`.
+
+    A single conditional update: the `copies_available > 0` guard and the
+    positional match on an available copy make it safe under concurrent
+    approvals. Returns True if a copy was reserved.
+    """
+    updated = _book(book_id, owner_id).filter(
+        copies_available__gt=0,
+        copies__state=BookCopy.AVAILABLE
+    ).update_one(
+        dec__copies_available=1,
+        set__copies__S__state=BookCopy.RENTED,
+        set__copies__S__rental_id=str(rental_id),
+        set__updated_at=timezone.now()
+    )
+    return updated == 1
+
+
+def release_copy(book_id, rental_id, owner_id=None):
+    """Return the copy held by `rental_id` to the pool. Returns True if one was held."""
+    updated = _book(book_id, owner_id).filter(
+        copies__rental_id=str(rental_id)
+    ).update_one(
+        inc__copies_available=1,
+        set__copies__S__state=BookCopy.AVAILABLE,
+        unset__copies__S__rental_id=True,
+        set__updated_at=timezone.now()
+    )
+    return updated == 1
+
+
+def resize(book, total):
+    """
+    Change the number of copies of `book` to `total`.
+
+    New copies are appended as available; shrinking only removes copies that
+    are not currently rented. Guarded on the previous `total_copies` so two
+    concurrent edits can't both apply.
+    """
+    current = book.total_copies or len(book.copies)
+    if total == current:
+        return
+    collection = Book._get_collection()
+    now = timezone.now()
+
+    if total > current:
+        next_number = max([c.number for c in book.copies] or [0]) + 1
+        added = [c.to_mongo() for c in build_copies(total - current, next_number)]
+        result = collection.update_one(
+            {'_id': book.pk, 'owner_id': book.owner_id, 'total_copies': current},
+            {
+                '$push': {'copies': {'$each': added}},
+                '$inc': {'total_copies': total - current, 'copies_available': total - current},
+                '$set': {'updated_at': now},
+            }
+        )
+    else:
+        removable = [c.number for c in reversed(book.copies) if c.state == BookCopy.AVAILABLE]
+        removed = removable[:current - total]
+        if len(removed) < current - total:
+            raise InventoryConflict("Cannot remove copies that are currently rented")
+        result = collection.update_one(
+            {
+                '_id': book.pk,
+                'owner_id': book.owner_id,
+                'total_copies': current,
+                'copies': {'$all': [{'$elemMatch': {'n': n, 's': BookCopy.AVAILABLE}} for n in removed]},
+            },
+            {
+                '$pull': {'copies': {'n': {'$in': removed}}},
+                '$inc': {'total_copies': -len(removed), 'copies_available': -len(removed)},
+                '$set': {'updated_at': now},
+            }
+        )
+
+    if result.modified_count != 1:
+        raise InventoryConflict("Inventory changed while resizing, please retry")
+    availability.refresh_masks(book.pk, book.owner_id)
+    book.reload()
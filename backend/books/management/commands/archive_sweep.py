@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from books import archive
+
+
+class Command(BaseCommand):
+    help = "Move finished rentals and old reviews from the hot collections into their archives"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['all'] + sorted(archive.TIERS), default='all')
+        parser.add_argument(
+            '--older-than-days', type=int, default=None,
+            help="Override ARCHIVE_RENTALS_AFTER_DAYS / ARCHIVE_REVIEWS_AFTER_DAYS"
+        )
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'ARCHIVE_BATCH_SIZE', 500))
+        parser.add_argument('--report', action='store_true', help="Print hot collection and index sizes before and after")
+        parser.add_argument(
+            '--compact', action='store_true',
+            help="Run compact on the hot collections afterwards so the freed space is returned"
+        )
+
+    def handle(self, *args, **options):
+        tiers = archive.TIERS.values() if options['kind'] == 'all' else [archive.TIERS[options['kind']]]
+        older_than = timedelta(days=options['older_than_days']) if options['older_than_days'] else None
+
+        for tier in tiers:
+            if older_than is None and tier.age() is None:
+                self.stdout.write(f"{tier.name}: archiving disabled ({tier.age_setting} is 0)")
+                continue
+            if options['report']:
+                before = archive.collection_report(tier)
+
+            moved = archive.sweep(tier, older_than, options['batch_size'], log=self.stdout.write)
+            if options['compact']:
+                tier.hot.database.command('compact', tier.hot.name)
+            self.stdout.write(self.style.SUCCESS(f"{tier.name}: moved {moved} documents to {tier.cold.name}"))
+
+            if options['report']:
+                self.print_report(tier, before, archive.collection_report(tier))
+
+    def print_report(self, tier, before, after):
+        def change(old, new):
+            return f"{old:,} -> {new:,}" + (f" ({1 - new / old:.1%} smaller)" if old else "")
+
+        self.stdout.write(f"{tier.hot.name}: documents {change(before['count'], after['count'])}")
+        self.stdout.write(f"  data bytes {change(before['size'], after['size'])}")
+        self.stdout.write(f"  index bytes {change(before['total_index_size'], after['total_index_size'])}")
+        for name, size in sorted(before['index_sizes'].items()):
+            self.stdout.write(f"    {name}: {change(size, after['index_sizes'].get(name, 0))}")
+        if not before['total_index_size'] > after['total_index_size']:
+            self.stdout.write("  (WiredTiger keeps freed pages for reuse; pass --compact to return them)")
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from books import analytics
+from books.models import BookRental
+
+
+class Command(BaseCommand):
+    help = "Rebuild owner and book daily rollups from book_rentals in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First creation date to include (YYYY-MM-DD)")
+        parser.add_argument('--end', help="Creation date to stop before (YYYY-MM-DD)")
+        parser.add_argument('--batch-days', type=int, default=30)
+        parser.add_argument(
+            '--reset', action='store_true',
+            help="Clear existing rental counters first (needed for an exact rebuild)"
+        )
+
+    def _date(self, value, fallback):
+        if not value:
+            return fallback
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError(f"Invalid date: {value}")
+        return datetime(parsed.year, parsed.month, parsed.day)
+
+    def handle(self, *args, **options):
+        first = BookRental.objects.order_by('created_at').only('created_at').first()
+        if first is None:
+            self.stdout.write("No rentals to backfill")
+            return
+        start = self._date(options['start'], analytics.day_of(first.created_at))
+        end = self._date(options['end'], datetime.utcnow())
+        total = analytics.backfill(
+            start, end,
+            batch_days=options['batch_days'],
+            reset=options['reset'],
+            log=self.stdout.write
+        )
+        self.stdout.write(self.style.SUCCESS(f"Applied {total} rollup updates"))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from books.inventory import build_copies
+from books.models import Book, BookCopy, BookRental
+
+
+class Command(BaseCommand):
+    help = "Give books created before multi-copy inventory a copies array"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        collection = Book._get_collection()
+        migrated = 0
+        cursor = collection.find(
+            {'copies': {'$exists': False}},
+            {'_id': 1},
+            batch_size=options['batch_size']
+        )
+        for doc in cursor:
+            copies = build_copies(1)
+            active = BookRental.objects(book=doc['_id'], status='ACTIVE').only('id').first()
+            if active:
+                copies[0].state = BookCopy.RENTED
+                copies[0].rental_id = str(active.pk)
+            # available_for_rent used to double as "currently rented"; it is now
+            # only the owner's listing switch, so restore it.
+            collection.update_one(
+                {'_id': doc['_id'], 'copies': {'$exists': False}},
+                {'$set': {
+                    'copies': [c.to_mongo() for c in copies],
+                    'total_copies': 1,
+                    'copies_available': 0 if active else 1,
+                    'available_for_rent': True,
+                }}
+            )
+            migrated += 1
+        self.stdout.write(self.style.SUCCESS(f"Backfilled inventory for {migrated} books"))
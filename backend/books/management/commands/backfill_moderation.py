@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from books import moderation
+
+
+class Command(BaseCommand):
+    help = "Set reported_at on reviews reported before the moderation queue, so they are listed in report order"
+
+    def handle(self, *args, **options):
+        updated = moderation.backfill_reported_at()
+        self.stdout.write(self.style.SUCCESS(f"Queued {updated} previously reported reviews"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from books import works
+
+
+class Command(BaseCommand):
+    help = "Copy publication year and title/author search terms from works onto their listings for catalog filtering"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        synced = works.sync_all_listings(options['batch_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"Synced the listings of {synced} works"))
@@ -0,0 +1,56 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from books import booking, inventory
+from books.models import Book, BookRental
+
+
+class Command(BaseCommand):
+    help = "Measure booking throughput for many renters requesting the same popular book"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--days', type=int, default=7)
+
+    def _book(self, renter_id, book_id, days):
+        started = time.perf_counter()
+        try:
+            booking.request_rental_for_days(book_id, renter_id, days)
+            ok = True
+        except booking.BookingError:
+            ok = False
+        return ok, time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        book = Book(
+            isbn=str(int(time.time() * 1000))[-13:],
+            owner_id=-1,
+            price_per_day=Decimal('1.50'),
+            copies=inventory.build_copies(1),
+            copies_available=1
+        ).save()
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                results = list(pool.map(
+                    lambda renter: self._book(renter, book.pk, options['days']),
+                    range(1, options['requests'] + 1)
+                ))
+            elapsed = time.perf_counter() - started
+        finally:
+            BookRental.objects(book=book).delete()
+            book.delete()
+
+        latencies = sorted(latency * 1000 for _, latency in results)
+        succeeded = sum(1 for ok, _ in results if ok)
+        self.stdout.write(
+            f"{len(results)} bookings ({succeeded} created) at concurrency {options['concurrency']}: "
+            f"{len(results) / elapsed:,.0f} req/s, "
+            f"p50 {statistics.median(latencies):.1f} ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.1f} ms"
+        )
@@ -0,0 +1,61 @@
+import io
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from backend import compression
+from backend.renderers import ORJSONParser, ORJSONRenderer
+from books.models import Book
+from books.serializers import BookSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare JSON rendering/parsing and response compression on a large BookSerializer payload"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=10000, help="Books in the rendered list")
+        parser.add_argument('--sample', type=int, default=500, help="Distinct books serialized from the database")
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def _time(self, fn, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - started)
+        return best, result
+
+    def handle(self, *args, **options):
+        sample = BookSerializer(Book.objects.limit(options['sample']), many=True).data
+        if not sample:
+            raise CommandError("No books in the database to serialize")
+        data = [sample[i % len(sample)] for i in range(options['items'])]
+        repeat = options['repeat']
+
+        self.stdout.write(f"{len(data)} books ({len(sample)} distinct), best of {repeat}")
+        for name, renderer, parser in (
+            ('json', JSONRenderer(), JSONParser()),
+            ('orjson', ORJSONRenderer(), ORJSONParser()),
+        ):
+            render_time, body = self._time(lambda: renderer.render(data), repeat)
+            parse_time, _ = self._time(lambda: parser.parse(io.BytesIO(body)), repeat)
+            self.stdout.write(
+                f"{name:>7}: render {render_time * 1000:8.1f} ms ({len(body) / render_time / 1e6:6.1f} MB/s), "
+                f"parse {parse_time * 1000:8.1f} ms, {len(body):,} bytes"
+            )
+
+        for encoding in compression._available():
+            compress_time, compressed = self._time(
+                lambda: compression._compressed(body, compression.CODECS[encoding]()), repeat
+            )
+            self.stdout.write(
+                f"{encoding:>7}: {len(compressed):,} bytes ({len(compressed) / len(body):.1%}), "
+                f"{compress_time * 1000:.1f} ms ({len(body) / compress_time / 1e6:.1f} MB/s)"
+            )
+        missing = set(settings.COMPRESSION_ENCODINGS) - set(compression._available())
+        if missing:
+            self.stdout.write(f"not installed: {', '.join(sorted(missing))}")
+
@@ -0,0 +1,37 @@
+import resource
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.recommendations import build_similarity
+
+
+class Command(BaseCommand):
+    help = "Benchmark the similarity build on synthetic rental history (no database needed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000_000)
+        parser.add_argument('--renters', type=int, default=1_000_000)
+        parser.add_argument('--books', type=int, default=200_000)
+        parser.add_argument('--top-n', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        import numpy as np
+
+        rng = np.random.default_rng(options['seed'])
+        # Popularity follows a power law, as real rental traffic does
+        book_codes = (rng.zipf(1.3, options['rows']) - 1) % options['books']
+        renter_codes = rng.integers(0, options['renters'], options['rows'])
+
+        started = time.monotonic()
+        neighbours, _ = build_similarity(renter_codes, book_codes, options['books'], options['top_n'])
+        elapsed = time.monotonic() - started
+
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        with_neighbours = sum(1 for columns, _ in neighbours if len(columns))
+        self.stdout.write(
+            f"rows={options['rows']} books={options['books']} renters={options['renters']}\n"
+            f"build: {elapsed:.2f}s ({options['rows'] / elapsed:,.0f} rows/s), "
+            f"peak RSS {peak_mb:,.0f} MB, {with_neighbours} books with neighbours"
+        )
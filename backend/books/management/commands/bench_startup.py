@@ -0,0 +1,110 @@
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: time each loading phase up to a first request
+PHASES = r"""
+import json, os, sys, time
+started = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+import django
+from django.conf import settings
+settings.INSTALLED_APPS
+loaded_settings = time.perf_counter()
+django.setup()
+set_up = time.perf_counter()
+from backend import startup
+startup.warm()
+warmed = time.perf_counter()
+from django.test import Client
+host = next((h for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+response = Client().get(sys.argv[1], HTTP_HOST=host)
+answered = time.perf_counter()
+print(json.dumps({
+    'settings': loaded_settings - started,
+    'setup': set_up - loaded_settings,
+    'warmup': warmed - set_up,
+    'first_request': answered - warmed,
+    'status': response.status_code,
+}))
+"""
+
+PHASE_NAMES = ('settings', 'setup', 'warmup', 'first_request')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = "Measure cold start: per-phase load time and time to first response of a freshly started server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--path', default='/api/auth/csrf/', help="Endpoint of the first request")
+        parser.add_argument('--server', choices=['uvicorn', 'gunicorn', 'none'], default='uvicorn')
+        parser.add_argument('--timeout', type=float, default=60)
+
+    def handle(self, *args, **options):
+        runs = [self.phases(options['path']) for _ in range(options['runs'])]
+        for name in PHASE_NAMES:
+            self.report(name, [run[name] for run in runs])
+        self.report('in-process total', [sum(run[name] for name in PHASE_NAMES) for run in runs])
+
+        if options['server'] != 'none':
+            timings = [self.time_to_first_response(options) for _ in range(options['runs'])]
+            self.report(f"{options['server']} time to first response", timings)
+
+    def report(self, name, seconds):
+        ms = sorted(value * 1000 for value in seconds)
+        self.stdout.write(
+            f"{name:>32}: median {statistics.median(ms):8.1f} ms, min {ms[0]:8.1f} ms, max {ms[-1]:8.1f} ms"
+        )
+
+    def phases(self, path):
+        result = subprocess.run(
+            [sys.executable, '-c', PHASES, path],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, env=dict(os.environ)
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Startup script failed:\n{result.stderr}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def time_to_first_response(self, options):
+        port = _free_port()
+        if options['server'] == 'uvicorn':
+            command = [sys.executable, '-m', 'uvicorn', 'backend.asgi:application',
+                       '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+        else:
+            command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                       '--bind', f'127.0.0.1:{port}', '--workers', '1', 'backend.asgi:application']
+        url = f"http://127.0.0.1:{port}{options['path']}"
+
+        started = time.perf_counter()
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            while time.perf_counter() - started < options['timeout']:
+                if process.poll() is not None:
+                    raise CommandError(f"Server exited:\n{process.stderr.read().decode()}")
+                try:
+                    urllib.request.urlopen(url, timeout=1).read()
+                    return time.perf_counter() - started
+                except urllib.error.HTTPError:
+                    return time.perf_counter() - started  # any answer counts
+                except (urllib.error.URLError, ConnectionError):
+                    time.sleep(0.01)
+            raise CommandError(f"No response from {url} within {options['timeout']}s")
+        finally:
+            process.terminate()
+            process.wait()
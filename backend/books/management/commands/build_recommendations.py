@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from books import recommendations
+
+
+class Command(BaseCommand):
+    help = "Rebuild item-item recommendation neighbours from the full rental history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        built = recommendations.rebuild(options['batch_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f"Built neighbours for {built} books in {time.monotonic() - started:.1f}s"
+        ))
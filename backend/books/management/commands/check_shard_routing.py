@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from books import sharding
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = "Explain the hot-path queries through mongos and report how many shards each one reaches"
+
+    def handle(self, *args, **options):
+        if not sharding.is_mongos(Book._get_db()):
+            raise CommandError("MONGO_URI must point at a mongos router")
+        report = sharding.check_routing()
+        if not report:
+            raise CommandError("No books or rentals to build the sample queries from")
+
+        broadcast = 0
+        for description, collection, stage, reached, total in report:
+            line = f"{collection:<14} {description:<38} {stage:<14} {reached}/{total} shards"
+            if stage == 'SINGLE_SHARD':
+                self.stdout.write(line)
+            else:
+                broadcast += 1
+                self.stdout.write(self.style.WARNING(line))
+        if broadcast:
+            raise CommandError(f"{broadcast} hot-path queries are not targeted to a single shard")
+        self.stdout.write(self.style.SUCCESS("Every hot-path query targets a single shard"))
@@ -0,0 +1,161 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from books import works
+from books.models import Book, Work
+
+
+def _isbn13(number):
+    body = f"978{number:09d}"
+    return body + works.isbn13_check_digit(body)
+
+
+def _isbn10(isbn13):
+    body = isbn13[3:12]
+    return body + works.isbn10_check_digit(body)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move title, author, description, cover and publication year from listings "
+        "into shared works keyed by normalized ISBN-13"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--report', action='store_true', help="Print working-set sizes before and after")
+        parser.add_argument(
+            '--simulate', type=int, default=0,
+            help="Only run the dedupe on N synthetic listings in scratch collections and report the sizes"
+        )
+        parser.add_argument('--works', type=int, default=0, help="Distinct works in the simulation (default N / 10)")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['simulate']:
+            self.simulate(options['simulate'], options['works'] or max(options['simulate'] // 10, 1), options)
+            return
+
+        books = Book._get_collection()
+        work_collection = Work._get_collection()
+        if options['report']:
+            before = self.sizes(books, work_collection)
+
+        # ISBN was unique on its own; listings of one work by different owners need (isbn, owner_id)
+        if books.index_information().get('isbn_1', {}).get('unique'):
+            books.drop_index('isbn_1')
+        Book.ensure_indexes()
+        Work.ensure_indexes()
+
+        moved, conflicts = works.dedupe(books, work_collection, options['batch_size'], log=self.stdout.write)
+        # Indexes on fields that moved to works
+        for index in ('title_1', 'catalog_year_price'):
+            if index in books.index_information():
+                books.drop_index(index)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} listings onto {work_collection.estimated_document_count()} works"
+        ))
+        for book_id in conflicts:
+            self.stdout.write(self.style.WARNING(
+                f"Listing {book_id} duplicates another listing of the same work by its owner; kept its ISBN"
+            ))
+        if options['report']:
+            self.print_sizes(before, self.sizes(books, work_collection))
+
+    def sizes(self, books, work_collection):
+        sizes = {}
+        for collection in (books, work_collection):
+            stats = collection.database.command('collStats', collection.name)
+            sizes[collection.name] = {
+                'data': stats.get('size', 0),
+                'indexes': stats.get('totalIndexSize', 0),
+                'title index': sum(size for name, size in stats.get('indexSizes', {}).items() if name.startswith('title')),
+            }
+        return sizes
+
+    def print_sizes(self, before, after):
+        totals = [0, 0]
+        for name in before:
+            for i, sizes in enumerate((before[name], after[name])):
+                totals[i] += sizes['data'] + sizes['indexes']
+            self.stdout.write(
+                f"{name}: data {before[name]['data']:,} -> {after[name]['data']:,} bytes, "
+                f"indexes {before[name]['indexes']:,} -> {after[name]['indexes']:,} bytes, "
+                f"title index {before[name]['title index']:,} -> {after[name]['title index']:,} bytes"
+            )
+        reduction = 1 - totals[1] / totals[0] if totals[0] else 0
+        self.stdout.write(f"working set {totals[0]:,} -> {totals[1]:,} bytes ({reduction:.1%} smaller)")
+
+    def simulate(self, listings, distinct, options):
+        rng = random.Random(options['seed'])
+        database = Book._get_db()
+        books = database['bench_dedupe_books']
+        work_collection = database['bench_dedupe_works']
+        books.drop()
+        work_collection.drop()
+
+        def words(count):
+            return ' '.join(
+                ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(count)
+            )
+
+        catalogue = [
+            {
+                'isbn': _isbn13(n),
+                'title': words(rng.randint(2, 7)).title()[:200],
+                'author': words(2).title(),
+                'description': words(rng.randint(60, 220)),
+                'cover_image': f"https://covers.example.com/{_isbn13(n)}-L.jpg",
+                'publication_year': rng.randint(1900, 2024),
+            }
+            for n in range(distinct)
+        ]
+        # Popular titles are listed by many owners: power-law popularity
+        weights = [1 / (rank + 1) ** 1.1 for rank in range(distinct)]
+        batch = []
+        for owner_id, work in enumerate(rng.choices(catalogue, weights=weights, k=listings), start=1):
+            listing = dict(work)
+            if rng.random() < 0.3:
+                listing['isbn'] = _isbn10(work['isbn'])  # older listings often use ISBN-10
+            listing.update({
+                'owner_id': owner_id,
+                'available_for_rent': True,
+                'price_cents': rng.randint(50, 900),
+                'total_copies': 1,
+                'copies_available': 1,
+                'copies': [{'n': 1, 's': 'A'}],
+                'category': rng.choice(['Fiction', 'Science', 'History', 'Children', 'Travel']),
+                'language': 'English',
+                'condition': rng.choice(['NEW', 'GOOD', 'FAIR']),
+                'tags': [],
+                'rating': 0,
+                'total_ratings': 0,
+            })
+            batch.append(listing)
+            if len(batch) == 5000:
+                books.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            books.insert_many(batch, ordered=False)
+        books.create_index('title')
+        books.create_index([('isbn', 1), ('owner_id', 1)], unique=True)
+        work_collection.create_index('title')
+
+        before = self.sizes(books, work_collection)
+        started = time.perf_counter()
+        works.dedupe(books, work_collection, options['batch_size'])
+        elapsed = time.perf_counter() - started
+        books.drop_index('title_1')
+        after = self.sizes(books, work_collection)
+
+        self.stdout.write(
+            f"{listings:,} listings of {work_collection.estimated_document_count():,} works, "
+            f"dedupe took {elapsed:.1f}s"
+        )
+        self.print_sizes(before, after)
+        books.drop()
+        work_collection.drop()
@@ -0,0 +1,53 @@
+import inspect
+
+from django.core.management.base import BaseCommand, CommandError
+from mongoengine import Document
+
+from books import archive
+from books import models as book_models
+from users import models as user_models
+
+
+def documents():
+    for module in (book_models, user_models):
+        for _, cls in inspect.getmembers(module, inspect.isclass):
+            if issubclass(cls, Document) and cls.__module__ == module.__name__ and not cls._meta.get('abstract'):
+                yield cls
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the indexes declared on every Document and the archive collections. "
+        "Run at deploy time: indexes are not created on first use."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report missing and undeclared indexes; exit non-zero if any are missing"
+        )
+
+    def handle(self, *args, **options):
+        missing_total = 0
+        for document in documents():
+            name = f"{document.__name__} ({document._get_collection_name()})"
+            if options['check']:
+                diff = document.compare_indexes()
+                missing_total += len(diff['missing'])
+                for spec in diff['missing']:
+                    self.stdout.write(self.style.WARNING(f"{name}: missing {spec}"))
+                for spec in diff['extra']:
+                    self.stdout.write(f"{name}: not declared {spec}")
+            else:
+                document.ensure_indexes()
+                self.stdout.write(f"{name}: {len(document.list_indexes())} indexes")
+
+        if not options['check']:
+            for tier in archive.TIERS.values():
+                tier.ensure_indexes()
+                self.stdout.write(f"{tier.cold.name}: {len(tier.indexes)} indexes")
+            self.stdout.write(self.style.SUCCESS("Indexes are in place"))
+        elif missing_total:
+            raise CommandError(f"{missing_total} declared indexes are missing; run ensure_indexes")
+        else:
+            self.stdout.write(self.style.SUCCESS("All declared indexes exist"))
@@ -0,0 +1,36 @@
+import importlib.util
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books import export
+
+
+class Command(BaseCommand):
+    help = (
+        "Export rentals, reviews and listings changed since the last run to Parquet files "
+        "partitioned by month, reading from a secondary when there is one"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Directory of the export; holds the watermarks of earlier runs")
+        parser.add_argument('--dataset', choices=['all'] + sorted(export.DATASETS), default='all')
+        parser.add_argument('--full', action='store_true', help="Ignore the watermarks and export everything")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Months exported in parallel")
+        parser.add_argument('--batch-size', type=int, default=None, help="Cursor batch size (EXPORT_BATCH_SIZE)")
+        parser.add_argument(
+            '--row-group-size', type=int, default=None,
+            help="Rows held in memory per worker and written per row group (EXPORT_ROW_GROUP_SIZE)"
+        )
+
+    def handle(self, *args, **options):
+        if importlib.util.find_spec('pyarrow') is None:
+            raise CommandError("pyarrow is required: pip install pyarrow")
+        names = sorted(export.DATASETS) if options['dataset'] == 'all' else [options['dataset']]
+        for name in names:
+            written, paths = export.export(
+                name, options['output'], full=options['full'], workers=options['workers'],
+                batch_size=options['batch_size'], row_group_size=options['row_group_size'],
+                log=self.stdout.write
+            )
+            self.stdout.write(self.style.SUCCESS(f"{name}: {written} rows in {len(paths)} files"))
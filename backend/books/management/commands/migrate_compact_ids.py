@@ -0,0 +1,175 @@
+import calendar
+import os
+import struct
+import time
+import uuid
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand
+from pymongo import UpdateMany
+from pymongo.errors import BulkWriteError
+
+from books import ids
+from books.models import (
+    Book, BookDailyRollup, BookNeighbours, BookRental, BookReview, BookScore, UserProfile
+)
+
+# Collections whose `book` field references books._id
+BOOK_REFERENCES = [BookRental, BookReview, BookScore, BookNeighbours, BookDailyRollup]
+
+
+def time_ordered_id(created_at):
+    """ObjectId whose timestamp is the document's creation time, so migrated ids stay ordered."""
+    # pymongo returns naive UTC datetimes
+    seconds = calendar.timegm(created_at.utctimetuple()) if created_at else int(time.time())
+    return ObjectId(struct.pack('>I', seconds) + os.urandom(8))
+
+
+def legacy_copy(doc):
+    """The document under a new time-ordered id, keeping the old key in legacy_id."""
+    new_id = time_ordered_id(doc.get('created_at'))
+    return new_id, dict(doc, _id=new_id, legacy_id=doc['_id'])
+
+
+def profile_copy(doc):
+    # Profiles already hold ObjectId hex strings; only the BSON type changes
+    new_id = ids.parse_id(doc['_id']) or time_ordered_id(doc.get('joined_date'))
+    return new_id, dict(doc, _id=new_id)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite UUID string primary keys as ObjectIds, online and in batches, "
+        "keeping the old key in legacy_id and updating references"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--report', action='store_true', help="Print collection and index sizes before and after")
+        parser.add_argument(
+            '--bench-inserts', type=int, default=0,
+            help="Only compare insert throughput and _id index size of N UUID vs ObjectId keys in scratch collections"
+        )
+
+    def handle(self, *args, **options):
+        if options['bench_inserts']:
+            self.bench_inserts(options['bench_inserts'])
+            return
+
+        collections = [Book, BookRental, BookReview, UserProfile]
+        if options['report']:
+            before = {doc: self.stats(doc) for doc in collections}
+
+        self.migrate(Book, options['batch_size'], self.rewrite_book_references)
+        self.migrate(BookRental, options['batch_size'], self.rewrite_rental_references)
+        self.migrate(BookReview, options['batch_size'])
+        self.migrate(UserProfile, options['batch_size'], copy=profile_copy)
+
+        if options['report']:
+            for doc in collections:
+                self.print_stats(doc, before[doc], self.stats(doc))
+
+    def migrate(self, document, batch_size, rewrite_references=None, copy=legacy_copy):
+        """
+        Move documents to new ids through a journal so an interrupted run can
+        resume: journal the copy, delete the old document (unique indexes such as
+        isbn or a profile's username would reject a second copy), insert the new
+        one, rewrite references, then clear the journal entry.
+        """
+        collection = document._get_collection()
+        journal = collection.database['id_migration_journal']
+        migrated = 0
+
+        pending = list(journal.find({'collection': collection.name}))
+        if pending:
+            self.stdout.write(f"{collection.name}: resuming {len(pending)} journaled documents")
+            self.apply(collection, journal, pending, rewrite_references)
+
+        while True:
+            batch = list(collection.find({'_id': {'$type': 'string'}}).limit(batch_size))
+            if not batch:
+                break
+            entries = []
+            for doc in batch:
+                new_id, new_doc = copy(doc)
+                entries.append({
+                    '_id': f"{collection.name}:{doc['_id']}",
+                    'collection': collection.name,
+                    'old': doc['_id'],
+                    'new': new_id,
+                    'doc': new_doc,
+                })
+            journal.insert_many(entries, ordered=False)
+            self.apply(collection, journal, entries, rewrite_references)
+
+            migrated += len(batch)
+            self.stdout.write(f"{collection.name}: {migrated} migrated")
+
+    def apply(self, collection, journal, entries, rewrite_references):
+        collection.delete_many({'_id': {'$in': [entry['old'] for entry in entries]}})
+        try:
+            collection.insert_many([entry['doc'] for entry in entries], ordered=False)
+        except BulkWriteError as e:
+            # Documents inserted by an interrupted run are already in place
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+        if rewrite_references:
+            rewrite_references({entry['old']: entry['new'] for entry in entries})
+        journal.delete_many({'_id': {'$in': [entry['_id'] for entry in entries]}})
+
+    def rewrite_book_references(self, mapping):
+        for document in BOOK_REFERENCES:
+            document._get_collection().bulk_write(
+                [UpdateMany({'book': old}, {'$set': {'book': new}}) for old, new in mapping.items()],
+                ordered=False
+            )
+        BookNeighbours._get_collection().bulk_write([
+            UpdateMany(
+                {'neighbours.book': old},
+                {'$set': {'neighbours.$[n].book': new}},
+                array_filters=[{'n.book': old}]
+            )
+            for old, new in mapping.items()
+        ], ordered=False)
+
+    def rewrite_rental_references(self, mapping):
+        # Inventory copies remember the rental holding them by its string id
+        Book._get_collection().bulk_write([
+            UpdateMany(
+                {'copies.r': old},
+                {'$set': {'copies.$[c].r': str(new)}},
+                array_filters=[{'c.r': old}]
+            )
+            for old, new in mapping.items()
+        ], ordered=False)
+
+    def stats(self, document):
+        collection = document._get_collection()
+        return collection.database.command('collStats', collection.name)
+
+    def print_stats(self, document, before, after):
+        self.stdout.write(
+            f"{document._get_collection_name()}: "
+            f"avg doc {before.get('avgObjSize', 0)} -> {after.get('avgObjSize', 0)} bytes, "
+            f"_id index {before['indexSizes'].get('_id_', 0)} -> {after['indexSizes'].get('_id_', 0)} bytes, "
+            f"all indexes {before['totalIndexSize']} -> {after['totalIndexSize']} bytes"
+        )
+
+    def bench_inserts(self, count, batch_size=1000):
+        database = Book._get_db()
+        for label, make_id in (('uuid4 string', lambda: str(uuid.uuid4())), ('ObjectId', ObjectId)):
+            collection = database[f'bench_ids_{label.split()[0].lower()}']
+            collection.drop()
+            started = time.perf_counter()
+            for start in range(0, count, batch_size):
+                collection.insert_many(
+                    [{'_id': make_id(), 'n': i} for i in range(start, min(start + batch_size, count))],
+                    ordered=False
+                )
+            elapsed = time.perf_counter() - started
+            stats = database.command('collStats', collection.name)
+            self.stdout.write(
+                f"{label:<13} {count / elapsed:10,.0f} inserts/s  "
+                f"_id index {stats['indexSizes']['_id_']:,} bytes"
+            )
+            collection.drop()
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = "Convert float price_per_day values to integer price_cents"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        collection = Book._get_collection()
+        converted = 0
+        while True:
+            ids = [
+                doc['_id'] for doc in
+                collection.find({'price_per_day': {'$exists': True}}, {'_id': 1}).limit(options['batch_size'])
+            ]
+            if not ids:
+                break
+            result = collection.update_many(
+                {'_id': {'$in': ids}, 'price_per_day': {'$exists': True}},
+                [
+                    {'$set': {'price_cents': {'$toLong': {'$round': [
+                        {'$multiply': [{'$ifNull': ['$price_per_day', 0]}, 100]}, 0
+                    ]}}}},
+                    {'$unset': 'price_per_day'},
+                ]
+            )
+            converted += result.modified_count
+        self.stdout.write(self.style.SUCCESS(f"Converted {converted} prices to cents"))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from books import availability
+from books.models import BookRental
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild every book's booking calendar from the open rentals, or with --prune "
+        "only drop months that have ended"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--prune', action='store_true', help="Only drop past months (safe while serving)")
+
+    def handle(self, *args, **options):
+        if options['prune']:
+            pruned = availability.prune()
+            self.stdout.write(self.style.SUCCESS(f"Pruned past months from {pruned} books"))
+            return
+        # Run with the outbox workers stopped: events applied during the rebuild
+        # would be counted again on top of it
+        applied = availability.rebuild(
+            BookRental._get_collection(), options['batch_size'], log=self.stdout.write
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt booking calendars from {applied} open rentals"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from books import ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute per-book rating counters from book_reviews"
+
+    def handle(self, *args, **options):
+        updated = ratings.recount()
+        self.stdout.write(self.style.SUCCESS(f"Recounted ratings for {updated} books"))
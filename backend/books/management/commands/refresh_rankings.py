@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from books import rankings
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized trending and top-rated lists per category"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=50)
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help="Keep running and refresh every N seconds (0 runs once)"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            refreshed = rankings.refresh_all(options['top_k'])
+            self.stdout.write(
+                f"Refreshed rankings for {refreshed} categories in {time.monotonic() - started:.2f}s"
+            )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,50 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from books import outbox
+
+
+class Command(BaseCommand):
+    help = "Apply outbox events (ratings, rankings, inventory, analytics, push) in the background"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'OUTBOX_WORKERS', 4))
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--poll-interval', type=float, default=getattr(settings, 'OUTBOX_POLL_INTERVAL', 0.2),
+            help="Seconds to wait after a round that found nothing to do"
+        )
+        parser.add_argument('--once', action='store_true', help="Drain until empty, then exit")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        if not options['once']:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda *_: stop.set())
+
+        def work():
+            while not stop.is_set():
+                try:
+                    processed = outbox.drain(options['batch_size'])
+                except Exception as e:
+                    self.stderr.write(f"Outbox round failed: {str(e)}")
+                    processed = 0
+                if not processed:
+                    if options['once']:
+                        return
+                    stop.wait(options['poll_interval'])
+
+        threads = [
+            threading.Thread(target=work, name=f'outbox-{i}', daemon=True)
+            for i in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Started {len(threads)} outbox workers")
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+        self.stdout.write(self.style.SUCCESS("Outbox workers stopped"))
@@ -0,0 +1,109 @@
+import os
+import shutil
+import signal
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import MongoClient
+
+PID_FILE = 'cluster.pids'
+
+
+def _wait_for(port, timeout=30):
+    client = MongoClient(port=port, serverSelectionTimeoutMS=500, directConnection=True)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            client.admin.command('ping')
+            return client
+        except Exception:
+            if time.monotonic() > deadline:
+                raise CommandError(f"Nothing answering on port {port}")
+            time.sleep(0.5)
+
+
+def _initiate(client, name, port, configsvr=False):
+    config = {'_id': name, 'members': [{'_id': 0, 'host': f'localhost:{port}'}]}
+    if configsvr:
+        config['configsvr'] = True
+    client.admin.command('replSetInitiate', config)
+    # Wait for the single member to become primary
+    while not client.admin.command('isMaster').get('ismaster'):
+        time.sleep(0.5)
+
+
+class Command(BaseCommand):
+    help = (
+        "Start (or stop) a local sharded cluster for setup_sharding and check_shard_routing: "
+        "a config server, N single-node shard replica sets and a mongos. Needs mongod and mongos on PATH."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['start', 'stop'])
+        parser.add_argument('--shards', type=int, default=2)
+        parser.add_argument('--port', type=int, default=27100, help="mongos port; the others follow it")
+        parser.add_argument('--dbpath', default='.cluster')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'stop':
+            self.stop(options['dbpath'])
+        else:
+            self.start(options['shards'], options['port'], options['dbpath'])
+
+    def spawn(self, dbpath, name, command):
+        log_path = os.path.join(dbpath, f'{name}.log')
+        with open(log_path, 'ab') as log:
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        with open(os.path.join(dbpath, PID_FILE), 'a') as pids:
+            pids.write(f"{process.pid}\n")
+
+    def mongod(self, dbpath, name, port, role):
+        data = os.path.join(dbpath, name)
+        os.makedirs(data, exist_ok=True)
+        self.spawn(dbpath, name, [
+            'mongod', role, '--replSet', name, '--port', str(port), '--dbpath', data, '--bind_ip', 'localhost',
+        ])
+
+    def start(self, shards, port, dbpath):
+        for binary in ('mongod', 'mongos'):
+            if shutil.which(binary) is None:
+                raise CommandError(f"{binary} not found on PATH")
+        if os.path.exists(os.path.join(dbpath, PID_FILE)):
+            raise CommandError(f"A cluster is already running from {dbpath}; stop it first")
+        os.makedirs(dbpath, exist_ok=True)
+
+        config_port = port + 1
+        self.mongod(dbpath, 'config', config_port, '--configsvr')
+        _initiate(_wait_for(config_port), 'config', config_port, configsvr=True)
+        shard_ports = []
+        for number in range(shards):
+            name, shard_port = f'shard{number}', port + 2 + number
+            self.mongod(dbpath, name, shard_port, '--shardsvr')
+            _initiate(_wait_for(shard_port), name, shard_port)
+            shard_ports.append((name, shard_port))
+            self.stdout.write(f"{name}: localhost:{shard_port}")
+
+        self.spawn(dbpath, 'mongos', [
+            'mongos', '--configdb', f'config/localhost:{config_port}', '--port', str(port), '--bind_ip', 'localhost',
+        ])
+        router = _wait_for(port, timeout=60)
+        for name, shard_port in shard_ports:
+            router.admin.command('addShard', f'{name}/localhost:{shard_port}')
+        self.stdout.write(self.style.SUCCESS(
+            f"mongos on localhost:{port}; run with MONGO_URI=mongodb://localhost:{port}/book_renting"
+        ))
+
+    def stop(self, dbpath):
+        pid_path = os.path.join(dbpath, PID_FILE)
+        if not os.path.exists(pid_path):
+            raise CommandError(f"No cluster running from {dbpath}")
+        with open(pid_path) as pids:
+            # mongos first, config server last
+            for pid in reversed([int(line) for line in pids if line.strip()]):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        os.remove(pid_path)
+        self.stdout.write(self.style.SUCCESS("Cluster stopped"))
@@ -1,19 +1,60 @@
-from mongoengine import Document, StringField, IntField, DecimalField, BooleanField, DateTimeField, ReferenceField, ListField, DictField, URLField
+from mongoengine import Document, EmbeddedDocument, EmbeddedDocumentField, ObjectIdField, StringField, IntField, DecimalField, FloatField, BooleanField, DateTimeField, ReferenceField, ListField, DictField, URLField
 from django.utils import timezone
-import uuid
 from bson import ObjectId
+from .fields import CentsField
 
-class Book(Document):
-    book_id = StringField(primary_key=True, default=lambda: str(uuid.uuid4()))
+class BookCopy(EmbeddedDocument):
+    """
+    One physical copy of a listing. Kept deliberately small since every copy is
+    embedded in the book document: short field names and a one-letter state.
+    """
+    AVAILABLE = 'A'
+    RENTED = 'R'
+
+    number = IntField(db_field='n', required=True)
+    state = StringField(db_field='s', max_length=1, default=AVAILABLE)
+    rental_id = StringField(db_field='r')
+
+
+class Work(Document):
+    """Bibliographic metadata shared by every listing of the same ISBN."""
+    isbn = StringField(primary_key=True, max_length=13)  # normalized ISBN-13
     title = StringField(required=True, max_length=200)
     author = StringField(required=True, max_length=200)
     description = StringField()
-    isbn = StringField(required=True, max_length=13, unique=True)
     cover_image = URLField()
     publication_year = IntField()
-    owner_id = IntField(required=True)  # Reference to Django User model
+    created_at = DateTimeField(default=timezone.now)
+    updated_at = DateTimeField(default=timezone.now)
+
+    meta = {
+        'collection': 'works',
+        # Indexes are created by `manage.py ensure_indexes`, not on first use
+        'auto_create_index': False,
+        'indexes': [
+            'title',
+            'publication_year'
+        ]
+    }
+
+    def __str__(self):
+        return f"{self.title} by {self.author}"
+
+
+def _work_attribute(name):
+    return property(lambda self: getattr(self.work, name, None))
+
+
+class Book(Document):
+    book_id = ObjectIdField(primary_key=True, default=ObjectId)
+    legacy_id = StringField()  # UUID string key from before compact ids
+    isbn = StringField(required=True, max_length=13)  # Work key
+    owner_id = IntField(required=True, unique_with='isbn')  # Reference to Django User model; shard key
     available_for_rent = BooleanField(default=True)
-    price_per_day = DecimalField(precision=2, min_value=0)
+    price_per_day = CentsField(db_field='price_cents', min_value=0)
+    total_copies = IntField(default=1, min_value=1)
+    copies_available = IntField(default=1, min_value=0)
+    copies = ListField(EmbeddedDocumentField(BookCopy))
     
     category = StringField(max_length=100)
     language = StringField(max_length=50, default='English')
@@ -22,31 +63,68 @@ class Book(Document):
     location = DictField()
     rating = DecimalField(precision=2, default=0.0)
     total_ratings = IntField(default=0)
+    rating_sum = IntField(default=0)
+    rating_counts = DictField()  # {'1': n, ..., '5': n}
+    applied_events = ListField(ObjectIdField())  # recent outbox events already counted
+    calendar = DictField()  # per-month booked days, see books/availability.py
+    # Copied from the work for catalog filtering, see works.listing_fields
+    work_year = IntField()
+    search_terms = ListField(StringField())
     
     created_at = DateTimeField(default=timezone.now)
     updated_at = DateTimeField(default=timezone.now)
 
     meta = {
         'collection': 'books',
+        'auto_create_index': False,
+        # Listings not yet moved by dedupe_works still carry the old metadata fields
+        'strict': False,
+        # See books/sharding.py; (owner_id, isbn) uniqueness is prefixed by it
+        'shard_key': ('owner_id',),
         'indexes': [
-            'title',
+            '#owner_id',
+            # The unique (owner_id, isbn) index can't serve lookups by ISBN
+            # alone (works.update_metadata, ISBN search, dedupe_works)
             'isbn',
-            'category',
+            {'fields': ['legacy_id'], 'sparse': True},
             'available_for_rent',
-            'owner_id'
+            ('copies_available', 'available_for_rent'),
+            # Catalog filtering; see books/catalog.py for how one is chosen
+            {'fields': ('category', 'price_per_day'), 'name': 'catalog_category_price'},
+            {'fields': ('language', 'condition', 'price_per_day'), 'name': 'catalog_language_condition_price'},
+            {'fields': ('condition', 'price_per_day'), 'name': 'catalog_condition_price'},
+            {'fields': ('tags', 'price_per_day'), 'name': 'catalog_tags_price'},
+            {'fields': ('price_per_day',), 'name': 'catalog_price'},
+            {'fields': ('search_terms', 'price_per_day'), 'name': 'catalog_terms_price'},
+            {'fields': ('work_year', 'price_per_day'), 'name': 'catalog_work_year_price'},
+            'updated_at',  # incremental analytics export, books/export.py
         ]
     }
 
+    title = _work_attribute('title')
+    author = _work_attribute('author')
+    description = _work_attribute('description')
+    cover_image = _work_attribute('cover_image')
+    publication_year = _work_attribute('publication_year')
+
+    @property
+    def work(self):
+        from . import works
+        return works.get(self.isbn)
+
     def __str__(self):
         return f"{self.title} by {self.author}"
 
 class BookRental(Document):
-    rental_id = StringField(primary_key=True, default=lambda: str(uuid.uuid4()))
+    rental_id = ObjectIdField(primary_key=True, default=ObjectId)
+    legacy_id = StringField()  # UUID string key from before compact ids
     book = ReferenceField(Book, required=True)
     renter_id = IntField(required=True)  # Reference to Django User model
+    book_owner_id = IntField()  # Copied from the book so owner queries don't need a join
     rental_start_date = DateTimeField(required=True)
     rental_end_date = DateTimeField(required=True)
     return_date = DateTimeField()
+    approved_at = DateTimeField()  # when the rental.approved event was written
     status = StringField(default='PENDING')
     total_price = DecimalField(precision=2)
     owner_approval = BooleanField(default=False)
@@ -58,17 +136,33 @@ class BookRental(Document):
     payment_status = StringField(default='PENDING')
     payment_details = DictField()
     communication_history = ListField(DictField())
+    outbox = ListField(DictField())  # events written with this document, not yet relayed
     created_at = DateTimeField(default=timezone.now)
     updated_at = DateTimeField(default=timezone.now)
 
     meta = {
         'collection': 'book_rentals',
+        'auto_create_index': False,
+        'shard_key': ('renter_id',),  # see books/sharding.py
         'indexes': [
+            '#renter_id',
+            {'fields': ['legacy_id'], 'sparse': True},
             'book',
             'renter_id',
+            'book_owner_id',
             'status',
             'rental_start_date',
-            'rental_end_date'
+            'rental_end_date',
+            'updated_at',
+            {'fields': ['outbox.id'], 'sparse': True, 'name': 'pending_outbox'},
+            {
+                # At most one open request per renter and book; renter_id
+                # first so the constraint holds on a collection sharded by it
+                'fields': ('renter_id', 'book'),
+                'unique': True,
+                'partialFilterExpression': {'status': 'PENDING'},
+                'name': 'pending_request_per_renter'
+            }
         ]
     }
 
@@ -76,7 +170,8 @@ class BookRental(Document):
         return f"Rental of {self.book.title} by user {self.renter_id}"
 
 class BookReview(Document):
-    review_id = StringField(primary_key=True, default=lambda: str(uuid.uuid4()))
+    review_id = ObjectIdField(primary_key=True, default=ObjectId)
+    legacy_id = StringField()  # UUID string key from before compact ids
     book = ReferenceField(Book, required=True)
     reviewer_id = IntField(required=True)  # Reference to Django User model
     rating = IntField(min_value=1, max_value=5)
@@ -85,15 +180,33 @@ class BookReview(Document):
     created_at = DateTimeField(default=timezone.now)
     updated_at = DateTimeField(default=timezone.now)
     reported = BooleanField(default=False)
+    reported_at = DateTimeField()  # first report since the last moderation
+    hidden = BooleanField(default=False)  # by a moderator; left out of listings and ratings
     review_metadata = DictField()
+    outbox = ListField(DictField())  # events written with this document, not yet relayed
 
     meta = {
         'collection': 'book_reviews',
+        'auto_create_index': False,
         'indexes': [
+            {'fields': ['legacy_id'], 'sparse': True},
+            {'fields': ['outbox.id'], 'sparse': True, 'name': 'pending_outbox'},
+            # Only reported reviews are indexed; see books/moderation.py
+            {
+                'fields': ('reported_at', 'review_id'),
+                'partialFilterExpression': {'reported': True},
+                'name': 'moderation_queue'
+            },
             'book',
             'reviewer_id',
             'rating',
-            'created_at'
+            'created_at',
+            'updated_at',
+            # Per-book listings; the pk is the keyset tie-breaker
+            ('book', '-created_at', '-review_id'),
+            ('book', '-helpful_votes', '-review_id'),
+            ('book', 'rating', '-created_at', '-review_id'),
+            ('book', 'rating', '-helpful_votes', '-review_id')
         ]
     }
 
@@ -102,7 +215,7 @@ class BookReview(Document):
 
 
 class UserProfile(Document):
-    _id = StringField(primary_key=True, default=lambda: str(ObjectId()))
+    _id = ObjectIdField(primary_key=True, default=ObjectId)
     user_id = IntField(required=True, unique=True)
     username = StringField(required=True, unique=True)
     email = StringField(required=True, unique=True)
@@ -115,6 +228,7 @@ class UserProfile(Document):
 
     meta = {
         'collection': 'user_profiles',
+        'auto_create_index': False,
         'indexes': [
             'user_id',
             'username',
@@ -125,3 +239,148 @@ class UserProfile(Document):
 
     def __str__(self):
         return f"{self.username}'s profile"
+
+
+class BookScore(Document):
+    """Time-decayed popularity score for a book, updated incrementally on events."""
+    book = ReferenceField(Book, required=True, unique=True)
+    category = StringField(max_length=100)
+    log_score = FloatField()  # log2 of the epoch-scaled score, see books/rankings.py
+    updated_at = DateTimeField(default=timezone.now)
+    applied_events = ListField(ObjectIdField())
+
+    meta = {
+        'collection': 'book_scores',
+        'auto_create_index': False,
+        'indexes': [
+            ('category', '-log_score'),
+            '-log_score'
+        ]
+    }
+
+
+class RankingList(Document):
+    """Materialized top-K list for one ranking kind and category ('*' for all)."""
+    list_id = StringField(primary_key=True)  # "<kind>:<category>"
+    kind = StringField(required=True)
+    category = StringField(required=True)
+    entries = ListField(DictField())
+    refreshed_at = DateTimeField(default=timezone.now)
+
+    meta = {
+        'collection': 'ranking_lists',
+        'auto_create_index': False,
+    }
+
+
+class BookNeighbours(Document):
+    """Top-N "renters also rented" neighbours for one book."""
+    book = ReferenceField(Book, required=True, unique=True)
+    renter_count = IntField(default=0)
+    neighbours = ListField(DictField())  # [{'book': <id>, 'score': float, ...summary}]
+    updated_at = DateTimeField(default=timezone.now)
+
+    meta = {
+        'collection': 'book_neighbours',
+        'auto_create_index': False,
+    }
+
+
+class OwnerDailyRollup(Document):
+    """Per-owner rental counters for one UTC day, maintained with $inc."""
+    owner_id = IntField(required=True)
+    day = DateTimeField(required=True)
+    requested = IntField(default=0)
+    approved = IntField(default=0)
+    rejected = IntField(default=0)
+    returned = IntField(default=0)
+    revenue_cents = IntField(default=0)
+    booked_days = FloatField(default=0)
+    returned_days = FloatField(default=0)
+    applied_events = ListField(ObjectIdField())
+
+    meta = {
+        'collection': 'owner_daily_rollups',
+        'auto_create_index': False,
+        'indexes': [
+            {'fields': ('owner_id', 'day'), 'unique': True}
+        ]
+    }
+
+
+class BookDailyRollup(Document):
+    """Per-book rental, view and impression counters for one UTC day, maintained with $inc."""
+    book = ReferenceField(Book, required=True)
+    owner_id = IntField(required=True)
+    day = DateTimeField(required=True)
+    requested = IntField(default=0)
+    approved = IntField(default=0)
+    rejected = IntField(default=0)
+    returned = IntField(default=0)
+    revenue_cents = IntField(default=0)
+    booked_days = FloatField(default=0)
+    returned_days = FloatField(default=0)
+    views = IntField(default=0)  # buffered, see books/counters.py
+    impressions = IntField(default=0)
+    applied_events = ListField(ObjectIdField())
+
+    meta = {
+        'collection': 'book_daily_rollups',
+        'auto_create_index': False,
+        'indexes': [
+            {'fields': ('book', 'day'), 'unique': True},
+            ('owner_id', 'day')
+        ]
+    }
+
+
+class IdempotencyRecord(Document):
+    """Stored outcome of a request made with an Idempotency-Key header."""
+    key = StringField(primary_key=True)  # "<user id>:<Idempotency-Key>"
+    fingerprint = StringField(required=True)
+    state = StringField(default='processing')
+    status_code = IntField()
+    body = DictField()  # {'data': <response data>}
+    created_at = DateTimeField(default=timezone.now)
+
+    meta = {
+        'collection': 'idempotency_keys',
+        'auto_create_index': False,
+        'indexes': [
+            {'fields': ['created_at'], 'expireAfterSeconds': 24 * 60 * 60}
+        ]
+    }
+
+
+class OutboxEvent(Document):
+    """
+    A side effect waiting to be applied by the outbox workers (books/outbox.py).
+    Events start out embedded in the document whose write produced them and are
+    relayed here, so they are never lost between the two writes.
+    """
+    event_id = ObjectIdField(primary_key=True)
+    kind = StringField(required=True)
+    payload = DictField()
+    state = StringField(default='pending')  # pending, processing, done, failed
+    attempts = IntField(default=0)
+    available_at = DateTimeField(default=timezone.now)
+    locked_by = ObjectIdField()
+    locked_until = DateTimeField()
+    last_error = StringField()
+    created_at = DateTimeField(default=timezone.now)
+    processed_at = DateTimeField()
+
+    meta = {
+        'collection': 'outbox',
+        'auto_create_index': False,
+        'indexes': [
+            ('state', 'available_at'),
+            ('state', 'locked_until'),
+            # Unfinished events of a rental or review, before it may be edited,
+            # deleted or archived
+            {'fields': ['payload.rental_id'], 'sparse': True},
+            {'fields': ['payload.review_id'], 'sparse': True},
+            # Finished events are kept a week for inspection
+            {'fields': ['processed_at'], 'expireAfterSeconds': 7 * 24 * 60 * 60}
+        ]
+    }
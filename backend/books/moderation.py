@@ -0,0 +1,149 @@
+"""
+Moderation queue of reported reviews.
+
+Reporting a review sets `reported` and, unless it is already queued,
+`reported_at`. The queue is read oldest report first from the
+`moderation_queue` index, which is partial on `reported: true`: it holds only
+the reviews waiting for a moderator, so its size and the cost of reading a
+page follow the queue, not book_reviews. Queries must include
+`reported: True` for the planner to use it.
+
+Moderators act on many reviews at once with one conditional bulk_write:
+
+    resolve  dismiss the reports, the review stays visible
+    hide     take the review out of listings and its book's rating
+    unhide   put a hidden review back
+
+All three take the review out of the queue, hide and unhide also when the
+review is already in that state. Hiding and unhiding adjust the book's rating
+counters through the outbox, once per event.
+
+Reviews reported before reported_at existed only carry the time in
+review_metadata; backfill_reported_at() copies it over.
+"""
+from django.utils import timezone
+
+from . import bulk, handlers, ids, outbox
+from .models import BookReview
+from .pagination import after, decode_cursor, encode_cursor
+
+RESOLVE = 'resolve'
+HIDE = 'hide'
+UNHIDE = 'unhide'
+ACTIONS = (RESOLVE, HIDE, UNHIDE)
+
+QUEUE_SORT = [('reported_at', 1), ('_id', 1)]
+
+
+def queue(limit, cursor=None):
+    """
+    (reviews, next cursor) of the oldest reported reviews. Raises
+    InvalidCursor for a malformed cursor.
+    """
+    query = {'reported': True}
+    if cursor:
+        value, last_id = decode_cursor(cursor, 2)
+        query.update(after('reported_at', value, last_id, descending=False))
+    docs = list(
+        BookReview._get_collection().find(query).sort(QUEUE_SORT).hint('moderation_queue').limit(limit + 1)
+    )
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = encode_cursor(docs[-1]['reported_at'], docs[-1]['_id']) if has_more else None
+    return [BookReview._from_son(doc) for doc in docs], next_cursor
+
+
+def _update(action, review, moderator_id, stamp):
+    """(conditions, update) applying `action` to `review`, or None if it doesn't apply."""
+    record = {
+        'review_metadata.moderation': {'action': action, 'by': str(moderator_id), 'at': stamp.isoformat()},
+        'reported': False,
+        'updated_at': stamp,
+    }
+    dequeue = {'reported_at': ''}
+    if action == RESOLVE:
+        if not review.get('reported'):
+            return None
+        return {'reported': True}, {'$set': record, '$unset': dequeue}
+
+    hiding = action == HIDE
+    if bool(review.get('hidden')) == hiding:
+        if not review.get('reported'):
+            return None
+        # Reported again since it was hidden (or unhidden): only dequeue it
+        visibility = True if hiding else {'$ne': True}
+        return {'reported': True, 'hidden': visibility}, {'$set': record, '$unset': dequeue}
+    update = {'$set': dict(record, hidden=hiding), '$unset': dequeue}
+    if review.get('rating') is not None:
+        update['$push'] = {'outbox': outbox.event(
+            handlers.REVIEW_HIDDEN if hiding else handlers.REVIEW_RESTORED,
+            review_id=review['_id'], book_id=review['book'], rating=review['rating']
+        )}
+    # The hidden condition is what keeps a concurrent hide from counting twice
+    conditions = {'hidden': {'$ne': True}} if hiding else {'hidden': True}
+    return conditions, update
+
+
+def apply(review_ids, action, moderator_id):
+    """
+    Apply one moderation `action` to many reviews. Returns
+    [{'id': ..., 'status': ...}] in request order, status being the action's
+    past tense, 'invalid_action', 'not_found' or 'invalid_state'.
+    """
+    review_ids = [str(review_id) for review_id in review_ids]
+    if action not in ACTIONS:
+        return [{'id': review_id, 'status': 'invalid_action'} for review_id in review_ids]
+
+    collection = BookReview._get_collection()
+    reviews = {}
+    for doc in collection.find(
+        ids.query_many(review_ids), {'legacy_id': 1, 'book': 1, 'rating': 1, 'reported': 1, 'hidden': 1}
+    ):
+        reviews[str(doc['_id'])] = doc
+        if doc.get('legacy_id'):
+            reviews[doc['legacy_id']] = doc
+    stamp = bulk.write_stamp()
+    results = {}
+    updates = {}
+    requested_as = {}  # pk -> the id the request used
+    for review_id in review_ids:
+        review = reviews.get(review_id)
+        if review is None:
+            results[review_id] = 'not_found'
+            continue
+        update = _update(action, review, moderator_id, stamp)
+        if update is None:
+            results[review_id] = 'invalid_state'
+        else:
+            updates[review['_id']] = update
+            requested_as[review['_id']] = review_id
+
+    applied = bulk.apply_conditional_updates(collection, updates, stamp)
+    done = {RESOLVE: 'resolved', HIDE: 'hidden', UNHIDE: 'unhidden'}[action]
+    for pk in updates:
+        results[requested_as[pk]] = done if pk in applied else 'invalid_state'
+    return [{'id': review_id, 'status': results[review_id]} for review_id in review_ids]
+
+
+def report(lookup, reason, reporter_id):
+    """Queue the review matching `lookup` for moderation. Returns False if there is none."""
+    now = timezone.now()
+    return bool(BookReview.objects(**lookup).update_one(
+        set__reported=True,
+        min__reported_at=now,  # a queued review keeps its place
+        set__review_metadata__report_reason=reason,
+        set__review_metadata__reported_by=str(reporter_id),
+        set__review_metadata__reported_at=now.isoformat()
+    ))
+
+
+def backfill_reported_at():
+    """Give queued reviews reported before reported_at existed their report time. Returns how many."""
+    return BookReview._get_collection().update_many(
+        {'reported': True, 'reported_at': None},
+        [{'$set': {'reported_at': {'$dateFromString': {
+            'dateString': '$review_metadata.reported_at',
+            'onError': '$created_at',
+            'onNull': '$created_at',
+        }}}}]
+    ).modified_count
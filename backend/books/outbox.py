@@ -0,0 +1,215 @@
+"""
+Outbox for the side effects of rental and review state changes.
+
+A state-changing endpoint writes its primary document and, in the same single
+document write, appends an event to that document's `outbox` array, so the
+event exists exactly when the change does. Workers (run_outbox_workers) then:
+
+1. relay: copy embedded events into the `outbox` collection (keyed by event
+   id, so copying twice is harmless) and $pull them from their document;
+2. claim a batch of due events under a lease, so a crashed worker's events
+   are picked up again once the lease expires;
+3. run the handler registered for each kind (books/handlers.py) and mark the
+   event done, or back off and retry it.
+
+Delivery is at least once. Handlers make their counter updates idempotent with
+guard(): the target document remembers the last APPLIED_EVENTS_KEPT event ids
+it has counted and the update only matches if the event isn't among them.
+"""
+import logging
+from datetime import timedelta
+
+from bson import ObjectId
+from django.conf import settings
+from django.utils import timezone
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .models import BookRental, BookReview, OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+# Documents that carry pending events
+SOURCES = [BookRental, BookReview]
+
+APPLIED_EVENTS_KEPT = 100
+
+_handlers = {}
+
+
+def handler(kind):
+    """Register the function that applies events of `kind`."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def event(kind, **payload):
+    """A new event, to be $push-ed to (or saved in) the primary document's outbox."""
+    return {'id': ObjectId(), 'kind': kind, 'payload': payload, 'at': timezone.now()}
+
+
+def guard(conditions, update, event_id):
+    """
+    Make an operator update apply at most once per event: it only matches
+    while `event_id` isn't recorded on the document, and records it.
+    With upsert, a DuplicateKeyError means the event was already applied.
+    """
+    if event_id is None:
+        return conditions, update
+    update = dict(update)
+    update['$push'] = dict(update.get('$push', {}), applied_events={
+        '$each': [event_id], '$slice': -APPLIED_EVENTS_KEPT
+    })
+    return dict(conditions, applied_events={'$ne': event_id}), update
+
+
+def guard_pipeline(conditions, pipeline, event_id):
+    """guard() for pipeline updates."""
+    if event_id is None:
+        return conditions, pipeline
+    return dict(conditions, applied_events={'$ne': event_id}), list(pipeline) + [
+        {'$set': {'applied_events': {'$slice': [
+            {'$concatArrays': [{'$ifNull': ['$applied_events', []]}, [event_id]]},
+            -APPLIED_EVENTS_KEPT
+        ]}}}
+    ]
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def relay(batch_size=500):
+    """Move embedded events into the outbox collection. Returns how many moved."""
+    outbox = OutboxEvent._get_collection()
+    moved = 0
+    for document in SOURCES:
+        collection = document._get_collection()
+        # Read the shard key too so each $pull below targets one shard
+        shard_key = list(document._meta.get('shard_key', ()))
+        docs = list(collection.find(
+            {'outbox.id': {'$exists': True}}, dict({'outbox': 1}, **{field: 1 for field in shard_key})
+        ).hint('pending_outbox').limit(batch_size))
+        if not docs:
+            continue
+        events = [
+            {
+                '_id': entry['id'],
+                'kind': entry['kind'],
+                'payload': entry.get('payload', {}),
+                'state': PENDING,
+                'attempts': 0,
+                'available_at': entry.get('at') or timezone.now(),
+                'created_at': entry.get('at') or timezone.now(),
+            }
+            for doc in docs for entry in doc['outbox']
+        ]
+        try:
+            outbox.insert_many(events, ordered=False)
+        except BulkWriteError as e:
+            # Relayed before, but the $pull below didn't happen
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+        collection.bulk_write([
+            UpdateOne(
+                dict({field: doc.get(field) for field in shard_key}, _id=doc['_id']),
+                {'$pull': {'outbox': {'id': {'$in': [entry['id'] for entry in doc['outbox']]}}}}
+            )
+            for doc in docs
+        ], ordered=False)
+        moved += len(events)
+    return moved
+
+
+def settled(document, pk, payload_key):
+    """
+    Whether every event written with `document` `pk` has been applied: none is
+    left embedded and none relayed under payload[payload_key] is unfinished.
+    """
+    # Embedded first: an event relayed after this read is found below
+    if document._get_collection().find_one({'_id': pk, 'outbox.id': {'$exists': True}}, {'_id': 1}):
+        return False
+    return OutboxEvent._get_collection().find_one(
+        {f'payload.{payload_key}': pk, 'state': {'$ne': DONE}}, {'_id': 1}
+    ) is None
+
+
+def unsettled(payload_key, pks):
+    """The `pks` with a relayed event under payload[payload_key] that isn't applied yet."""
+    return {
+        doc['payload'][payload_key] for doc in OutboxEvent._get_collection().find(
+            {f'payload.{payload_key}': {'$in': list(pks)}, 'state': {'$ne': DONE}}, {f'payload.{payload_key}': 1}
+        )
+    }
+
+
+def _due(now):
+    return {'$or': [
+        {'state': PENDING, 'available_at': {'$lte': now}},
+        {'state': PROCESSING, 'locked_until': {'$lt': now}},
+    ]}
+
+
+def claim(batch_size=100):
+    """Lease up to `batch_size` due events to this caller."""
+    collection = OutboxEvent._get_collection()
+    now = timezone.now()
+    ids = [doc['_id'] for doc in collection.find(_due(now), {'_id': 1}).sort('_id', 1).limit(batch_size)]
+    if not ids:
+        return []
+    token = ObjectId()
+    collection.update_many(
+        dict(_due(now), _id={'$in': ids}),
+        {'$set': {
+            'state': PROCESSING,
+            'locked_by': token,
+            'locked_until': now + timedelta(seconds=_setting('OUTBOX_LEASE_SECONDS', 60)),
+        }}
+    )
+    return list(collection.find({'locked_by': token, 'state': PROCESSING}).sort('_id', 1))
+
+
+def process(events):
+    """Apply claimed events and record the outcome of each."""
+    operations = []
+    max_attempts = _setting('OUTBOX_MAX_ATTEMPTS', 10)
+    for doc in events:
+        conditions = {'_id': doc['_id'], 'locked_by': doc['locked_by']}
+        try:
+            fn = _handlers.get(doc['kind'])
+            if fn is None:
+                raise LookupError(f"No handler for {doc['kind']} events")
+            fn(doc)
+            operations.append(UpdateOne(conditions, {
+                '$set': {'state': DONE, 'processed_at': timezone.now()},
+                '$unset': {'locked_by': '', 'locked_until': ''},
+            }))
+        except Exception as e:
+            attempts = doc.get('attempts', 0) + 1
+            logger.error(f"Error applying {doc['kind']} event {doc['_id']} (attempt {attempts}): {str(e)}")
+            retry_in = min(2 ** attempts, _setting('OUTBOX_MAX_BACKOFF_SECONDS', 300))
+            operations.append(UpdateOne(conditions, {
+                '$set': {
+                    'state': FAILED if attempts >= max_attempts else PENDING,
+                    'attempts': attempts,
+                    'available_at': timezone.now() + timedelta(seconds=retry_in),
+                    'last_error': str(e)[:500],
+                },
+                '$unset': {'locked_by': '', 'locked_until': ''},
+            }))
+    if operations:
+        OutboxEvent._get_collection().bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def drain(batch_size=100):
+    """One relay-claim-process round. Returns the number of events processed."""
+    relay(batch_size)
+    return process(claim(batch_size))
@@ -0,0 +1,46 @@
+import base64
+from datetime import datetime
+
+from bson import ObjectId, json_util
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Sort key values a cursor may carry. Anything else, such as a {'$gt': ...}
+# document in an edited cursor, would become part of the query.
+CURSOR_TYPES = (datetime, int, float, str, ObjectId)
+
+
+def encode_cursor(*values):
+    """Opaque keyset cursor for the sort key values of the last row returned."""
+    return base64.urlsafe_b64encode(json_util.dumps(list(values)).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, size):
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor("Invalid cursor")
+    if any(isinstance(value, bool) or not isinstance(value, CURSOR_TYPES) for value in values):
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+
+def after(field, value, last_id, descending=True):
+    """Match rows strictly after (value, last_id) in a (field, _id) keyset ordering."""
+    op = '$lt' if descending else '$gt'
+    return {'$or': [
+        {field: {op: value}},
+        {field: value, '_id': {op: last_id}},
+    ]}
+
+
+def get_limit(request, default=20, maximum=100):
+    try:
+        return max(1, min(int(request.query_params.get('limit', default)), maximum))
+    except ValueError:
+        return default
@@ -0,0 +1,175 @@
+"""
+Trending and top-rated rankings.
+
+Popularity is an exponentially decayed sum of event weights. Instead of decaying
+every score over time, each event is scaled up by 2 ** (age_of_epoch / half_life)
+when it is added, so adding to a score keeps the ordering of all scores
+correct. That scaled sum outgrows a float after about 1024 half-lives, so the
+stored `log_score` is its base-2 logarithm: adding an event is one pipeline
+update computing log2(2 ** a + 2 ** b), and the logarithm only grows by one
+per half-life.
+"""
+import logging
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from . import works
+from .models import Book, BookScore, RankingList
+from .outbox import guard_pipeline
+
+logger = logging.getLogger(__name__)
+
+TRENDING = 'trending'
+TOP_RATED = 'top_rated'
+ALL_CATEGORIES = '*'
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+EVENT_WEIGHTS = {
+    'rental': 3.0,
+    'review': 2.0,
+    'helpful_vote': 0.5,
+    'view': 0.05,
+}
+
+
+def _half_life_seconds():
+    return getattr(settings, 'RANKING_HALF_LIFE_DAYS', 7) * 86400
+
+
+def _half_lives(when):
+    """log2 of the scale of an event at `when`: half-lives since EPOCH."""
+    return (when - EPOCH).total_seconds() / _half_life_seconds()
+
+
+def current_score(log_score, now=None):
+    """Convert a stored log_score to its decayed value at `now`."""
+    return 2 ** (log_score - _half_lives(now or timezone.now()))
+
+
+def _log_add(value):
+    """Pipeline expression for log2(2 ** log_score + 2 ** value); log_score may be missing."""
+    current = {'$ifNull': ['$log_score', float('-inf')]}
+    high = {'$max': [current, value]}
+    low = {'$min': [current, value]}
+    return {'$add': [high, {'$log': [{'$add': [1, {'$pow': [2, {'$subtract': [low, high]}]}]}, 2]}]}
+
+
+def _add_events(category, weight, when):
+    return [{'$set': {
+        'log_score': _log_add(math.log2(weight) + _half_lives(when)),
+        'category': {'$literal': category},
+        'updated_at': when,
+    }}]
+
+
+def record_event(book, kind, when=None, event_id=None):
+    """Add one `kind` event for `book` to its popularity score, once per outbox `event_id`."""
+    when = when or timezone.now()
+    conditions, pipeline = guard_pipeline(
+        {'book': book.pk}, _add_events(book.category or '', EVENT_WEIGHTS[kind], when), event_id
+    )
+    try:
+        BookScore._get_collection().update_one(conditions, pipeline, upsert=True)
+    except DuplicateKeyError:
+        pass  # already counted
+
+
+def score_update(book_id, category, kind, count, when=None):
+    """UpdateOne adding `count` `kind` events to a book's score, for bulk writers."""
+    when = when or timezone.now()
+    return UpdateOne({'book': book_id}, _add_events(category, EVENT_WEIGHTS[kind] * count, when), upsert=True)
+
+
+def list_id(kind, category=None):
+    return f"{kind}:{category or ALL_CATEGORIES}"
+
+
+def get_ranking(kind, category=None):
+    return RankingList.objects(list_id=list_id(kind, category)).first()
+
+
+def _summaries(book_ids):
+    from .serializers import BookSummarySerializer
+
+    books = {b.pk: b for b in Book.objects(id__in=book_ids)}
+    works.get_many(book.isbn for book in books.values())
+    return {pk: BookSummarySerializer(book).data for pk, book in books.items()}
+
+
+def _save(kind, category, scored_ids):
+    summaries = _summaries([book_id for book_id, _ in scored_ids])
+    entries = []
+    for book_id, score in scored_ids:
+        if book_id in summaries:
+            entries.append(dict(summaries[book_id], score=round(score, 4)))
+    RankingList(
+        list_id=list_id(kind, category),
+        kind=kind,
+        category=category or ALL_CATEGORIES,
+        entries=entries,
+        refreshed_at=timezone.now()
+    ).save()
+    return len(entries)
+
+
+def refresh_trending(top_k, category=None):
+    queryset = BookScore.objects(log_score__ne=None).order_by('-log_score').limit(top_k)
+    if category:
+        queryset = queryset.filter(category=category)
+    now = timezone.now()
+    scored = [
+        (doc['book'], current_score(doc['log_score'], now))
+        for doc in queryset.as_pymongo().only('book', 'log_score')
+    ]
+    return _save(TRENDING, category, scored)
+
+
+def refresh_top_rated(top_k, category=None):
+    """
+    Rank by Bayesian average so a single 5-star review doesn't beat hundreds of
+    4.8s: (C * m + rating * n) / (C + n), with m the catalog-wide mean rating.
+    """
+    prior_weight = getattr(settings, 'RANKING_RATING_PRIOR_WEIGHT', 10)
+    collection = Book._get_collection()
+    match = {'total_ratings': {'$gt': 0}}
+    if category:
+        match['category'] = category
+
+    mean = list(collection.aggregate([
+        {'$match': {'total_ratings': {'$gt': 0}}},
+        {'$group': {
+            '_id': None,
+            'sum': {'$sum': {'$multiply': ['$rating', '$total_ratings']}},
+            'count': {'$sum': '$total_ratings'},
+        }},
+    ]))
+    prior_mean = mean[0]['sum'] / mean[0]['count'] if mean and mean[0]['count'] else 0
+
+    ranked = collection.aggregate([
+        {'$match': match},
+        {'$project': {
+            'score': {'$divide': [
+                {'$add': [prior_weight * prior_mean, {'$multiply': ['$rating', '$total_ratings']}]},
+                {'$add': [prior_weight, '$total_ratings']},
+            ]},
+        }},
+        {'$sort': {'score': -1}},
+        {'$limit': top_k},
+    ])
+    return _save(TOP_RATED, category, [(doc['_id'], doc['score']) for doc in ranked])
+
+
+def refresh_all(top_k):
+    categories = [c for c in Book.objects.distinct('category') if c]
+    refreshed = 0
+    for category in [None] + categories:
+        refresh_trending(top_k, category)
+        refresh_top_rated(top_k, category)
+        refreshed += 1
+    return refreshed
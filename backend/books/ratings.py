@@ -0,0 +1,87 @@
+"""
+Book rating counters.
+
+Each book keeps per-star counts, a rating sum and the total, adjusted with one
+pipeline update per review, so the rating summary never needs a pass over
+book_reviews. recount() rebuilds them from both archive tiers.
+"""
+from .archive import REVIEWS
+from .models import Book, BookReview
+from .outbox import guard_pipeline
+
+STARS = ('1', '2', '3', '4', '5')
+
+
+def _average():
+    return {'$cond': [
+        {'$gt': ['$total_ratings', 0]},
+        {'$round': [{'$divide': ['$rating_sum', '$total_ratings']}, 2]},
+        0,
+    ]}
+
+
+def adjust(book_id, rating, delta=1, event_id=None):
+    """
+    Add (or with delta=-1, remove) one `rating`-star review from the book's
+    counters, at most once per outbox `event_id`.
+    """
+    star = str(rating)
+    Book._get_collection().update_one(*guard_pipeline({'_id': book_id}, [
+        {'$set': {
+            f'rating_counts.{star}': {'$add': [{'$ifNull': [f'$rating_counts.{star}', 0]}, delta]},
+            'total_ratings': {'$add': [{'$ifNull': ['$total_ratings', 0]}, delta]},
+            'rating_sum': {'$add': [{'$ifNull': ['$rating_sum', 0]}, delta * int(rating)]},
+        }},
+        {'$set': {'rating': _average()}},
+    ], event_id))
+
+
+def summary(book):
+    counts = book.rating_counts or {}
+    return {
+        'id': str(book.pk),
+        'rating': book.rating,
+        'total_ratings': book.total_ratings,
+        'rating_counts': {star: counts.get(star, 0) for star in STARS},
+    }
+
+
+def recount(book_ids=None):
+    """
+    Recompute counters from the visible reviews in both archive tiers, for
+    backfills and repairs.
+    """
+    match = {'hidden': {'$ne': True}}
+    if book_ids is not None:
+        match['book'] = {'$in': list(book_ids)}
+    rows = BookReview._get_collection().aggregate([
+        {'$match': match},
+        {'$project': {'book': 1, 'rating': 1}},
+        # Archived reviews keep book, rating and hidden at the top level
+        {'$unionWith': {'coll': REVIEWS.cold.name, 'pipeline': [
+            {'$match': match},
+            {'$project': {'book': 1, 'rating': 1}},
+        ]}},
+        # A review caught mid-sweep is in both tiers; count it once
+        {'$group': {'_id': '$_id', 'book': {'$first': '$book'}, 'rating': {'$first': '$rating'}}},
+        {'$group': {'_id': {'book': '$book', 'rating': '$rating'}, 'n': {'$sum': 1}}},
+        {'$group': {
+            '_id': '$_id.book',
+            'counts': {'$push': {'k': {'$toString': '$_id.rating'}, 'v': '$n'}},
+            'total': {'$sum': '$n'},
+            'sum': {'$sum': {'$multiply': ['$_id.rating', '$n']}},
+        }},
+    ], allowDiskUse=True)
+    collection = Book._get_collection()
+    updated = 0
+    for row in rows:
+        collection.update_one({'_id': row['_id']}, [
+            {'$set': {
+                'rating_counts': {'$literal': {c['k']: c['v'] for c in row['counts']}},
+                'total_ratings': row['total'],
+                'rating_sum': row['sum'],
+            }},
+            {'$set': {'rating': _average()}},
+        ])
+        updated += 1
+    return updated
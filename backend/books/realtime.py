@@ -0,0 +1,393 @@
+"""
+Push rental events to the people they concern.
+
+The outbox handlers (books/handlers.py) call publish() after a rental is
+created, approved, rejected or returned. The event goes to the configured
+broker, which hands it to the Hub of every ASGI process; the hub forwards it to that process's open WebSocket and SSE
+connections of the renter and the book owner.
+
+Connections are cheap while idle: one bounded queue and two pending futures
+each. A client that stops reading and lets its queue fill up is sent a
+`resync` event and disconnected, so a slow client can't grow server memory;
+it should re-fetch its rentals and reconnect.
+
+Brokers:
+    LocalBroker  delivers inside the publishing process only (tests, runserver)
+    MongoBroker  fans out across processes through a capped collection
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from http.cookies import SimpleCookie
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from pymongo import CursorType, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = {
+    'requested': 'rental.created',
+    'approved': 'rental.approved',
+    'rejected': 'rental.rejected',
+    'returned': 'rental.returned',
+}
+
+RESYNC = json.dumps({'type': 'resync'})
+PING = json.dumps({'type': 'ping'})
+
+# Event numbers a restarted MongoBroker tail reads again
+RESUME_OVERLAP = 1000
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Connection:
+    """One subscriber's bounded outbox."""
+    __slots__ = ('user_id', 'queue', 'overflowed')
+
+    def __init__(self, user_id, size):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=size)
+        self.overflowed = False
+
+    def offer(self, text):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            # Drop the backlog; the client re-fetches instead
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class TooManyConnections(Exception):
+    pass
+
+
+class Hub:
+    """In-process pub/sub from user ids to their open connections."""
+
+    def __init__(self):
+        self.connections = {}
+        self.loop = None
+        self._started = False
+
+    async def start(self):
+        if self._started:
+            return
+        self._started = True
+        self.loop = asyncio.get_running_loop()
+        get_broker().subscribe(self)
+
+    def subscribe(self, user_id):
+        connections = self.connections.setdefault(user_id, set())
+        if len(connections) >= _setting('REALTIME_MAX_CONNECTIONS_PER_USER', 10):
+            raise TooManyConnections()
+        connection = Connection(user_id, _setting('REALTIME_QUEUE_SIZE', 64))
+        connections.add(connection)
+        return connection
+
+    def unsubscribe(self, connection):
+        connections = self.connections.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self.connections[connection.user_id]
+
+    def dispatch(self, user_ids, text):
+        """Deliver an encoded event. Must run on the hub's event loop."""
+        for user_id in user_ids:
+            for connection in tuple(self.connections.get(user_id, ())):
+                connection.offer(text)
+
+    def dispatch_threadsafe(self, user_ids, text):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.dispatch, user_ids, text)
+
+
+hub = Hub()
+
+
+class LocalBroker:
+    """Delivers to this process's hub only."""
+
+    def __init__(self):
+        self.hubs = []
+
+    def subscribe(self, target):
+        self.hubs.append(target)
+
+    def publish(self, user_ids, text):
+        for target in self.hubs:
+            target.dispatch_threadsafe(user_ids, text)
+
+
+class MongoBroker:
+    """
+    Fans events out through a capped collection. Every subscribing process
+    tails it from a daemon thread, starting after the newest event.
+
+    Events are numbered from a counter document when they are published. The
+    numbers increase, but two processes can insert theirs out of order, so a
+    tail whose cursor dies resumes RESUME_OVERLAP numbers back and skips the
+    events it has already delivered.
+    """
+
+    def __init__(self):
+        self.collection_name = _setting('REALTIME_MONGO_COLLECTION', 'realtime_events')
+        self._collection = None
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            from .models import BookRental
+            database = BookRental._get_db()
+            if self.collection_name not in database.list_collection_names():
+                try:
+                    database.create_collection(
+                        self.collection_name, capped=True,
+                        size=_setting('REALTIME_MONGO_CAPPED_BYTES', 64 * 1024 * 1024)
+                    )
+                except Exception:
+                    pass  # created concurrently by another process
+            self._collection = database[self.collection_name]
+        return self._collection
+
+    @property
+    def counters(self):
+        return self.collection.database[f'{self.collection_name}_sequence']
+
+    def last_number(self):
+        doc = self.counters.find_one({'_id': self.collection_name})
+        return doc['n'] if doc else 0
+
+    def next_number(self):
+        return self.counters.find_one_and_update(
+            {'_id': self.collection_name}, {'$inc': {'n': 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )['n']
+
+    def publish(self, user_ids, text):
+        self.collection.insert_one({'s': self.next_number(), 'u': list(user_ids), 'e': text, 't': timezone.now()})
+
+    def subscribe(self, target):
+        threading.Thread(target=self._tail, args=(target,), daemon=True, name='realtime-tail').start()
+
+    def seen_so_far(self):
+        """The numbers a new subscriber treats as delivered: everything published before it."""
+        last = self.last_number()
+        return set(range(last - RESUME_OVERLAP + 1, last + 1))
+
+    def deliver(self, target, seen, cursor_type=CursorType.NON_TAILABLE):
+        """
+        Dispatch the events numbered above max(seen) - RESUME_OVERLAP that
+        aren't in `seen`, in insertion order, until the cursor dies. Adds their
+        numbers to `seen`.
+        """
+        top = max(seen, default=0)
+        cursor = self.collection.find({'s': {'$gt': top - RESUME_OVERLAP}}, cursor_type=cursor_type)
+        while cursor.alive:
+            for doc in cursor:
+                if doc['s'] in seen:
+                    continue
+                seen.add(doc['s'])
+                top = max(top, doc['s'])
+                if len(seen) > 2 * RESUME_OVERLAP:
+                    seen.difference_update([n for n in seen if n <= top - RESUME_OVERLAP])
+                target.dispatch_threadsafe(doc['u'], doc['e'])
+
+    def _tail(self, target):
+        seen = None
+        while True:
+            try:
+                if seen is None:
+                    seen = self.seen_so_far()
+                self.deliver(target, seen, CursorType.TAILABLE_AWAIT)
+                time.sleep(0.1)  # empty collection: the cursor dies immediately
+            except Exception as e:
+                logger.error(f"Error tailing realtime events: {str(e)}")
+                time.sleep(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(_setting('REALTIME_BROKER', 'books.realtime.LocalBroker'))()
+    return _broker
+
+
+def publish(rental, event):
+    """Tell the renter and the book owner about a rental state change."""
+    try:
+        text = json.dumps({
+            'type': EVENT_TYPES[event],
+            'rental': {
+                'id': str(rental.pk),
+                'book_id': str(rental.to_mongo()['book']),
+                'renter_id': str(rental.renter_id),
+                'book_owner_id': str(rental.book_owner_id),
+                'status': rental.status,
+                'rental_start_date': rental.rental_start_date.isoformat() if rental.rental_start_date else None,
+                'rental_end_date': rental.rental_end_date.isoformat() if rental.rental_end_date else None,
+            },
+            'at': timezone.now().isoformat(),
+        })
+        user_ids = {str(rental.renter_id), str(rental.book_owner_id)}
+        get_broker().publish(user_ids, text)
+    except Exception as e:
+        logger.error(f"Error publishing {event} event for rental {rental.pk}: {str(e)}")
+
+
+@sync_to_async
+def _authenticate(session_key):
+    from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY, get_user_model
+    from django.utils.crypto import constant_time_compare
+
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    user_id = session.get(SESSION_KEY)
+    if user_id is None:
+        return None
+    user = get_user_model().objects.filter(pk=user_id, is_active=True).first()
+    if user is None or not constant_time_compare(session.get(HASH_SESSION_KEY, ''), user.get_session_auth_hash()):
+        return None
+    return str(user.pk)
+
+
+def _headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+
+
+async def authenticate(scope):
+    """User id of the session in the request's cookies, or None."""
+    cookie = SimpleCookie()
+    cookie.load(_headers(scope).get('cookie', ''))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+    return await _authenticate(morsel.value)
+
+
+def origin_allowed(scope):
+    origin = _headers(scope).get('origin')
+    if origin is None:
+        return True  # not a browser
+    return origin in getattr(settings, 'CORS_ALLOWED_ORIGINS', [])
+
+
+async def _next(connection, receive_task):
+    """Wait for an outgoing event, the client going away, or the heartbeat."""
+    get_task = asyncio.ensure_future(connection.queue.get())
+    done, _ = await asyncio.wait(
+        {get_task, receive_task},
+        timeout=_setting('REALTIME_HEARTBEAT_SECONDS', 25),
+        return_when=asyncio.FIRST_COMPLETED
+    )
+    if get_task in done:
+        return get_task.result()
+    get_task.cancel()
+    return None
+
+
+async def websocket_app(scope, receive, send):
+    """ws(s)://<host>/ws/rentals/ -- JSON text frames."""
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    user_id = await authenticate(scope) if origin_allowed(scope) else None
+    if user_id is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+    await hub.start()
+    try:
+        connection = hub.subscribe(user_id)
+    except TooManyConnections:
+        await send({'type': 'websocket.close', 'code': 4429})
+        return
+
+    await send({'type': 'websocket.accept'})
+    receive_task = asyncio.ensure_future(receive())
+    try:
+        while True:
+            text = await _next(connection, receive_task)
+            if receive_task.done():
+                message = receive_task.result()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                receive_task = asyncio.ensure_future(receive())  # client frames are ignored
+                if text is None:
+                    continue
+            await send({'type': 'websocket.send', 'text': text or PING})
+            if text == RESYNC:
+                await send({'type': 'websocket.close', 'code': 4008})
+                break
+    finally:
+        receive_task.cancel()
+        hub.unsubscribe(connection)
+
+
+async def sse_app(scope, receive, send):
+    """GET /api/events/rentals/ -- text/event-stream, one JSON event per message."""
+    message = await receive()
+    while message.get('more_body'):
+        message = await receive()
+    user_id = await authenticate(scope) if origin_allowed(scope) else None
+    if user_id is None:
+        await _plain_response(send, 401, b'Authentication required')
+        return
+    await hub.start()
+    try:
+        connection = hub.subscribe(user_id)
+    except TooManyConnections:
+        await _plain_response(send, 429, b'Too many open event streams')
+        return
+
+    headers = [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),  # don't let nginx buffer the stream
+    ]
+    origin = _headers(scope).get('origin')
+    if origin:
+        headers += [
+            (b'access-control-allow-origin', origin.encode('latin-1')),
+            (b'access-control-allow-credentials', b'true'),
+        ]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    receive_task = asyncio.ensure_future(receive())
+    try:
+        while True:
+            text = await _next(connection, receive_task)
+            if receive_task.done():
+                break  # http.disconnect
+            chunk = f"data: {text}\n\n".encode() if text is not None else b': ping\n\n'
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if text == RESYNC:
+                break
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        receive_task.cancel()
+        hub.unsubscribe(connection)
+
+
+async def _plain_response(send, status_code, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [(b'content-type', b'text/plain')],
+    })
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,248 @@
+"""
+"Renters of this book also rented" recommendations.
+
+The full build turns (renter, book) pairs into a sparse renter x book matrix X
+and computes cosine item-item similarity from X.T @ X, keeping only the top-N
+neighbours of each book. Between builds, each completed rental adds its new
+co-occurrences incrementally with the same 1 / sqrt(deg_a * deg_b) weighting,
+using degrees as of the update; the next full build renormalizes exactly.
+
+NumPy and SciPy are only needed for the full build and are imported lazily.
+"""
+from array import array
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from . import archive, works
+from .ids import parse_id
+from .models import Book, BookNeighbours, BookRental
+from .outbox import guard
+
+# A rental counts once returned, in the full build as in the incremental update
+# the RENTAL_RETURNED event triggers
+COMPLETED_STATUSES = ['RETURNED']
+
+
+def top_n():
+    return getattr(settings, 'RECOMMENDATIONS_TOP_N', 20)
+
+
+def build_similarity(renter_codes, book_codes, n_books, limit):
+    """
+    Build top-`limit` cosine neighbours from parallel arrays of integer codes.
+
+    Returns a list indexed by book code of (neighbour_codes, scores) arrays,
+    sorted by descending score.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    renter_codes = np.asarray(renter_codes, dtype=np.int64)
+    book_codes = np.asarray(book_codes, dtype=np.int64)
+    n_renters = int(renter_codes.max()) + 1 if len(renter_codes) else 0
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(renter_codes), dtype=np.float32), (renter_codes, book_codes)),
+        shape=(n_renters, n_books)
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1  # renting the same book twice counts once
+
+    degree = np.asarray(matrix.sum(axis=0)).ravel()
+    scale = sparse.diags(1.0 / np.sqrt(np.maximum(degree, 1)).astype(np.float32))
+    similarity = (scale @ (matrix.T @ matrix) @ scale).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+
+    result = []
+    for row in range(n_books):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        scores = similarity.data[start:end]
+        columns = similarity.indices[start:end]
+        if len(scores) > limit:
+            keep = np.argpartition(-scores, limit)[:limit]
+            scores, columns = scores[keep], columns[keep]
+        order = np.argsort(-scores, kind='stable')
+        result.append((columns[order], scores[order]))
+    return result, degree
+
+
+def _summaries(book_ids, chunk_size=1000):
+    from .serializers import BookSummarySerializer
+
+    summaries = {}
+    book_ids = list(book_ids)
+    for i in range(0, len(book_ids), chunk_size):
+        books = list(Book.objects(id__in=book_ids[i:i + chunk_size]))
+        works.get_many(book.isbn for book in books)
+        for book in books:
+            summaries[book.pk] = dict(BookSummarySerializer(book).data)
+    return summaries
+
+
+def rebuild(batch_size=10000, log=None):
+    """Recompute every book's neighbours from the full rental history, archive included."""
+    book_index = {}
+    renter_index = {}
+    renter_codes = array('q')
+    book_codes = array('q')
+
+    for collection in (BookRental._get_collection(), archive.RENTALS.cold):
+        cursor = collection.find(
+            {'status': {'$in': COMPLETED_STATUSES}},
+            {'renter_id': 1, 'book': 1, '_id': 0},
+            batch_size=batch_size
+        )
+        for doc in cursor:
+            renter_codes.append(renter_index.setdefault(doc['renter_id'], len(renter_index)))
+            book_codes.append(book_index.setdefault(doc['book'], len(book_index)))
+
+    if not book_index:
+        return 0
+    if log:
+        log(f"Loaded {len(book_codes)} rentals over {len(book_index)} books")
+
+    book_ids = list(book_index)
+    neighbours, degree = build_similarity(renter_codes, book_codes, len(book_ids), top_n())
+    summaries = _summaries(book_ids)
+    now = timezone.now()
+
+    collection = BookNeighbours._get_collection()
+    operations = []
+    for code, (columns, scores) in enumerate(neighbours):
+        entries = [
+            dict(summaries.get(book_ids[c], {}), book=book_ids[c], score=float(s))
+            for c, s in zip(columns.tolist(), scores.tolist())
+        ]
+        operations.append(UpdateOne(
+            {'book': book_ids[code]},
+            {'$set': {
+                'neighbours': entries,
+                'renter_count': int(degree[code]),
+                'updated_at': now,
+            }},
+            upsert=True
+        ))
+        if len(operations) >= batch_size:
+            collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    return len(book_ids)
+
+
+def _increment(degree, other_degree):
+    return 1.0 / max(1, degree * other_degree) ** 0.5
+
+
+def _add_neighbour(collection, book_id, entry, increment, limit, event_id=None):
+    """Add `increment` to `entry`'s score in `book_id`'s neighbours, once per outbox `event_id`."""
+    updated = collection.update_one(*guard(
+        {'book': book_id, 'neighbours.book': entry['book']},
+        {'$inc': {'neighbours.$.score': increment}}, event_id
+    ))
+    if updated.matched_count:
+        return
+    try:
+        collection.update_one(*guard(
+            {'book': book_id, 'neighbours.book': {'$ne': entry['book']}},
+            {'$push': {'neighbours': {
+                '$each': [dict(entry, score=increment)],
+                '$sort': {'score': -1},
+                '$slice': limit,
+            }}}, event_id
+        ), upsert=True)
+    except DuplicateKeyError:
+        # Lost a race with another writer creating or filling the document,
+        # or the event was already applied
+        collection.update_one(*guard(
+            {'book': book_id, 'neighbours.book': entry['book']},
+            {'$inc': {'neighbours.$.score': increment}}, event_id
+        ))
+
+
+def _add_renter(collection, book_id, others, summaries, limit, event_id=None):
+    """
+    Count one more renter of `book_id` and add its co-occurrences with
+    `others` (book id -> renter count) in a single write, once per outbox
+    `event_id`. The write only applies if the document is unchanged since it
+    was read; otherwise it raises and the event is retried.
+    Returns the book's renter count including this renter.
+    """
+    doc = collection.find_one({'book': book_id}, {'renter_count': 1, 'neighbours': 1, 'applied_events': 1}) or {}
+    if event_id is not None and event_id in doc.get('applied_events', []):
+        return doc.get('renter_count', 0)
+    degree = doc.get('renter_count', 0) + 1
+
+    merged = {entry['book']: entry for entry in doc.get('neighbours', [])}
+    for other, other_degree in others.items():
+        score = merged.get(other, {}).get('score', 0) + _increment(degree, other_degree)
+        merged[other] = dict(summaries.get(other, {}), book=other, score=score)
+    neighbours = sorted(merged.values(), key=lambda entry: entry['score'], reverse=True)[:limit]
+
+    update = {'$set': {'renter_count': degree, 'neighbours': neighbours, 'updated_at': timezone.now()}}
+    if not doc:
+        try:
+            collection.update_one(*guard({'book': book_id}, update, event_id), upsert=True)
+        except DuplicateKeyError:
+            raise RuntimeError(f"Neighbours of book {book_id} were created concurrently")
+        return degree
+    conditions = {'_id': doc['_id'], 'renter_count': doc.get('renter_count'), 'neighbours': doc.get('neighbours')}
+    if not collection.update_one(*guard(conditions, update, event_id)).matched_count:
+        raise RuntimeError(f"Neighbours of book {book_id} changed concurrently")
+    return degree
+
+
+def record_completed_rental(renter_id, book, max_history=50, event_id=None):
+    """
+    Fold one completed rental into the neighbour lists of the books involved,
+    at most once per outbox `event_id`.
+    """
+    rentals = BookRental._get_collection()
+    completed = {'renter_id': renter_id, 'status': {'$in': COMPLETED_STATUSES}}
+    pair = dict(completed, book=book.pk)
+    if rentals.count_documents(pair) + archive.RENTALS.cold.count_documents(pair) > 1:
+        return  # this renter already contributed to the pair counts
+
+    others = [
+        doc['_id'] for doc in rentals.aggregate([
+            {'$match': dict(completed, book={'$ne': book.pk})},
+            {'$project': {'book': 1, 'updated_at': 1}},
+            {'$unionWith': {'coll': archive.RENTALS.cold.name, 'pipeline': [
+                {'$match': dict(completed, book={'$ne': book.pk})},
+                {'$project': {'book': 1, 'updated_at': 1}},
+            ]}},
+            {'$group': {'_id': '$book', 'last': {'$max': '$updated_at'}}},
+            {'$sort': {'last': -1}},
+            {'$limit': max_history},
+        ])
+    ]
+    collection = BookNeighbours._get_collection()
+    degrees = {
+        doc['book']: doc.get('renter_count', 0)
+        for doc in collection.find({'book': {'$in': others}}, {'book': 1, 'renter_count': 1})
+    }
+    degrees = {other: degrees.get(other, 1) for other in others}
+    summaries = _summaries(others + [book.pk])
+    limit = top_n()
+
+    degree = _add_renter(collection, book.pk, degrees, summaries, limit, event_id)
+    for other in others:
+        entry = dict(summaries.get(book.pk, {}), book=book.pk)
+        _add_neighbour(collection, other, entry, _increment(degree, degrees[other]), limit, event_id)
+
+
+def recommendations_for(book_id, limit=None):
+    object_id = parse_id(book_id)
+    if object_id is None:
+        return []
+    doc = BookNeighbours._get_collection().find_one({'book': object_id}, {'neighbours': 1})
+    if not doc:
+        return []
+    neighbours = sorted(doc.get('neighbours', []), key=lambda n: n['score'], reverse=True)
+    for entry in neighbours:
+        entry['book'] = str(entry['book'])
+    return neighbours[:limit or top_n()]
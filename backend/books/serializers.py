@@ -1,7 +1,9 @@
 # serializers.py
 
+from django.conf import settings
 from rest_framework import serializers
-from .models import Book, BookRental, BookReview
+from .models import Book, BookReview
+from . import booking, covers, handlers, ids, inventory, outbox, works
 from users.serializers import UserProfileSerializer
 
 class UserSerializer(serializers.Serializer):
@@ -11,17 +13,39 @@ class UserSerializer(serializers.Serializer):
     first_name = serializers.CharField()
     last_name = serializers.CharField()
 
+def cover_thumbnails(cover_image):
+    """Thumbnail URLs by size for uploaded covers; external covers only have the original."""
+    stored = covers.parse_cover_url(cover_image)
+    if stored is None:
+        return {size: cover_image for size in covers.thumbnail_sizes()} if cover_image else {}
+    return covers.thumbnail_urls(*stored)
+
+def smallest_cover(cover_image):
+    """URL of the smallest thumbnail, for covers shown as tiles in lists."""
+    sizes = covers.thumbnail_sizes()
+    return cover_thumbnails(cover_image).get(min(sizes, key=sizes.get))
+
+class BookListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Load the works of the whole page at once; items then hit the cache
+        books = list(data)
+        works.get_many(book.isbn for book in books)
+        return super().to_representation(books)
+
 class BookSerializer(serializers.Serializer):
-    id = serializers.CharField(source='_id', read_only=True)
+    id = serializers.CharField(source='pk', read_only=True)
     title = serializers.CharField(max_length=200, required=True)
     author = serializers.CharField(max_length=200, required=True)
     description = serializers.CharField(allow_blank=True, required=False)
-    isbn = serializers.CharField(max_length=13, required=True)
+    isbn = serializers.CharField(max_length=17, required=True)
     cover_image = serializers.URLField(allow_blank=True, required=False)
+    cover_thumbnails = serializers.SerializerMethodField()
     publication_year = serializers.IntegerField(allow_null=True, required=False)
     owner_id = serializers.CharField(required=False)  # Changed to CharField
     available_for_rent = serializers.BooleanField(default=True)
     price_per_day = serializers.DecimalField(max_digits=10, decimal_places=2, required=True)
+    total_copies = serializers.IntegerField(min_value=1, required=False)
+    available_copies = serializers.IntegerField(source='copies_available', read_only=True)
     category = serializers.CharField(max_length=100, allow_blank=True, required=False)
     language = serializers.CharField(max_length=50, default='English', required=False)
     condition = serializers.CharField(max_length=50, default='GOOD', required=False)
@@ -29,20 +53,93 @@ class BookSerializer(serializers.Serializer):
     location = serializers.DictField(default=dict, required=False)
     rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
     total_ratings = serializers.IntegerField(read_only=True)
+    rating_counts = serializers.DictField(read_only=True)
     created_at = serializers.DateTimeField(read_only=True)
     updated_at = serializers.DateTimeField(read_only=True)
 
+    class Meta:
+        list_serializer_class = BookListSerializer
+
+    def get_cover_thumbnails(self, obj):
+        return cover_thumbnails(obj.cover_image)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if isinstance(self.parent, BookListSerializer):
+            # A page of listings shows covers as tiles; never ship the original
+            data['cover_image'] = smallest_cover(instance.cover_image)
+        return data
+
+    def validate_isbn(self, value):
+        try:
+            return works.normalize_isbn(value)
+        except ValueError:
+            raise serializers.ValidationError("Enter a valid ISBN-10 or ISBN-13.")
+
+    def validate_total_copies(self, value):
+        # Every copy is an element of the book document
+        limit = getattr(settings, 'BOOK_MAX_COPIES', 100)
+        if value > limit:
+            raise serializers.ValidationError(f"Ensure this value is less than or equal to {limit}.")
+        return value
+
+    def _pop_work_fields(self, validated_data):
+        return {
+            field: validated_data.pop(field)
+            for field in works.WORK_FIELDS
+            if field in validated_data
+        }
+
     def create(self, validated_data):
         if 'owner_id' not in validated_data:
             raise serializers.ValidationError({'owner_id': 'This field is required.'})
+        validated_data.update(works.ensure(validated_data['isbn'], self._pop_work_fields(validated_data)))
+        total = validated_data.get('total_copies', 1)
+        validated_data['copies'] = inventory.build_copies(total)
+        validated_data['copies_available'] = total
         return Book(**validated_data).save()
 
     def update(self, instance, validated_data):
+        total = validated_data.pop('total_copies', None)
+        metadata = self._pop_work_fields(validated_data)
+        isbn = validated_data.get('isbn', instance.isbn)
+        if isbn != instance.isbn:
+            # Moving to another work: carry over what the listing showed so far
+            current = instance.work
+            validated_data.update(works.ensure(isbn, dict(
+                {field: getattr(current, field, None) for field in works.WORK_FIELDS}, **metadata
+            )))
+        elif metadata:
+            works.update_metadata(isbn, metadata, instance.owner_id)
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         instance.save()
+        if total is not None:
+            try:
+                inventory.resize(instance, total)
+            except inventory.InventoryConflict as e:
+                raise serializers.ValidationError({'total_copies': str(e)})
         return instance
 
+class BookSummarySerializer(serializers.Serializer):
+    """Compact book representation for lists embedded in other documents."""
+    id = serializers.CharField(source='pk', read_only=True)
+    title = serializers.CharField(read_only=True)
+    author = serializers.CharField(read_only=True)
+    cover_image = serializers.SerializerMethodField()
+    cover_thumbnails = serializers.SerializerMethodField()
+    category = serializers.CharField(read_only=True)
+    price_per_day = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
+    total_ratings = serializers.IntegerField(read_only=True)
+
+    def get_cover_image(self, obj):
+        # Lists of summaries render as small tiles; never ship the original
+        return smallest_cover(obj.cover_image)
+
+    def get_cover_thumbnails(self, obj):
+        return cover_thumbnails(obj.cover_image)
+
 class BookRentalSerializer(serializers.Serializer):
     id = serializers.CharField(read_only=True)
     book = BookSerializer(read_only=True)
@@ -51,9 +148,9 @@ class BookRentalSerializer(serializers.Serializer):
     book_owner_id = serializers.CharField(read_only=True)  # New field
     rental_start_date = serializers.DateTimeField()
     rental_end_date = serializers.DateTimeField()
-    actual_return_date = serializers.DateTimeField(allow_null=True, required=False)
+    actual_return_date = serializers.DateTimeField(source='return_date', allow_null=True, required=False)
     status = serializers.CharField(read_only=True)
-    total_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     owner_approval = serializers.BooleanField(read_only=True)
     created_at = serializers.DateTimeField(read_only=True)
     updated_at = serializers.DateTimeField(read_only=True)
@@ -64,17 +161,14 @@ class BookRentalSerializer(serializers.Serializer):
         return data
 
     def create(self, validated_data):
-        book_id = validated_data.pop('book_id')
-        try:
-            book = Book.objects.get(id=book_id)
-            if not book.available_for_rent:
-                raise serializers.ValidationError("This book is not available for rent")
-            validated_data['book'] = book
-            validated_data['book_owner_id'] = str(book.owner_id)
-            validated_data['status'] = 'PENDING'
-            return BookRental.objects.create(**validated_data)
-        except Book.DoesNotExist:
-            raise serializers.ValidationError("Invalid book_id")
+        # Price is always computed from the book, never taken from the client.
+        # BookingError carries its status code up to the view.
+        return booking.request_rental(
+            validated_data['book_id'],
+            validated_data['renter_id'],
+            validated_data['rental_start_date'],
+            validated_data['rental_end_date']
+        )
 
     def update(self, instance, validated_data):
         for attr, value in validated_data.items():
@@ -91,6 +185,8 @@ class BookReviewSerializer(serializers.Serializer):
     review_text = serializers.CharField(allow_blank=True)
     helpful_votes = serializers.IntegerField(read_only=True, default=0)
     reported = serializers.BooleanField(read_only=True, default=False)
+    reported_at = serializers.DateTimeField(read_only=True)
+    hidden = serializers.BooleanField(read_only=True, default=False)
     review_metadata = serializers.DictField(read_only=True, default=dict)
     created_at = serializers.DateTimeField(read_only=True)
     updated_at = serializers.DateTimeField(read_only=True)
@@ -98,19 +194,13 @@ class BookReviewSerializer(serializers.Serializer):
     def create(self, validated_data):
         book_id = validated_data.pop('book_id')
         try:
-            book = Book.objects.get(id=book_id)
-            review = BookReview.objects.create(book=book, **validated_data)
-            
-            # Update book rating
-            book_reviews = BookReview.objects.filter(book=book)
-            total_ratings = book_reviews.count()
-            avg_rating = sum(r.rating for r in book_reviews) / total_ratings if total_ratings > 0 else 0
-            
-            book.rating = round(avg_rating, 2)
-            book.total_ratings = total_ratings
-            book.save()
-            
-            return review
+            book = Book.objects.get(**ids.lookup(book_id))
+            review = BookReview(book=book, **validated_data)
+            # Rating counters and rankings are updated by the outbox worker
+            review.outbox = [outbox.event(
+                handlers.REVIEW_CREATED, review_id=review.pk, book_id=book.pk, rating=review.rating
+            )]
+            return review.save()
         except Book.DoesNotExist:
             raise serializers.ValidationError("Invalid book_id")
 
@@ -118,4 +208,15 @@ class BookReviewSerializer(serializers.Serializer):
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
         instance.save()
-        return instance
\ No newline at end of file
+        return instance
+
+class NestedBookReviewSerializer(BookReviewSerializer):
+    """Review listed under its book, so the book itself is left out."""
+    book = None
+
+class ModerationReviewSerializer(NestedBookReviewSerializer):
+    """Queued review with its book's id, without loading the book."""
+    book_id = serializers.SerializerMethodField()
+
+    def get_book_id(self, review):
+        return str(review.to_mongo()['book'])
@@ -0,0 +1,126 @@
+"""
+Sharded layout of the catalog and the rental history.
+
+    books          {owner_id: 'hashed'}   unique (owner_id, isbn)
+    book_rentals   {renter_id: 'hashed'}  unique (renter_id, book) while PENDING
+
+A unique index on a sharded collection must start with the shard key, which
+is why the (isbn, owner) and (book, renter) constraints are keyed owner and
+renter first. Both keys are immutable: an owner never changes, a rental's
+renter never changes. Hashing spreads new users, whose ids grow
+monotonically, over all shards.
+
+Routing: a query that includes the shard key goes to one shard; one without
+it is broadcast. The owner's books, a renter's rentals, the booking upsert,
+rental state changes (which add renter_id), copy reservation and release
+and calendar updates (which add the book's owner_id), and outbox relays are
+all targeted. Lookups by id alone (GET /books/<id>/, GET /rentals/<id>/) and
+owner-side rental listings are point lookups broadcast to every shard, and
+catalog search is a scatter-gather by nature. Lookups by ISBN alone (metadata
+edits fanning out to other listings, ISBN search, dedupe_works) are
+broadcast too, but use the plain isbn index on every shard.
+
+The remaining collections are derived, small or keyed by values that
+don't fit either key (works, rollups, scores, outbox) and stay unsharded on
+the primary shard until they need their own plan.
+
+`manage.py setup_sharding` applies the plan; `manage.py check_shard_routing`
+explains the hot-path queries through mongos and reports how many shards
+each one reaches; `manage.py shard_cluster` starts a local multi-process
+cluster to run both against.
+"""
+from .models import Book, BookRental
+
+PLAN = [
+    (Book, {'owner_id': 'hashed'}),
+    (BookRental, {'renter_id': 'hashed'}),
+]
+
+# Indexes replaced by shard-key-prefixed ones
+RETIRED_INDEXES = {
+    Book: ['isbn_1_owner_id_1', 'owner_id_1'],
+    BookRental: ['one_pending_request_per_renter'],
+}
+
+
+def is_mongos(database):
+    return database.client.admin.command('isMaster').get('msg') == 'isdbgrid'
+
+
+def sharded_collections(database):
+    """Namespaces of `database` that are already sharded, with their keys."""
+    return {
+        doc['_id']: doc['key']
+        for doc in database.client['config']['collections'].find(
+            {'_id': {'$regex': f'^{database.name}\\.'}, 'dropped': {'$ne': True}}
+        )
+    }
+
+
+def apply(log=None):
+    """
+    Create the shard-key-prefixed indexes, drop the ones they replace and shard
+    the collections of PLAN. Safe to run again.
+    """
+    log = log or (lambda message: None)
+    database = Book._get_db()
+    admin = database.client.admin
+    admin.command('enableSharding', database.name)
+    already = sharded_collections(database)
+
+    for document, key in PLAN:
+        collection = document._get_collection()
+        namespace = f'{database.name}.{collection.name}'
+        # New constraints first, so uniqueness is enforced throughout
+        document.ensure_indexes()
+        existing = collection.index_information()
+        for name in RETIRED_INDEXES.get(document, []):
+            if name in existing:
+                collection.drop_index(name)
+                log(f"{collection.name}: dropped {name}")
+        if namespace in already:
+            log(f"{collection.name}: already sharded on {already[namespace]}")
+            continue
+        admin.command('shardCollection', namespace, key=key)
+        log(f"{collection.name}: sharded on {key}")
+
+
+def _explain_shards(cursor):
+    """(stage, number of shards reached) from a find explain run through mongos."""
+    planner = cursor.explain()['queryPlanner']
+    winning = planner['winningPlan']
+    return winning.get('stage'), len(winning.get('shards', [])) or 1
+
+
+def hot_path_queries():
+    """(description, document, filter) for the queries the plan must keep targeted."""
+    book = Book._get_collection().find_one({}, {'owner_id': 1, 'isbn': 1})
+    rental = BookRental._get_collection().find_one({}, {'renter_id': 1, 'book': 1, 'book_owner_id': 1})
+    queries = []
+    if book:
+        queries += [
+            ("owner's books (my_books)", Book, {'owner_id': book['owner_id']}),
+            ("listing uniqueness (owner, isbn)", Book, {'owner_id': book['owner_id'], 'isbn': book['isbn']}),
+            ("copy reservation / calendar update", Book, {'_id': book['_id'], 'owner_id': book['owner_id']}),
+        ]
+    if rental:
+        queries += [
+            ("renter's rentals (my_rentals)", BookRental, {'renter_id': rental['renter_id']}),
+            ("booking upsert", BookRental, {'book': rental['book'], 'renter_id': rental['renter_id'], 'status': 'PENDING'}),
+            ("rental state change", BookRental, {'_id': rental['_id'], 'renter_id': rental['renter_id']}),
+        ]
+    return queries
+
+
+def check_routing():
+    """
+    [(description, collection, stage, shards reached, shards total)] for every
+    hot-path query; stage is SINGLE_SHARD when the query is targeted.
+    """
+    database = Book._get_db()
+    total = database.client['config']['shards'].count_documents({})
+    report = []
+    for description, document, query in hot_path_queries():
+        stage, reached = _explain_shards(document._get_collection().find(query))
+        report.append((description, document._get_collection().name, stage, reached, total))
+    return report
@@ -1,3 +1,1020 @@
-from django.test import TestCase
+import asyncio
+import base64
+import importlib.util
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import SkipTest, mock
 
-# Create your tests here.
+import mongoengine
+from bson import ObjectId, json_util
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from pymongo import ASCENDING, DESCENDING, MongoClient, UpdateOne
+from rest_framework.exceptions import ValidationError as DRFValidationError
+from rest_framework.test import APIClient
+
+from backend import mongo, startup
+from books import (
+    analytics, archive, availability, catalog, counters, covers, export, handlers, ids, inventory, moderation, outbox,
+    pagination, rankings, realtime, recommendations, sharding, works,
+)
+from books.management.commands.ensure_indexes import documents
+from books.models import (
+    Book, BookDailyRollup, BookNeighbours, BookRental, BookReview, BookScore, OutboxEvent, OwnerDailyRollup,
+    UserProfile, Work,
+)
+
+MONGO_TEST_URI = os.getenv('MONGO_TEST_URI', 'mongodb://localhost:27017/book_renting_test')
+
+
+class MongoTestCase(TestCase):
+    """
+    Runs against a scratch MongoDB database (MONGO_TEST_URI) with every declared
+    index in place. Skipped when no server is reachable.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=1000).admin.command('ping')
+        except Exception:
+            raise SkipTest(f"No MongoDB server at {MONGO_TEST_URI}")
+        super().setUpClass()
+        mongoengine.disconnect()
+        mongoengine.connect(host=MONGO_TEST_URI)
+        cls.db = UserProfile._get_db()
+        cls.db.client.drop_database(cls.db.name)
+        for document in documents():
+            document.ensure_indexes()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.client.drop_database(cls.db.name)
+        mongo.reconnect()
+        super().tearDownClass()
+
+    def setUp(self):
+        for name in self.db.list_collection_names():
+            if not name.startswith('system.') and not self.db[name].options().get('capped'):
+                self.db[name].delete_many({})
+
+
+class CompactIdMigrationTests(MongoTestCase):
+    def profile(self, profile_id, user_id, username):
+        return {
+            '_id': profile_id, 'user_id': user_id, 'username': username,
+            'email': f'{username}@example.com', 'first_name': '', 'last_name': '',
+        }
+
+    def test_profiles_with_unique_fields_are_migrated(self):
+        collection = UserProfile._get_collection()
+        ann, bob = str(ObjectId()), str(ObjectId())
+        collection.insert_many([self.profile(ann, 1, 'ann'), self.profile(bob, 2, 'bob')])
+
+        call_command('migrate_compact_ids', stdout=StringIO())
+
+        profiles = {doc['username']: doc for doc in collection.find()}
+        self.assertEqual(profiles['ann']['_id'], ObjectId(ann))
+        self.assertEqual(profiles['bob']['_id'], ObjectId(bob))
+        self.assertEqual(profiles['ann']['email'], 'ann@example.com')
+        self.assertEqual(collection.count_documents({'_id': {'$type': 'string'}}), 0)
+        self.assertEqual(self.db['id_migration_journal'].count_documents({}), 0)
+
+    def test_interrupted_profile_migration_resumes_from_the_journal(self):
+        collection = UserProfile._get_collection()
+        ann = str(ObjectId())
+        doc = self.profile(ann, 1, 'ann')
+        collection.insert_one(doc)
+        # Journaled, but stopped before the old document was deleted
+        self.db['id_migration_journal'].insert_one({
+            '_id': f'{collection.name}:{ann}', 'collection': collection.name,
+            'old': ann, 'new': ObjectId(ann), 'doc': dict(doc, _id=ObjectId(ann)),
+        })
+
+        call_command('migrate_compact_ids', stdout=StringIO())
+
+        self.assertEqual([p['_id'] for p in collection.find()], [ObjectId(ann)])
+        self.assertEqual(self.db['id_migration_journal'].count_documents({}), 0)
+
+
+class PublicIdLookupTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.uuid = str(uuid.uuid4())
+        self.migrated_uuid = str(uuid.uuid4())
+        self.migrated_id = ObjectId()
+        Book._get_collection().insert_many([
+            {'_id': self.uuid, 'isbn': '9780000000001', 'owner_id': 1},
+            {'_id': self.migrated_id, 'legacy_id': self.migrated_uuid, 'isbn': '9780000000002', 'owner_id': 1},
+        ])
+
+    def test_lookup_finds_unmigrated_and_migrated_documents(self):
+        self.assertEqual(Book.objects.get(**ids.lookup(self.uuid)).pk, self.uuid)
+        self.assertEqual(Book.objects.get(**ids.lookup(self.migrated_uuid)).pk, self.migrated_id)
+        self.assertEqual(Book.objects.get(**ids.lookup(str(self.migrated_id))).pk, self.migrated_id)
+
+    def test_query_many_mixes_id_kinds(self):
+        found = Book._get_collection().find(ids.query_many([self.uuid, self.migrated_uuid, str(ObjectId())]))
+        self.assertEqual({doc['_id'] for doc in found}, {self.uuid, self.migrated_id})
+
+
+def make_book(owner_id, copies=1, isbn='9780000000001', **fields):
+    return Book(
+        isbn=isbn, owner_id=owner_id, total_copies=copies, copies_available=copies,
+        copies=inventory.build_copies(copies), **fields
+    ).save()
+
+
+def make_rental(book, renter_id, status='PENDING', start=None, days=3):
+    start = start or timezone.now() + timedelta(days=1)
+    return BookRental(
+        book=book, renter_id=renter_id, book_owner_id=book.owner_id, status=status,
+        rental_start_date=start, rental_end_date=start + timedelta(days=days)
+    ).save()
+
+
+class BatchRentalTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='secret-pass-1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_repeated_id_reserves_one_copy(self):
+        book = make_book(self.owner.id, copies=2)
+        rental = make_rental(book, renter_id=self.owner.id + 1)
+
+        response = self.client.post(
+            '/api/rentals/batch/', {'action': 'approve', 'ids': [str(rental.pk), str(rental.pk)]}, format='json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in response.data['results']], ['approved', 'approved'])
+        book.reload()
+        self.assertEqual(book.copies_available, 1)
+        self.assertEqual([c.rental_id for c in book.copies if c.state == 'R'], [str(rental.pk)])
+        self.assertEqual(BookRental.objects.get(id=rental.pk).status, 'ACTIVE')
+
+    def test_rental_that_is_not_pending_keeps_its_copy(self):
+        book = make_book(self.owner.id)
+        rental = make_rental(book, renter_id=self.owner.id + 1, status='REJECTED')
+
+        response = self.client.post('/api/rentals/batch/', {'action': 'approve', 'ids': [str(rental.pk)]}, format='json')
+
+        self.assertEqual(response.data['results'][0]['status'], 'invalid_state')
+        self.assertEqual(Book.objects.get(id=book.pk).copies_available, 1)
+
+
+@override_settings(RANKING_HALF_LIFE_DAYS=1)
+class RankingScoreTests(MongoTestCase):
+    def test_scores_stay_finite_past_a_thousand_half_lives(self):
+        # 2 ** 1100 doesn't fit a float; the stored log score does
+        late = rankings.EPOCH + timedelta(days=1100)
+        book = make_book(1, category='fiction')
+        rankings.record_event(book, 'rental', when=late)
+        rankings.record_event(book, 'review', when=late, event_id=ObjectId())
+
+        doc = BookScore._get_collection().find_one({'book': book.pk})
+        self.assertAlmostEqual(rankings.current_score(doc['log_score'], late), 5.0, places=6)
+        self.assertAlmostEqual(rankings.current_score(doc['log_score'], late + timedelta(days=1)), 2.5, places=6)
+
+    def test_events_are_counted_once_and_ordered_by_decayed_score(self):
+        now = rankings.EPOCH + timedelta(days=1023)
+        older, newer = make_book(1, isbn='9780000000001'), make_book(1, isbn='9780000000002')
+        event_id = ObjectId()
+        rankings.record_event(older, 'rental', when=now - timedelta(days=2), event_id=event_id)
+        rankings.record_event(older, 'rental', when=now - timedelta(days=2), event_id=event_id)
+        rankings.record_event(newer, 'review', when=now)
+
+        scores = {doc['book']: doc['log_score'] for doc in BookScore._get_collection().find()}
+        self.assertAlmostEqual(rankings.current_score(scores[older.pk], now), 0.75, places=6)
+        self.assertGreater(scores[newer.pk], scores[older.pk])
+
+
+class RentalEditTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.renter = User.objects.create_user('renter', password='secret-pass-1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.renter)
+
+    def test_open_rental_cannot_be_deleted(self):
+        rental = make_rental(make_book(self.renter.id + 1), renter_id=self.renter.id, status='ACTIVE')
+
+        response = self.client.delete(f'/api/rentals/{rental.pk}/')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(BookRental.objects(id=rental.pk).count(), 1)
+
+    def test_closed_rental_waits_for_its_events(self):
+        rental = make_rental(make_book(self.renter.id + 1), renter_id=self.renter.id, status='RETURNED')
+        BookRental.objects(id=rental.pk).update_one(push__outbox=outbox.event('rental.returned', rental_id=rental.pk))
+
+        self.assertEqual(self.client.delete(f'/api/rentals/{rental.pk}/').status_code, 409)
+
+        outbox.relay()
+        OutboxEvent.objects(payload__rental_id=rental.pk).update(set__state=outbox.DONE)
+        self.assertEqual(self.client.delete(f'/api/rentals/{rental.pk}/').status_code, 204)
+        self.assertEqual(BookRental.objects(id=rental.pk).count(), 0)
+
+
+@override_settings(BOOK_MAX_COPIES=5)
+class CopyInventoryTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner', password='secret-pass-1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_too_many_copies_are_rejected(self):
+        book = make_book(self.owner.id, copies=2)
+
+        response = self.client.put(f'/api/books/{book.pk}/', {
+            'title': 'T', 'author': 'A', 'isbn': book.isbn, 'price_per_day': '1.00', 'total_copies': 6,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('total_copies', response.data)
+        self.assertEqual(len(Book.objects.get(id=book.pk).copies), 2)
+
+        response = self.client.post('/api/books/', {
+            'title': 'T', 'author': 'A', 'isbn': '9780000000002', 'price_per_day': '1.00', 'total_copies': 6,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('total_copies', response.data)
+
+    def test_copies_are_reserved_once_and_released(self):
+        book = make_book(self.owner.id, copies=1)
+        first, second = ObjectId(), ObjectId()
+
+        self.assertTrue(inventory.reserve_copy(book.pk, first, book.owner_id))
+        self.assertFalse(inventory.reserve_copy(book.pk, second, book.owner_id))
+        inventory.release_copy(book.pk, first, book.owner_id)
+        inventory.release_copy(book.pk, first, book.owner_id)
+
+        book.reload()
+        self.assertEqual(book.copies_available, 1)
+        self.assertEqual([c.state for c in book.copies], ['A'])
+
+
+class WorkDedupeTests(MongoTestCase):
+    def test_listing_metadata_moves_to_one_work(self):
+        books, work_collection = Book._get_collection(), Work._get_collection()
+        first, second = ObjectId(), ObjectId()
+        books.insert_many([
+            {'_id': first, 'owner_id': 1, 'isbn': '0-306-40615-2', 'title': 'First'},
+            {'_id': second, 'owner_id': 2, 'isbn': '9780306406157', 'title': 'Second', 'description': 'More'},
+        ])
+
+        moved, conflicts = works.dedupe(books, work_collection, batch_size=1)
+
+        self.assertEqual((moved, conflicts), (2, []))
+        work = work_collection.find_one({'_id': '9780306406157'})
+        self.assertEqual((work['title'], work['description']), ('First', 'More'))
+        for doc in books.find():
+            self.assertEqual(doc['isbn'], '9780306406157')
+            self.assertNotIn('title', doc)
+
+    def test_owner_listing_a_work_twice_is_a_conflict(self):
+        books = Book._get_collection()
+        duplicate = ObjectId()
+        books.insert_many([
+            {'_id': ObjectId(), 'owner_id': 1, 'isbn': '9780306406157', 'title': 'First'},
+            {'_id': duplicate, 'owner_id': 1, 'isbn': '0306406152', 'title': 'Again'},
+        ])
+
+        moved, conflicts = works.dedupe(books, Work._get_collection())
+
+        self.assertEqual(conflicts, [duplicate])
+        self.assertEqual(books.find_one({'_id': duplicate})['isbn'], '0306406152')
+        self.assertEqual(Work._get_collection().find_one({'_id': '0306406152'})['title'], 'Again')
+
+    def test_search_and_years_filter_copied_work_fields(self):
+        dune = make_book(1)
+        messiah = make_book(1, isbn='9780000000002')
+        works.ensure(dune.isbn, {'title': 'Dune', 'author': 'Frank Herbert', 'publication_year': 1965})
+        works.ensure(messiah.isbn, {'title': 'Dune Messiah', 'author': 'Frank Herbert', 'publication_year': 1969})
+
+        def found(**params):
+            response = APIClient().get('/api/books/', params)
+            self.assertEqual(response.status_code, 200)
+            return {item['id'] for item in response.data}
+
+        self.assertEqual(found(search='dune'), {str(dune.pk), str(messiah.pk)})
+        self.assertEqual(found(search='herb mess'), {str(messiah.pk)})
+        self.assertEqual(found(min_year=1966), {str(messiah.pk)})
+        self.assertEqual(found(search='Dune', max_year=1965), {str(dune.pk)})
+
+
+class RentalCreateTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.renter = User.objects.create_user('renter', password='secret-pass-1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.renter)
+
+    def request(self, book):
+        start = timezone.now() + timedelta(days=1)
+        return self.client.post('/api/rentals/', {
+            'book_id': str(book.pk), 'renter_id': str(self.renter.id),
+            'rental_start_date': start, 'rental_end_date': start + timedelta(days=2),
+        }, format='json')
+
+    def test_booking_errors_keep_their_status(self):
+        self.assertEqual(self.request(make_book(self.renter.id)).status_code, 400)
+
+        book = make_book(self.renter.id + 1, isbn='9780000000002')
+        self.assertEqual(self.request(book).status_code, 201)
+        response = self.request(book)
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('pending request', response.data['error'])
+
+    def test_past_and_fully_booked_dates_are_rejected(self):
+        book = make_book(self.renter.id + 1)
+        start = timezone.now() - timedelta(days=2)
+        response = self.client.post('/api/rentals/', {
+            'book_id': str(book.pk), 'renter_id': str(self.renter.id),
+            'rental_start_date': start, 'rental_end_date': start + timedelta(days=4),
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        start = timezone.now() + timedelta(days=1)
+        availability.change(book.pk, book.owner_id, start, start + timedelta(days=2), 1)
+        response = self.request(book)
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('fully booked', response.data['error'])
+
+
+class AnalyticsTests(MongoTestCase):
+    def test_backfill_counts_an_approval_on_the_day_it_happened(self):
+        now = timezone.now()
+        rental = make_rental(make_book(1), renter_id=2, status='ACTIVE', start=now + timedelta(days=5))
+        BookRental.objects(id=rental.pk).update_one(set__approved_at=now)
+
+        analytics.backfill(now - timedelta(days=1), now + timedelta(days=1), reset=True)
+
+        rollups = {doc['day']: doc for doc in OwnerDailyRollup._get_collection().find({'owner_id': 1})}
+        self.assertEqual(rollups[analytics.day_of(now)].get('approved'), 1)
+        self.assertNotIn(analytics.day_of(now + timedelta(days=5)), rollups)
+
+    def test_impossible_dates_are_rejected(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('owner', password='secret-pass-1'))
+        for url in ('/api/rentals/earnings/', '/api/rentals/book_stats/'):
+            self.assertEqual(client.get(url, {'start': '2024-13-01'}).status_code, 400)
+            self.assertEqual(client.get(url, {'end': 'soon'}).status_code, 400)
+
+
+class Recorder:
+    """Stands in for a Hub, recording what a broker dispatches."""
+
+    def __init__(self):
+        self.events = []
+
+    def dispatch_threadsafe(self, user_ids, text):
+        self.events.append(text)
+
+
+class MongoBrokerTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.broker = realtime.MongoBroker()
+        # Capped collections can't be emptied; use a fresh one per test
+        self.broker.collection_name = f'realtime_test_{ObjectId()}'
+
+    def test_subscriber_starts_after_the_newest_event(self):
+        self.broker.publish(['1'], 'old')
+        seen = self.broker.seen_so_far()
+        self.broker.publish(['1'], 'new')
+
+        target = Recorder()
+        self.broker.deliver(target, seen)
+        self.assertEqual(target.events, ['new'])
+
+    def test_resumed_tail_delivers_late_inserts_once(self):
+        seen = self.broker.seen_so_far()
+        self.broker.publish(['1'], 'a')
+        late = self.broker.next_number()  # numbered by another process, inserted later
+        self.broker.publish(['1'], 'c')
+        target = Recorder()
+        self.broker.deliver(target, seen)
+
+        self.broker.collection.insert_one({'s': late, 'u': ['1'], 'e': 'b', 't': timezone.now()})
+        self.broker.deliver(target, seen)
+
+        self.assertEqual(target.events, ['a', 'c', 'b'])
+
+
+class HubTests(TestCase):
+    def test_events_reach_the_users_connections(self):
+        hub = realtime.Hub()
+        ann, bob = hub.subscribe('1'), hub.subscribe('2')
+
+        hub.dispatch(['1'], 'event')
+
+        self.assertEqual(ann.queue.get_nowait(), 'event')
+        self.assertTrue(bob.queue.empty())
+        hub.unsubscribe(ann)
+        self.assertNotIn('1', hub.connections)
+
+    @override_settings(REALTIME_MAX_CONNECTIONS_PER_USER=1)
+    def test_connections_per_user_are_limited(self):
+        hub = realtime.Hub()
+        hub.subscribe('1')
+        with self.assertRaises(realtime.TooManyConnections):
+            hub.subscribe('1')
+
+    @override_settings(REALTIME_QUEUE_SIZE=2)
+    def test_full_queue_is_replaced_by_resync(self):
+        hub = realtime.Hub()
+        connection = hub.subscribe('1')
+        for text in ('a', 'b', 'c', 'd'):
+            hub.dispatch(['1'], text)
+
+        self.assertTrue(connection.overflowed)
+        self.assertEqual(connection.queue.get_nowait(), realtime.RESYNC)
+        self.assertTrue(connection.queue.empty())
+
+
+class RealtimeAuthenticationTests(TransactionTestCase):
+    def scope(self, cookie):
+        return {'headers': [(b'cookie', cookie.encode('latin-1'))]}
+
+    def test_session_cookie_authenticates(self):
+        user = User.objects.create_user('ann', password='secret-pass-1')
+        self.client.force_login(user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+        self.assertEqual(asyncio.run(realtime.authenticate(self.scope(cookie))), str(user.pk))
+
+        # Changing the password invalidates existing sessions
+        user.set_password('secret-pass-2')
+        user.save()
+        self.assertIsNone(asyncio.run(realtime.authenticate(self.scope(cookie))))
+
+    def test_missing_or_unknown_session_is_rejected(self):
+        self.assertIsNone(asyncio.run(realtime.authenticate(self.scope(''))))
+        self.assertIsNone(asyncio.run(realtime.authenticate(self.scope(f"{settings.SESSION_COOKIE_NAME}=nope"))))
+
+    @override_settings(CORS_ALLOWED_ORIGINS=['https://app.example.com'])
+    def test_foreign_origins_are_refused(self):
+        self.assertTrue(realtime.origin_allowed({'headers': [(b'origin', b'https://app.example.com')]}))
+        self.assertFalse(realtime.origin_allowed({'headers': [(b'origin', b'https://evil.example.com')]}))
+        self.assertTrue(realtime.origin_allowed({'headers': []}))
+
+
+class IdempotencyTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.renter = User.objects.create_user('renter', password='secret-pass-1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.renter)
+        self.book = make_book(self.renter.id + 1)
+
+    def request_rental(self, key, days=3):
+        return self.client.post(
+            f'/api/books/{self.book.pk}/request_rental/', {'days': days}, format='json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_the_first_response(self):
+        first = self.request_rental('key-1')
+        retry = self.request_rental('key-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(BookRental.objects(book=self.book.pk).count(), 1)
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self.request_rental('key-1')
+        self.assertEqual(self.request_rental('key-1', days=5).status_code, 422)
+
+
+class OutboxTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.applied = []
+        outbox.handler('test.ok')(lambda event: self.applied.append(event['_id']))
+        outbox.handler('test.fail')(self.fail_event)
+
+    def fail_event(self, event):
+        raise RuntimeError('boom')
+
+    def relayed(self, kind):
+        rental = make_rental(make_book(1), renter_id=2)
+        event = outbox.event(kind, rental_id=rental.pk)
+        BookRental.objects(id=rental.pk).update_one(push__outbox=event)
+        outbox.relay()
+        return event['id']
+
+    def state(self, event_id):
+        return OutboxEvent._get_collection().find_one({'_id': event_id})
+
+    def test_relay_moves_embedded_events_once(self):
+        event_id = self.relayed('test.ok')
+
+        self.assertEqual(self.state(event_id)['state'], outbox.PENDING)
+        self.assertEqual(BookRental._get_collection().count_documents({'outbox.id': {'$exists': True}}), 0)
+        self.assertEqual(outbox.relay(), 0)
+
+    def test_claimed_events_are_leased_and_applied(self):
+        event_id = self.relayed('test.ok')
+
+        claimed = outbox.claim()
+        self.assertEqual([doc['_id'] for doc in claimed], [event_id])
+        self.assertEqual(outbox.claim(), [])  # leased to the first caller
+        outbox.process(claimed)
+
+        self.assertEqual(self.applied, [event_id])
+        self.assertEqual(self.state(event_id)['state'], outbox.DONE)
+
+    def test_expired_lease_is_claimed_again(self):
+        event_id = self.relayed('test.ok')
+        outbox.claim()
+        OutboxEvent._get_collection().update_one(
+            {'_id': event_id}, {'$set': {'locked_until': timezone.now() - timedelta(seconds=1)}}
+        )
+        self.assertEqual([doc['_id'] for doc in outbox.claim()], [event_id])
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2)
+    def test_failures_back_off_then_give_up(self):
+        event_id = self.relayed('test.fail')
+
+        outbox.process(outbox.claim())
+        doc = self.state(event_id)
+        self.assertEqual((doc['state'], doc['attempts']), (outbox.PENDING, 1))
+        self.assertGreater(doc['available_at'], timezone.now().replace(tzinfo=None))
+        self.assertEqual(outbox.claim(), [])  # not due until the backoff ends
+
+        OutboxEvent._get_collection().update_one({'_id': event_id}, {'$set': {'available_at': timezone.now()}})
+        outbox.process(outbox.claim())
+        doc = self.state(event_id)
+        self.assertEqual((doc['state'], doc['attempts']), (outbox.FAILED, 2))
+        self.assertIn('boom', doc['last_error'])
+
+
+class CalendarTests(MongoTestCase):
+    start = datetime(2026, 11, 28, tzinfo=dt_timezone.utc)
+    end = datetime(2026, 12, 2, tzinfo=dt_timezone.utc)  # midnight: Dec 2 stays free
+
+    def calendar(self, book):
+        return Book._get_collection().find_one({'_id': book.pk})['calendar']
+
+    def free(self, first, last):
+        query = availability.window_filter(first, last)
+        return [doc['_id'] for doc in Book._get_collection().find(query)]
+
+    def test_days_spanning_months(self):
+        self.assertEqual(availability.occupied_days(self.start, self.end), (date(2026, 11, 28), date(2026, 12, 1)))
+        self.assertEqual(
+            availability.month_spans(date(2026, 11, 28), date(2026, 12, 1)), {'m202611': (27, 29), 'm202612': (0, 0)}
+        )
+
+    def test_fully_booked_days_are_masked_and_filtered(self):
+        book = make_book(1, copies=1)
+        availability.change(book.pk, book.owner_id, self.start, self.end, 1)
+
+        calendar = self.calendar(book)
+        self.assertEqual(calendar['m202611']['f'], 0b111 << 27)
+        self.assertEqual(calendar['m202612']['f'], 0b1)
+        self.assertEqual(self.free(date(2026, 11, 20), date(2026, 11, 27)), [book.pk])
+        self.assertEqual(self.free(date(2026, 11, 30), date(2026, 12, 3)), [])
+        self.assertEqual(self.free(date(2026, 12, 2), date(2026, 12, 5)), [book.pk])
+
+        availability.change(book.pk, book.owner_id, self.start, self.end, -1)
+        self.assertEqual(self.free(date(2026, 11, 30), date(2026, 12, 3)), [book.pk])
+
+    def test_a_copy_left_keeps_days_open_and_events_count_once(self):
+        book = make_book(1, copies=2)
+        event_id = ObjectId()
+        availability.change(book.pk, book.owner_id, self.start, self.end, 1, event_id=event_id)
+        availability.change(book.pk, book.owner_id, self.start, self.end, 1, event_id=event_id)
+
+        calendar = self.calendar(book)
+        self.assertEqual(calendar['m202611']['c'][27:30], [1, 1, 1])
+        self.assertEqual(calendar['m202611']['f'], 0)
+        self.assertEqual(self.free(date(2026, 11, 28), date(2026, 12, 1)), [book.pk])
+
+
+class ArchiveTests(MongoTestCase):
+    def returned(self, **fields):
+        rental = make_rental(make_book(1), renter_id=2, status='RETURNED')
+        BookRental._get_collection().update_one(
+            {'_id': rental.pk}, {'$set': dict({'updated_at': timezone.now() - timedelta(days=400)}, **fields)}
+        )
+        return rental
+
+    def test_rental_with_unapplied_relayed_event_stays_hot(self):
+        rental = self.returned()
+        event = outbox.event('rental.returned', rental_id=rental.pk)
+        BookRental.objects(id=rental.pk).update_one(push__outbox=event)
+        outbox.relay()
+
+        self.assertEqual(archive.sweep(archive.RENTALS, older_than=timedelta(days=365)), 0)
+        self.assertEqual(archive.RENTALS.cold.count_documents({}), 0)
+
+        OutboxEvent._get_collection().update_one({'_id': event['id']}, {'$set': {'state': outbox.DONE}})
+        self.assertEqual(archive.sweep(archive.RENTALS, older_than=timedelta(days=365)), 1)
+        self.assertIsNone(BookRental._get_collection().find_one({'_id': rental.pk}))
+
+    def test_merge_sorts_missing_values_apart(self):
+        approved = timezone.now() - timedelta(days=390)
+        archived = self.returned(approved_at=approved)
+        never_approved = self.returned(approved_at=None)
+        archive.sweep(archive.RENTALS, older_than=timedelta(days=365))
+        hot = self.returned(approved_at=approved + timedelta(days=1))
+
+        found = archive.find(archive.RENTALS, {}, [('approved_at', DESCENDING)])
+        self.assertEqual([doc['_id'] for doc in found], [hot.pk, archived.pk, never_approved.pk])
+        found = archive.find(archive.RENTALS, {}, [('approved_at', ASCENDING)])
+        self.assertEqual([doc['_id'] for doc in found], [never_approved.pk, archived.pk, hot.pk])
+
+
+class RecommendationTests(MongoTestCase):
+    def test_replayed_return_counts_once(self):
+        first = make_book(1)
+        second = make_book(1, isbn='9780000000002')
+        make_rental(first, renter_id=2, status='RETURNED')
+        make_rental(second, renter_id=2, status='RETURNED')
+
+        event_id = ObjectId()
+        recommendations.record_completed_rental(2, second, event_id=event_id)
+        recommendations.record_completed_rental(2, second, event_id=event_id)
+
+        collection = BookNeighbours._get_collection()
+        doc = collection.find_one({'book': second.pk})
+        self.assertEqual(doc['renter_count'], 1)
+        self.assertEqual([(n['book'], n['score']) for n in doc['neighbours']], [(first.pk, 1.0)])
+        doc = collection.find_one({'book': first.pk})
+        self.assertEqual([(n['book'], n['score']) for n in doc['neighbours']], [(second.pk, 1.0)])
+
+
+class CatalogPlanTests(TestCase):
+    def plan(self, **params):
+        return catalog.CatalogQuery.from_params(params).plan()
+
+    def test_equality_keys_then_one_range(self):
+        self.assertEqual(self.plan(category='Fiction', min_price='2'), 'catalog_category_price')
+        self.assertEqual(self.plan(language='French', condition='GOOD'), 'catalog_language_condition_price')
+        self.assertEqual(self.plan(condition='GOOD', max_price='5'), 'catalog_condition_price')
+        self.assertEqual(self.plan(tags='sci-fi'), 'catalog_tags_price')
+        self.assertEqual(self.plan(min_price='1'), 'catalog_price')
+        self.assertEqual(self.plan(search='dune'), 'catalog_terms_price')
+        self.assertEqual(self.plan(min_year='2000'), 'catalog_work_year_price')
+        self.assertIsNone(self.plan(language='French'))
+        self.assertIsNone(self.plan())
+
+    def test_planned_indexes_are_declared(self):
+        declared = {spec.get('name') for spec in Book._meta['index_specs']}
+        for name, keys in catalog.CATALOG_INDEXES:
+            self.assertIn(name, declared)
+
+    def test_bad_values_are_rejected(self):
+        for params in ({'min_price': 'NaN'}, {'max_price': 'cheap'}, {'min_year': '20th'}, {'ordering': 'title'}):
+            with self.assertRaises(DRFValidationError):
+                catalog.CatalogQuery.from_params(params)
+
+
+class CentsFieldTests(TestCase):
+    field = Book._fields['price_per_day']
+
+    def test_amounts_are_stored_as_cents(self):
+        self.assertEqual(self.field.to_mongo(Decimal('2.50')), 250)
+        self.assertEqual(self.field.to_mongo('0.1'), 10)
+        self.assertEqual(self.field.to_python(250), Decimal('2.50'))
+        self.assertEqual(self.field.to_python(self.field.to_mongo(Decimal('19.99'))), Decimal('19.99'))
+
+    def test_queries_compare_cents(self):
+        query = Book.objects(price_per_day__gte=Decimal('1.5'), price_per_day__lt='3')._query
+        self.assertEqual(query, {'price_cents': {'$gte': 150, '$lt': 300}})
+
+    def test_negative_amounts_are_invalid(self):
+        with self.assertRaises(mongoengine.ValidationError):
+            self.field.validate(Decimal('-0.01'))
+
+
+class CatalogTests(MongoTestCase):
+    def test_only_catalog_actions_parse_filters(self):
+        book = make_book(1)
+        client = APIClient()
+        self.assertEqual(client.get('/api/books/', {'min_price': 'cheap'}).status_code, 400)
+        self.assertEqual(client.get(f'/api/books/{book.pk}/', {'min_price': 'cheap'}).status_code, 200)
+
+    def test_list_shows_the_smallest_cover(self):
+        book = make_book(1)
+        digest = 'ab' * 32
+        works.ensure(book.isbn, {
+            'title': 'Dune', 'author': 'Frank Herbert', 'cover_image': covers.url_for(digest, 'jpg'),
+        })
+
+        listed = APIClient().get('/api/books/').data[0]
+        self.assertEqual(listed['cover_image'], covers.url_for(digest, 'jpg', 'sm'))
+        detail = APIClient().get(f'/api/books/{book.pk}/').data
+        self.assertEqual(detail['cover_image'], covers.url_for(digest, 'jpg'))
+
+
+class CursorTests(TestCase):
+    def test_round_trip(self):
+        created_at, last_id = datetime(2026, 1, 2, tzinfo=dt_timezone.utc), ObjectId()
+        cursor = pagination.encode_cursor(created_at, last_id)
+        self.assertEqual(pagination.decode_cursor(cursor, 2), [created_at, last_id])
+
+    def test_operator_values_are_rejected(self):
+        for values in ([{'$gt': ''}, ObjectId()], [None, ObjectId()], [True, 'x']):
+            cursor = base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+            with self.assertRaises(pagination.InvalidCursor):
+                pagination.decode_cursor(cursor, 2)
+
+
+class FakeCollection:
+    """Records bulk writes; fails the first `failures` of them."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.writes = []
+
+    def bulk_write(self, operations, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('database unavailable')
+        self.writes.append(list(operations))
+
+
+class CounterBufferTests(TestCase):
+    def setUp(self):
+        self.rollups, self.scores = FakeCollection(), FakeCollection()
+        for document, collection in ((BookDailyRollup, self.rollups), (BookScore, self.scores)):
+            patcher = mock.patch.object(document, '_get_collection', return_value=collection)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.day = analytics.day_of(timezone.now())
+
+    def book(self, category='Fiction'):
+        return SimpleNamespace(pk=ObjectId(), owner_id=1, category=category)
+
+    def rollup(self, book, views=0, impressions=0):
+        return UpdateOne(
+            {'book': book.pk, 'day': self.day},
+            {'$inc': {counters.VIEWS: views, counters.IMPRESSIONS: impressions}, '$setOnInsert': {'owner_id': 1}},
+            upsert=True
+        )
+
+    def wait_for_write(self):
+        for _ in range(100):
+            if self.rollups.writes:
+                return self.rollups.writes
+            time.sleep(0.02)
+        self.fail('the buffer was not flushed')
+
+    def test_reaching_max_keys_wakes_the_flusher(self):
+        buffer = counters.CounterBuffer(flush_seconds=3600, max_keys=2)
+        first, second = self.book(), self.book()
+        buffer.add(first, counters.VIEWS)
+        buffer.add(first, counters.IMPRESSIONS, 3)
+        buffer.add(second, counters.VIEWS)
+
+        self.assertEqual(self.wait_for_write(), [[self.rollup(first, 1, 3), self.rollup(second, 1)]])
+        self.assertEqual(buffer.stats()['pending_keys'], 0)
+
+    def test_interval_flushes_a_single_key(self):
+        buffer = counters.CounterBuffer(flush_seconds=0.05, max_keys=100)
+        book = self.book()
+        buffer.add(book, counters.IMPRESSIONS)
+
+        self.assertEqual(self.wait_for_write(), [[self.rollup(book, impressions=1)]])
+
+    def test_failed_flush_is_retried_once_without_loss(self):
+        self.rollups.failures = 1
+        buffer = counters.CounterBuffer(flush_seconds=3600, max_keys=100)
+        book = self.book()
+        buffer.add(book, counters.VIEWS, 2)
+
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.stats()['pending_increments'], 2)
+        buffer.add(book, counters.VIEWS)
+        self.assertEqual(buffer.flush(), 3)
+
+        self.assertEqual(self.rollups.writes, [[self.rollup(book, views=3)]])
+        self.assertEqual(len(self.scores.writes), 1)
+        self.assertEqual((buffer.flushed, buffer.failed_flushes), (3, 1))
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_failed_score_write_keeps_the_rollups_applied_once(self):
+        self.scores.failures = 1
+        buffer = counters.CounterBuffer(flush_seconds=3600, max_keys=100)
+        book = self.book()
+        buffer.add(book, counters.VIEWS)
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(self.rollups.writes, [[self.rollup(book, views=1)]])
+        self.assertEqual(buffer.failed_flushes, 1)
+
+
+class ModerationTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.book = make_book(1)
+
+    def review(self, reported=True, hidden=False, **fields):
+        review = BookReview(book=self.book, reviewer_id=2, rating=4, hidden=hidden, **fields).save()
+        if reported:
+            moderation.report({'pk': review.pk}, 'spam', reporter_id=3)
+        return review
+
+    def statuses(self, review_ids, action):
+        return [result['status'] for result in moderation.apply(review_ids, action, moderator_id=9)]
+
+    def stored(self, review):
+        return BookReview._get_collection().find_one({'_id': review.pk})
+
+    def test_per_id_statuses(self):
+        reported = self.review()
+        legacy = self.review(legacy_id=str(uuid.uuid4()))
+        unreported = self.review(reported=False)
+
+        requested = [str(reported.pk), legacy.legacy_id, str(unreported.pk), str(ObjectId())]
+        self.assertEqual(
+            self.statuses(requested, moderation.RESOLVE), ['resolved', 'resolved', 'invalid_state', 'not_found']
+        )
+        self.assertEqual(self.statuses([str(reported.pk)], 'delete'), ['invalid_action'])
+        self.assertNotIn('reported_at', self.stored(legacy))
+
+    def test_hide_and_unhide_write_outbox_events(self):
+        review = self.review()
+
+        self.assertEqual(self.statuses([str(review.pk)], moderation.HIDE), ['hidden'])
+        doc = self.stored(review)
+        self.assertEqual((doc['hidden'], doc['reported']), (True, False))
+        self.assertEqual([event['kind'] for event in doc['outbox']], [handlers.REVIEW_HIDDEN])
+
+        self.assertEqual(self.statuses([str(review.pk)], moderation.HIDE), ['invalid_state'])
+        self.assertEqual(self.statuses([str(review.pk)], moderation.UNHIDE), ['unhidden'])
+        kinds = [event['kind'] for event in self.stored(review)['outbox']]
+        self.assertEqual(kinds, [handlers.REVIEW_HIDDEN, handlers.REVIEW_RESTORED])
+
+    def test_hiding_a_hidden_review_reported_again_dequeues_it(self):
+        review = self.review(hidden=True)
+
+        self.assertEqual(self.statuses([str(review.pk)], moderation.HIDE), ['hidden'])
+        doc = self.stored(review)
+        self.assertEqual((doc['hidden'], doc['reported']), (True, False))
+        self.assertNotIn('reported_at', doc)
+        self.assertNotIn('outbox', doc)
+        self.assertEqual(moderation.queue(10)[0], [])
+
+    def test_queue_pages_oldest_report_first(self):
+        reviews = [self.review() for _ in range(3)]
+
+        page, cursor = moderation.queue(2)
+        self.assertEqual([review.pk for review in page], [reviews[0].pk, reviews[1].pk])
+        page, cursor = moderation.queue(2, cursor)
+        self.assertEqual(([review.pk for review in page], cursor), ([reviews[2].pk], None))
+
+
+class OverdueTests(MongoTestCase):
+    def test_dashboard_and_overdue_list_agree(self):
+        renter = User.objects.create_user('renter', password='secret-pass-1')
+        book = make_book(renter.id + 1)
+        now = timezone.now()
+        overdue = make_rental(book, renter.id, status='ACTIVE', start=now - timedelta(days=5))
+        make_rental(book, renter.id, status='ACTIVE', start=now - timedelta(days=1))
+        make_rental(book, renter.id, status='RETURNED', start=now - timedelta(days=5))
+        client = APIClient()
+        client.force_authenticate(renter)
+
+        listed = client.get('/api/rentals/overdue/').data
+        self.assertEqual([rental['id'] for rental in listed], [str(overdue.pk)])
+        bucket = client.get('/api/rentals/dashboard/', {'buckets': 'active,overdue'}).data
+        self.assertEqual((bucket['active']['count'], bucket['overdue']['count']), (2, 1))
+        self.assertEqual([rental['id'] for rental in bucket['overdue']['results']], [str(overdue.pk)])
+
+
+class StartupTests(TestCase):
+    def test_documents_leave_indexes_to_deploy_time(self):
+        for document in documents():
+            self.assertFalse(document._meta.get('auto_create_index'), document.__name__)
+
+    def test_connect_is_lazy(self):
+        with mock.patch.object(mongoengine, 'connect') as connect:
+            mongo.connect()
+        self.assertFalse(connect.call_args.kwargs['connect'])
+
+    def test_warm_loads_the_urlconf_unless_disabled(self):
+        with mock.patch('django.urls.get_resolver') as get_resolver:
+            with override_settings(STARTUP_WARMUP=False):
+                startup.warm()
+            get_resolver.assert_not_called()
+            startup.warm()
+            get_resolver.assert_called_once_with()
+
+
+class IndexCheckTests(MongoTestCase):
+    def test_check_reports_missing_indexes(self):
+        call_command('ensure_indexes', '--check', stdout=StringIO())
+
+        Book._get_collection().drop_index('catalog_price')
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('ensure_indexes', '--check', stdout=out)
+        self.assertIn('missing', out.getvalue())
+
+
+class ShardingPlanTests(TestCase):
+    def test_unique_indexes_start_with_the_shard_key(self):
+        for document, key in sharding.PLAN:
+            unique = [spec for spec in document._meta['index_specs'] if spec.get('unique')]
+            self.assertTrue(unique, document.__name__)
+            for spec in unique:
+                self.assertEqual(spec['fields'][0][0], next(iter(key)), spec)
+
+    def test_retired_indexes_are_no_longer_declared(self):
+        for document, names in sharding.RETIRED_INDEXES.items():
+            declared = {spec.get('name') for spec in document._meta['index_specs']}
+            self.assertFalse(declared & set(names), document.__name__)
+
+    def test_shard_keys_match_the_documents(self):
+        for document, key in sharding.PLAN:
+            self.assertEqual(tuple(key), tuple(document._meta['shard_key']))
+
+
+class ShardRoutingTests(MongoTestCase):
+    def test_hot_path_queries_carry_the_shard_key(self):
+        make_rental(make_book(1), renter_id=2)
+
+        queries = sharding.hot_path_queries()
+        self.assertEqual(len(queries), 6)
+        keys = dict(sharding.PLAN)
+        for description, document, query in queries:
+            self.assertTrue(set(keys[document]) <= set(query), description)
+
+
+class ExportTests(TestCase):
+    def test_values_convert_to_column_types(self):
+        naive = datetime(2026, 3, 1, 12, 0)
+        self.assertEqual(export._convert('time', naive), naive.replace(tzinfo=dt_timezone.utc))
+        self.assertEqual(export._convert('id', ObjectId('0' * 24)), '0' * 24)
+        self.assertEqual(export._convert('strings', ('a', 1)), ['a', '1'])
+        self.assertIsNone(export._convert('int', 'many'))
+        self.assertIsNone(export._convert('float', None))
+
+    def test_watermarks_round_trip(self):
+        with tempfile.TemporaryDirectory() as output:
+            self.assertEqual(export.read_watermarks(output), {})
+            when = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+            export.write_watermark(output, 'rentals', when)
+            export.write_watermark(output, 'reviews', when + timedelta(days=1))
+            self.assertEqual(export.read_watermarks(output), {'rentals': when, 'reviews': when + timedelta(days=1)})
+
+    @override_settings(ARCHIVE_RENTALS_AFTER_DAYS=30)
+    def test_archive_is_read_by_full_runs_and_stale_watermarks(self):
+        until = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        rentals = export.DATASETS['rentals']
+        self.assertTrue(export.includes_archive(rentals, None, until))
+        self.assertTrue(export.includes_archive(rentals, until - timedelta(days=31), until))
+        self.assertFalse(export.includes_archive(rentals, until - timedelta(days=1), until))
+        self.assertFalse(export.includes_archive(export.DATASETS['books'], None, until))
+
+
+class ExportRunTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        if importlib.util.find_spec('pyarrow') is None:
+            self.skipTest('pyarrow is not installed')
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output)
+
+    def rental(self, owner_id, updated_at):
+        rental = make_rental(make_book(owner_id), renter_id=9)
+        BookRental._get_collection().update_one({'_id': rental.pk}, {'$set': {'updated_at': updated_at}})
+        return rental
+
+    def test_months_are_exported_once_then_incrementally(self):
+        import pyarrow.parquet as pq
+
+        now = datetime.now(dt_timezone.utc)
+        old = self.rental(1, now - timedelta(days=40))
+        self.rental(2, now - timedelta(days=1))
+
+        total, paths = export.export('rentals', self.output)
+        self.assertEqual((total, len(paths)), (2, 2))
+        ids = {row for path in paths for row in pq.read_table(path).column('id').to_pylist()}
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(export.export('rentals', self.output), (0, []))
+
+        # Changed after the watermark, and older than the settle time
+        export.write_watermark(self.output, 'rentals', now - timedelta(hours=2))
+        BookRental._get_collection().update_one({'_id': old.pk}, {'$set': {'updated_at': now - timedelta(hours=1)}})
+        total, paths = export.export('rentals', self.output)
+        self.assertEqual(total, 1)
+        self.assertEqual(pq.read_table(paths[0]).column('id').to_pylist(), [str(old.pk)])
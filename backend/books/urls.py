@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested import routers
-from .views import BookViewSet, BookRentalViewSet, BookReviewViewSet
+from .views import BookViewSet, BookRentalViewSet, BookReviewViewSet, BookReviewsViewSet
 
 # Create a router for the main endpoints
 router = DefaultRouter()
@@ -9,6 +9,11 @@ router.register(r'books', BookViewSet, basename='book')
 router.register(r'rentals', BookRentalViewSet, basename='rental')
 router.register(r'reviews', BookReviewViewSet, basename='review')
 
+# Endpoints nested under a book
+books_router = routers.NestedDefaultRouter(router, r'books', lookup='book')
+books_router.register(r'reviews', BookReviewsViewSet, basename='book-reviews')
+
 urlpatterns = [
     path('', include(router.urls)),
+    path('', include(books_router.urls)),
 ] 
\ No newline at end of file
@@ -1,18 +1,39 @@
 from django.shortcuts import render
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
 from rest_framework import viewsets, status, permissions, filters
 from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 from .models import Book, BookRental, BookReview
-from .serializers import BookSerializer, BookRentalSerializer, BookReviewSerializer
+from .serializers import (
+    BookSerializer, BookRentalSerializer, BookReviewSerializer, ModerationReviewSerializer, NestedBookReviewSerializer
+)
+from . import analytics, archive, booking, bulk, counters, covers, dashboard, handlers, ids, inventory, moderation, outbox, rankings, ratings, recommendations, works
+from .catalog import CatalogQuery
+from .idempotency import idempotent
+from .pagination import InvalidCursor, after, decode_cursor, encode_cursor, get_limit
 from mongoengine.queryset.visitor import Q
-from rest_framework.filters import SearchFilter, OrderingFilter
 from django.core.exceptions import ValidationError
+from django.utils.dateparse import parse_date
 import logging
+import mimetypes
+import os
 
 logger = logging.getLogger(__name__)
 
+MAX_BATCH_SIZE = 100
+
+# Rentals that no longer hold calendar days or a copy
+CLOSED_STATUSES = ['REJECTED', 'RETURNED']
+
+
+def include_archived(request):
+    return request.query_params.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
 class IsOwnerOrReadOnly(permissions.BasePermission):
     """
     Custom permission to only allow owners of an object to edit it.
@@ -32,6 +53,9 @@ class MongoModelViewSet(viewsets.ViewSet):
     def get_queryset(self):
         return self.document_class.objects.all()
 
+    def get_object(self):
+        return self.get_queryset().get(**ids.lookup(self.kwargs['pk']))
+
     def list(self, request):
         try:
             queryset = self.get_queryset()
@@ -44,6 +68,7 @@ class MongoModelViewSet(viewsets.ViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @idempotent
     def create(self, request):
         try:
             serializer = self.serializer_class(data=request.data)
@@ -51,6 +76,8 @@ class MongoModelViewSet(viewsets.ViewSet):
                 self.perform_create(serializer)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        except booking.BookingError as e:
+            return Response({'error': e.message}, status=e.status_code)
         except Exception as e:
             logger.error(f"Error in create view: {str(e)}")
             return Response(
@@ -60,7 +87,7 @@ class MongoModelViewSet(viewsets.ViewSet):
 
     def retrieve(self, request, pk=None):
         try:
-            instance = self.document_class.objects.get(id=pk)
+            instance = self.document_class.objects.get(**ids.lookup(pk))
             serializer = self.serializer_class(instance)
             return Response(serializer.data)
         except self.document_class.DoesNotExist:
@@ -77,7 +104,7 @@ class MongoModelViewSet(viewsets.ViewSet):
 
     def update(self, request, pk=None):
         try:
-            instance = self.document_class.objects.get(id=pk)
+            instance = self.document_class.objects.get(**ids.lookup(pk))
             serializer = self.serializer_class(instance, data=request.data)
             if serializer.is_valid():
                 serializer.save()
@@ -97,7 +124,7 @@ class MongoModelViewSet(viewsets.ViewSet):
 
     def destroy(self, request, pk=None):
         try:
-            instance = self.document_class.objects.get(id=pk)
+            instance = self.document_class.objects.get(**ids.lookup(pk))
             instance.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         except self.document_class.DoesNotExist:
@@ -116,16 +143,57 @@ class BookViewSet(MongoModelViewSet):
     serializer_class = BookSerializer
     document_class = Book
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
-    filter_backends = [SearchFilter, OrderingFilter]
-    search_fields = ['title', 'author', 'description', 'category', 'tags']
-    ordering_fields = ['title', 'publication_year', 'price_per_day', 'rating', 'created_at']
+    # Actions that filter the catalog by the query parameters
+    catalog_actions = ('list', 'search', 'my_books', 'available')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Parse catalog filters up front so bad values are a 400, not a 500;
+        # other actions don't read them
+        self.catalog = None
+        if self.action in self.catalog_actions:
+            self.catalog = CatalogQuery.from_params(request.query_params)
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        # Apply search and ordering filters
-        for backend in list(self.filter_backends):
-            queryset = backend().filter_queryset(self.request, queryset, self)
-        return queryset
+        if self.catalog is None:
+            return queryset
+        # Apply catalog filters, search and ordering; only the catalog itself
+        # (list and search) runs on the planned index, my_books and available
+        # add filters of their own
+        return self.catalog.apply(queryset, hint=self.action in ('list', 'search'))
+
+    def list(self, request):
+        try:
+            books = list(self.get_queryset())
+            serializer = self.serializer_class(books, many=True)
+            data = serializer.data
+            counters.record_impressions(books)
+            return Response(data)
+        except Exception as e:
+            logger.error(f"Error in list view: {str(e)}")
+            return Response(
+                {"error": "Failed to retrieve items"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    def retrieve(self, request, pk=None):
+        try:
+            instance = self.document_class.objects.get(**ids.lookup(pk))
+            data = self.serializer_class(instance).data
+            counters.record_view(instance)
+            return Response(data)
+        except self.document_class.DoesNotExist:
+            return Response(
+                {"error": "Item not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except Exception as e:
+            logger.error(f"Error in retrieve view: {str(e)}")
+            return Response(
+                {"error": "Failed to retrieve item"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
 
     def perform_create(self, serializer):
         try:
@@ -148,10 +216,168 @@ class BookViewSet(MongoModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        try:
+            queryset = self.get_queryset()
+            results = list(queryset.limit(get_limit(request, default=50, maximum=200)))
+            counters.record_impressions(results)
+            return Response({
+                'results': self.serializer_class(results, many=True).data,
+                'price_histogram': self.catalog.price_histogram(queryset),
+                'index': self.catalog.plan()
+            })
+        except Exception as e:
+            logger.error(f"Error in book search: {str(e)}")
+            return Response(
+                {"error": "Failed to search books"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    def _ranking_response(self, kind, request):
+        try:
+            ranking = rankings.get_ranking(kind, request.query_params.get('category'))
+            if ranking is None:
+                return Response({'results': [], 'refreshed_at': None})
+            return Response({
+                'results': ranking.entries,
+                'refreshed_at': ranking.refreshed_at
+            })
+        except Exception as e:
+            logger.error(f"Error in {kind} rankings: {str(e)}")
+            return Response(
+                {"error": "Failed to retrieve rankings"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def counter_stats(self, request):
+        """This process's view/impression buffer: pending increments, lag, drops."""
+        return Response(counters.buffer.stats())
+
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        return self._ranking_response(rankings.TRENDING, request)
+
+    @action(detail=False, methods=['get'])
+    def top_rated(self, request):
+        return self._ranking_response(rankings.TOP_RATED, request)
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    @idempotent
+    def request_rental(self, request, pk=None):
+        try:
+            days = int(request.data.get('days', 0))
+            if days < 1:
+                return Response(
+                    {'error': 'days must be a positive integer'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            start = None
+            if request.data.get('start_date'):
+                start = parse_date(str(request.data['start_date']))
+                if start is None:
+                    return Response(
+                        {'error': 'start_date must be YYYY-MM-DD'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                start = timezone.make_aware(datetime.combine(start, time.min))
+
+            rental = booking.request_rental_for_days(pk, request.user.id, days, start)
+            return Response(BookRentalSerializer(rental).data, status=status.HTTP_201_CREATED)
+        except booking.BookingError as e:
+            return Response({'error': e.message}, status=e.status_code)
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'days must be a positive integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            logger.error(f"Error in request_rental: {str(e)}")
+            return Response(
+                {"error": "Failed to request rental"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        requested = [i for i in request.query_params.get('ids', '').split(',') if i]
+        if not requested:
+            return Response({'error': 'ids is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(requested) > MAX_BATCH_SIZE:
+            return Response(
+                {'error': f'At most {MAX_BATCH_SIZE} ids per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            found = {}
+            for book in Book.objects(__raw__=ids.query_many(requested)):
+                found[str(book.pk)] = book
+                if book.legacy_id:
+                    found[book.legacy_id] = book
+            ordered = [found[i] for i in requested if i in found]
+            return Response({
+                'results': self.serializer_class(ordered, many=True).data,
+                'missing': [i for i in requested if i not in found]
+            })
+        except Exception as e:
+            logger.error(f"Error in batch books: {str(e)}")
+            return Response(
+                {"error": "Failed to retrieve books"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @action(detail=True, methods=['post'], parser_classes=[MultiPartParser, FormParser])
+    def cover(self, request, pk=None):
+        try:
+            book = self.get_object()
+            if str(book.owner_id) != str(request.user.id):
+                return Response(
+                    {"error": "Only the book owner can change its cover"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            upload = request.FILES.get('cover')
+            if upload is None:
+                return Response(
+                    {'error': 'Upload the image as the "cover" field'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            digest, ext = covers.store(upload)
+            works.update_metadata(book.isbn, {'cover_image': covers.url_for(digest, ext)}, book.owner_id)
+            return Response(self.serializer_class(book).data)
+        except covers.InvalidCover as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Book.DoesNotExist:
+            return Response({"error": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            logger.error(f"Error uploading cover: {str(e)}")
+            return Response(
+                {"error": "Failed to upload cover"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @action(detail=True, methods=['get'])
+    def recommendations(self, request, pk=None):
+        try:
+            limit = min(int(request.query_params.get('limit', recommendations.top_n())), 100)
+            return Response({'results': recommendations.recommendations_for(pk, limit)})
+        except ValueError:
+            return Response(
+                {"error": "limit must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            logger.error(f"Error in recommendations: {str(e)}")
+            return Response(
+                {"error": "Failed to retrieve recommendations"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
     @action(detail=False, methods=['get'])
     def available(self, request):
         try:
             queryset = self.get_queryset().filter(
+                copies_available__gt=0,
                 available_for_rent=True,
                 owner_id__ne=str(request.user.id)
             )
@@ -168,6 +394,7 @@ class BookRentalViewSet(MongoModelViewSet):
     serializer_class = BookRentalSerializer
     document_class = BookRental
     permission_classes = [permissions.IsAuthenticated]
+    newest_first = [('created_at', -1), ('_id', -1)]
 
     def get_queryset(self):
         user_id = str(self.request.user.id)
@@ -175,30 +402,71 @@ class BookRentalViewSet(MongoModelViewSet):
             Q(renter_id=user_id) | Q(book_owner_id=user_id)
         )
 
+    def list(self, request):
+        if not include_archived(request):
+            return super().list(request)
+        try:
+            user_id = request.user.id
+            docs = archive.find(
+                archive.RENTALS,
+                {'$or': [{'renter_id': user_id}, {'book_owner_id': user_id}]},
+                self.newest_first
+            )
+            serializer = self.serializer_class([BookRental._from_son(doc) for doc in docs], many=True)
+            return Response(serializer.data)
+        except Exception as e:
+            logger.error(f"Error in list view: {str(e)}")
+            return Response(
+                {"error": "Failed to retrieve items"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    def retrieve(self, request, pk=None):
+        response = super().retrieve(request, pk)
+        if response.status_code != status.HTTP_404_NOT_FOUND:
+            return response
+        # Finished rentals may have been moved to the archive
+        doc = archive.get(archive.RENTALS, ids.query(pk))
+        if doc is None or request.user.id not in (doc.get('renter_id'), doc.get('book_owner_id')):
+            return response
+        return Response(self.serializer_class(BookRental._from_son(doc)).data)
+
+    def _unsettled(self, pk):
+        """
+        The error response for editing or deleting rental `pk`, or None if it
+        may be. An open rental, or one with events still to apply, is counted
+        in its book's calendar and may hold a copy; changing its dates or
+        deleting it would leave them counted.
+        """
+        rental = self.get_queryset().filter(**ids.lookup(pk)).only('id', 'status').first()
+        if rental is None:
+            return Response({"error": "Item not found"}, status=status.HTTP_404_NOT_FOUND)
+        if rental.status in CLOSED_STATUSES and outbox.settled(BookRental, rental.pk, 'rental_id'):
+            return None
+        return Response(
+            {'error': 'Open rentals cannot be changed or deleted'},
+            status=status.HTTP_409_CONFLICT
+        )
+
+    def update(self, request, pk=None):
+        return self._unsettled(pk) or super().update(request, pk)
+
+    def destroy(self, request, pk=None):
+        return self._unsettled(pk) or super().destroy(request, pk)
+
     def perform_create(self, serializer):
         try:
-            # Get the book details first
-            book_id = serializer.validated_data.get('book_id')
-            book = Book.objects.get(id=book_id)
-            
-            if not book.available_for_rent:
-                raise ValidationError("This book is not available for rent")
-            
-            # Set required fields
+            # The serializer validates the book, prices and inserts in one pass
             serializer.validated_data['renter_id'] = str(self.request.user.id)
-            serializer.validated_data['book_owner_id'] = str(book.owner_id)
-            serializer.validated_data['status'] = 'PENDING'
-            
-            # Create the rental
             serializer.save()
-            
-        except Book.DoesNotExist:
-            raise ValidationError("Book not found")
+        except booking.BookingError:
+            raise
         except Exception as e:
             logger.error(f"Error in rental creation: {str(e)}")
             raise ValidationError("Failed to create rental")
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def approve_rental(self, request, pk=None):
         try:
             rental = self.get_object()
@@ -215,18 +483,44 @@ class BookRentalViewSet(MongoModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+            # Reserve a copy first; the guarded update is what prevents two
+            # approvals from handing out the same last copy.
+            book_id = rental.to_mongo()['book']
+            if not inventory.reserve_copy(book_id, rental.pk, rental.book_owner_id):
+                return Response(
+                    {'error': 'No copies of this book are available'},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+            approval = outbox.event(handlers.RENTAL_APPROVED, rental_id=rental.pk, renter_id=rental.renter_id)
+            now = approval['at']
+            approved = BookRental.objects(id=rental.pk, renter_id=rental.renter_id, status='PENDING').update_one(
+                set__status='ACTIVE',
+                set__owner_approval=True,
+                set__approved_at=now,
+                set__updated_at=now,
+                push__outbox=approval
+            )
+            if not approved:
+                inventory.release_copy(book_id, rental.pk, rental.book_owner_id)
+                return Response(
+                    {'error': 'This rental cannot be approved'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
             rental.status = 'ACTIVE'
             rental.owner_approval = True
-            rental.save()
-
-            # Update book availability
-            book = rental.book
-            book.available_for_rent = False
-            book.save()
+            rental.approved_at = now
+            rental.updated_at = now
 
             serializer = self.serializer_class(rental)
             return Response(serializer.data)
             
+        except BookRental.DoesNotExist:
+            return Response(
+                {"error": "Item not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
         except Exception as e:
             logger.error(f"Error in approve_rental: {str(e)}")
             return Response(
@@ -235,6 +529,7 @@ class BookRentalViewSet(MongoModelViewSet):
             )
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def reject_rental(self, request, pk=None):
         try:
             rental = self.get_object()
@@ -251,12 +546,29 @@ class BookRentalViewSet(MongoModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+            now = timezone.now()
+            rejected = BookRental.objects(id=rental.pk, renter_id=rental.renter_id, status='PENDING').update_one(
+                set__status='REJECTED',
+                set__updated_at=now,
+                push__outbox=outbox.event(handlers.RENTAL_REJECTED, rental_id=rental.pk, renter_id=rental.renter_id)
+            )
+            if not rejected:
+                return Response(
+                    {'error': 'This rental cannot be rejected'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
             rental.status = 'REJECTED'
-            rental.save()
+            rental.updated_at = now
 
             serializer = self.serializer_class(rental)
             return Response(serializer.data)
             
+        except BookRental.DoesNotExist:
+            return Response(
+                {"error": "Item not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
         except Exception as e:
             logger.error(f"Error in reject_rental: {str(e)}")
             return Response(
@@ -265,6 +577,7 @@ class BookRentalViewSet(MongoModelViewSet):
             )
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def return_book(self, request, pk=None):
         try:
             rental = self.get_object()
@@ -281,18 +594,34 @@ class BookRentalViewSet(MongoModelViewSet):
                     status=status.HTTP_403_FORBIDDEN
                 )
 
-            rental.actual_return_date = timezone.now()
-            rental.status = 'RETURNED'
-            rental.save()
-
-            # Update book availability
-            book = rental.book
-            book.available_for_rent = True
-            book.save()
+            # The copy goes back to the pool when the outbox event is applied
+            now = timezone.now()
+            returned = BookRental.objects(id=rental.pk, renter_id=rental.renter_id, status='ACTIVE').update_one(
+                set__return_date=now,
+                set__status='RETURNED',
+                set__updated_at=now,
+                push__outbox=outbox.event(
+                    handlers.RENTAL_RETURNED, rental_id=rental.pk, renter_id=rental.renter_id,
+                    book_id=rental.to_mongo()['book']
+                )
+            )
+            if not returned:
+                return Response(
+                    {'error': 'This rental cannot be returned'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
+            rental.return_date = now
+            rental.status = 'RETURNED'
+            rental.updated_at = now
             serializer = self.serializer_class(rental)
             return Response(serializer.data)
             
+        except BookRental.DoesNotExist:
+            return Response(
+                {"error": "Item not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
         except Exception as e:
             logger.error(f"Error in return_book: {str(e)}")
             return Response(
@@ -300,10 +629,117 @@ class BookRentalViewSet(MongoModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['post'])
+    @idempotent
+    def batch(self, request):
+        """
+        Approve or reject many rental requests at once.
+
+        Body: {"items": [{"id": ..., "action": "approve" | "reject"}, ...]}
+        or {"action": ..., "ids": [...]}. Returns a status per item.
+        """
+        items = request.data.get('items')
+        if items is None:
+            items = [{'id': i, 'action': request.data.get('action')} for i in request.data.get('ids', [])]
+        if not items or len(items) > MAX_BATCH_SIZE:
+            return Response(
+                {'error': f'Provide between 1 and {MAX_BATCH_SIZE} items'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            return Response({'results': self._apply_batch(items, request.user.id)})
+        except Exception as e:
+            logger.error(f"Error in batch rentals: {str(e)}")
+            return Response(
+                {"error": "Failed to update rentals"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    def _apply_batch(self, items, user_id):
+        collection = BookRental._get_collection()
+        rentals = {}
+        for doc in collection.find(ids.query_many(item.get('id') for item in items)):
+            rentals[str(doc['_id'])] = BookRental._from_son(doc)
+            if doc.get('legacy_id'):
+                rentals[doc['legacy_id']] = rentals[str(doc['_id'])]
+        stamp = bulk.write_stamp()
+        results = {}
+        updates = {}
+        reserved = {}
+        requested_as = {}  # pk -> the id the item used
+        seen = set()
+
+        for item in items:
+            rental_id, action_name = str(item.get('id')), item.get('action')
+            if rental_id in seen:
+                continue  # a repeated id is reported with its first item
+            seen.add(rental_id)
+            rental = rentals.get(rental_id)
+            if action_name not in ('approve', 'reject'):
+                results[rental_id] = 'invalid_action'
+            elif rental is None:
+                results[rental_id] = 'not_found'
+            elif rental.pk in requested_as:
+                # The same rental under its other id; it must not reserve a second copy
+                results[rental_id] = 'duplicate'
+            elif rental.book_owner_id != user_id:
+                results[rental_id] = 'forbidden'
+            elif rental.status != 'PENDING':
+                results[rental_id] = 'invalid_state'
+            elif action_name == 'approve':
+                book_id = rental.to_mongo()['book']
+                if not inventory.reserve_copy(book_id, rental.pk, user_id):
+                    results[rental_id] = 'unavailable'
+                    continue
+                reserved[rental.pk] = book_id
+                requested_as[rental.pk] = rental_id
+                approval = outbox.event(handlers.RENTAL_APPROVED, rental_id=rental.pk, renter_id=rental.renter_id)
+                updates[rental.pk] = (
+                    {'renter_id': rental.renter_id, 'status': 'PENDING', 'book_owner_id': user_id},
+                    {
+                        '$set': {
+                            'status': 'ACTIVE', 'owner_approval': True,
+                            'approved_at': approval['at'], 'updated_at': stamp,
+                        },
+                        '$push': {'outbox': approval},
+                    }
+                )
+            else:
+                requested_as[rental.pk] = rental_id
+                updates[rental.pk] = (
+                    {'renter_id': rental.renter_id, 'status': 'PENDING', 'book_owner_id': user_id},
+                    {
+                        '$set': {'status': 'REJECTED', 'updated_at': stamp},
+                        '$push': {'outbox': outbox.event(
+                            handlers.RENTAL_REJECTED, rental_id=rental.pk, renter_id=rental.renter_id
+                        )},
+                    }
+                )
+
+        applied = bulk.apply_conditional_updates(collection, updates, stamp)
+
+        for pk in updates:
+            approving = pk in reserved
+            if pk not in applied:
+                if approving:
+                    inventory.release_copy(reserved[pk], pk, user_id)
+                results[requested_as[pk]] = 'invalid_state'
+                continue
+            results[requested_as[pk]] = 'approved' if approving else 'rejected'
+
+        return [
+            {'id': str(item.get('id')), 'status': results.get(str(item.get('id')))}
+            for item in items
+        ]
+
     @action(detail=False, methods=['get'])
     def my_rentals(self, request):
         try:
-            rentals = self.get_queryset().filter(renter_id=str(request.user.id))
+            if include_archived(request):
+                docs = archive.find(archive.RENTALS, {'renter_id': request.user.id}, self.newest_first)
+                rentals = [BookRental._from_son(doc) for doc in docs]
+            else:
+                rentals = self.get_queryset().filter(renter_id=str(request.user.id))
             serializer = self.serializer_class(rentals, many=True)
             return Response(serializer.data)
         except Exception as e:
@@ -345,9 +781,10 @@ class BookRentalViewSet(MongoModelViewSet):
     @action(detail=False, methods=['get'])
     def overdue(self, request):
         try:
+            # Same predicate as the dashboard's overdue bucket: still out past its end
             overdue_rentals = self.get_queryset().filter(
                 status='ACTIVE',
-                return_date__lt=timezone.now()
+                rental_end_date__lt=timezone.now()
             )
             serializer = self.serializer_class(overdue_rentals, many=True)
             return Response(serializer.data)
@@ -358,22 +795,95 @@ class BookRentalViewSet(MongoModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['get'])
+    def dashboard(self, request):
+        try:
+            buckets = request.query_params.get('buckets')
+            buckets = [b for b in buckets.split(',') if b in dashboard.BUCKETS] if buckets else dashboard.BUCKETS
+            cursors = {b: request.query_params.get(f'{b}_cursor') for b in buckets}
+            data = dashboard.build(request.user.id, cursors, get_limit(request), buckets)
+            for bucket in data.values():
+                bucket['results'] = self.serializer_class(bucket['results'], many=True).data
+            return Response(data)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error in dashboard: {str(e)}")
+            return Response(
+                {"error": "Failed to retrieve rental dashboard"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    def _analytics_range(self, request):
+        """(start, end) from the query; raises ValueError for a malformed or impossible date."""
+        dates = {}
+        for name in ('start', 'end'):
+            value = request.query_params.get(name)
+            try:
+                dates[name] = parse_date(value) if value else None
+            except ValueError:  # well formed but impossible, e.g. 2024-13-01
+                dates[name] = None
+            if value and dates[name] is None:
+                raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+        end = dates['end'] or timezone.now().date() + timedelta(days=1)
+        start = dates['start'] or end - timedelta(days=30)
+        return start, end
+
+    @action(detail=False, methods=['get'])
+    def earnings(self, request):
+        try:
+            start, end = self._analytics_range(request)
+            granularity = request.query_params.get('granularity', 'day')
+            if granularity not in ('day', 'month'):
+                return Response(
+                    {'error': 'granularity must be day or month'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            series = analytics.earnings(request.user.id, start, end, granularity)
+            return Response({'start': start, 'end': end, 'granularity': granularity, 'results': series})
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error in earnings: {str(e)}")
+            return Response(
+                {"error": "Failed to retrieve earnings"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @action(detail=False, methods=['get'])
+    def book_stats(self, request):
+        try:
+            start, end = self._analytics_range(request)
+            stats = analytics.book_stats(request.user.id, start, end)
+            return Response({'start': start, 'end': end, 'results': stats})
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error in book_stats: {str(e)}")
+            return Response(
+                {"error": "Failed to retrieve book statistics"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
 class BookReviewViewSet(MongoModelViewSet):
     serializer_class = BookReviewSerializer
     document_class = BookReview
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return self.document_class.objects.all()
+        return self.document_class.objects(hidden__ne=True)
+
     def perform_create(self, serializer):
         try:
-            # Check if user has already reviewed this book
-            book_id = serializer.validated_data.get('book_id')
-            existing_review = BookReview.objects.filter(
-                book_id=book_id,
-                reviewer_id=str(self.request.user.id)
-            ).first()
-            
-            if existing_review:
-                raise ValidationError("You have already reviewed this book")
+            # Check if user has already reviewed this book, archived reviews included
+            book = Book.objects(**ids.lookup(serializer.validated_data.get('book_id'))).only('id').first()
+            if book is not None:
+                reviewed = {'book': book.pk, 'reviewer_id': self.request.user.id}
+                if (BookReview._get_collection().find_one(reviewed, {'_id': 1})
+                        or archive.REVIEWS.cold.find_one(reviewed, {'_id': 1})):
+                    raise ValidationError("You have already reviewed this book")
             
             serializer.validated_data['reviewer_id'] = str(self.request.user.id)
             serializer.save()
@@ -387,10 +897,17 @@ class BookReviewViewSet(MongoModelViewSet):
     @action(detail=True, methods=['post'])
     def vote_helpful(self, request, pk=None):
         try:
-            review = self.get_object()
-            review.helpful_votes += 1
-            review.save()
+            lookup = ids.lookup(pk)
+            review_id = lookup.get('id') or self.get_object().pk
+            voted = BookReview.objects(id=review_id).update_one(
+                inc__helpful_votes=1,
+                push__outbox=outbox.event(handlers.REVIEW_HELPFUL_VOTE, review_id=review_id)
+            )
+            if not voted:
+                return Response({"error": "Item not found"}, status=status.HTTP_404_NOT_FOUND)
             return Response({'status': 'vote recorded'})
+        except BookReview.DoesNotExist:
+            return Response({"error": "Item not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             logger.error(f"Error in vote_helpful: {str(e)}")
             return Response(
@@ -401,13 +918,150 @@ class BookReviewViewSet(MongoModelViewSet):
 
     @action(detail=True, methods=['post'])
     def report(self, request, pk=None):
-        review = self.get_object()
-        review.reported = True
-        review.review_metadata = review.review_metadata or {}
-        review.review_metadata.update({
-            'report_reason': request.data.get('reason', ''),
-            'reported_by': str(request.user.id),
-            'reported_at': timezone.now().isoformat()
-        })
-        review.save()
-        return Response({'status': 'review reported'})
\ No newline at end of file
+        # One update of just the report fields, no read-modify-write of the review
+        if not moderation.report(ids.lookup(pk), request.data.get('reason', ''), request.user.id):
+            return Response({"error": "Item not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'status': 'review reported'})
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def moderation_queue(self, request):
+        """Reported reviews, oldest report first, keyset-paginated with ?cursor=."""
+        try:
+            reviews, next_cursor = moderation.queue(get_limit(request), request.query_params.get('cursor'))
+            return Response({
+                'results': ModerationReviewSerializer(reviews, many=True).data,
+                'next_cursor': next_cursor
+            })
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error in moderation_queue: {str(e)}")
+            return Response(
+                {"error": "Failed to retrieve the moderation queue"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    @idempotent
+    def moderate(self, request):
+        """
+        Resolve, hide or unhide many reviews at once.
+
+        Body: {"action": "resolve" | "hide" | "unhide", "ids": [...]}.
+        Returns a status per review.
+        """
+        review_ids = request.data.get('ids')
+        if not isinstance(review_ids, list) or not 1 <= len(review_ids) <= MAX_BATCH_SIZE:
+            return Response(
+                {'error': f'Provide between 1 and {MAX_BATCH_SIZE} ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if request.data.get('action') not in moderation.ACTIONS:
+            return Response(
+                {'error': f"action must be one of {', '.join(moderation.ACTIONS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            return Response({
+                'results': moderation.apply(review_ids, request.data['action'], request.user.id)
+            })
+        except Exception as e:
+            logger.error(f"Error in moderate reviews: {str(e)}")
+            return Response(
+                {"error": "Failed to moderate reviews"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class BookReviewsViewSet(viewsets.ViewSet):
+    """
+    Reviews of one book: /books/{book_pk}/reviews/.
+
+    Keyset-paginated on (created_at, id) for ?ordering=newest (default) or
+    (helpful_votes, id) for ?ordering=helpful, optionally filtered to one star
+    rating. Each combination is served by a (book, ...) compound index.
+    Reviews hidden by a moderator are left out.
+    ?include_archived=1 also reads reviews moved to the archive.
+    """
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    orderings = {
+        'newest': 'created_at',
+        'helpful': 'helpful_votes',
+    }
+
+    def list(self, request, book_pk=None):
+        try:
+            book = Book.objects(**ids.lookup(book_pk)).only(
+                'rating', 'total_ratings', 'rating_counts'
+            ).first()
+            if book is None:
+                return Response(
+                    {"error": "Item not found"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+            ordering = request.query_params.get('ordering', 'newest')
+            if ordering not in self.orderings:
+                return Response(
+                    {'error': 'ordering must be newest or helpful'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            sort_field = self.orderings[ordering]
+
+            query = {'book': book.pk, 'hidden': {'$ne': True}}
+            if request.query_params.get('rating'):
+                query['rating'] = int(request.query_params['rating'])
+            cursor = request.query_params.get('cursor')
+            if cursor:
+                value, last_id = decode_cursor(cursor, 2)
+                query.update(after(sort_field, value, last_id))
+
+            limit = get_limit(request)
+            docs = archive.find(
+                archive.REVIEWS, query, [(sort_field, -1), ('_id', -1)], limit + 1,
+                include_archived=include_archived(request)
+            )
+            has_more = len(docs) > limit
+            docs = docs[:limit]
+            reviews = [BookReview._from_son(doc) for doc in docs]
+
+            return Response({
+                'book': ratings.summary(book),
+                'results': NestedBookReviewSerializer(reviews, many=True).data,
+                'next_cursor': encode_cursor(docs[-1][sort_field], docs[-1]['_id']) if has_more else None
+            })
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response(
+                {'error': 'rating must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            logger.error(f"Error in book reviews: {str(e)}")
+            return Response(
+                {"error": "Failed to retrieve reviews"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+def serve_cover(request, path):
+    """
+    Serve a stored cover or thumbnail. Paths are content addressed, so responses
+    are cacheable forever. In production set COVERS_ACCEL_REDIRECT so nginx
+    sends the file: the app runs on uvicorn workers (ASGI), where FileResponse
+    streams it through the worker in chunks, without sendfile.
+    """
+    absolute = covers.resolve(path)
+    if absolute is None:
+        raise Http404("Cover not found")
+    etag = f'"{os.path.basename(absolute)}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    elif getattr(settings, 'COVERS_ACCEL_REDIRECT', ''):
+        response = HttpResponse(content_type=mimetypes.guess_type(absolute)[0])
+        response['X-Accel-Redirect'] = settings.COVERS_ACCEL_REDIRECT + path
+    else:
+        response = FileResponse(open(absolute, 'rb'))
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
@@ -0,0 +1,288 @@
+"""
+Canonical works shared by every listing of the same book.
+
+Title, author, description, cover and publication year live once per work in
+the `works` collection, keyed by normalized ISBN-13. A listing only stores its
+owner-specific fields and the ISBN. Works are read through a small in-process
+LRU so rendering a page of listings costs at most one $in query.
+
+The catalog filters on the publication year and on the words of the title and
+author, so each listing also keeps a copy of those (listing_fields) and is
+filtered with its own indexes. Every write to a work here updates the copies
+on its listings.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .models import Book, Work
+
+WORK_FIELDS = ['title', 'author', 'description', 'cover_image', 'publication_year']
+
+
+_WORD = re.compile(r'\w+')
+
+
+def search_terms(*texts):
+    """Distinct lowercased words of `texts`, as kept on listings for search."""
+    return sorted({word for text in texts if text for word in _WORD.findall(text.lower())})
+
+
+def listing_fields(work):
+    """Fields a listing copies from its work (a raw document or None) for catalog filtering."""
+    work = work or {}
+    return {
+        'work_year': work.get('publication_year'),
+        'search_terms': search_terms(work.get('title'), work.get('author')),
+    }
+
+
+def _sync_listings(work):
+    Book._get_collection().update_many({'isbn': work['_id']}, {'$set': listing_fields(work)})
+
+
+def isbn10_check_digit(digits):
+    total = sum((10 - i) * int(d) for i, d in enumerate(digits[:9]))
+    check = (11 - total % 11) % 11
+    return 'X' if check == 10 else str(check)
+
+
+def isbn13_check_digit(digits):
+    total = sum((3 if i % 2 else 1) * int(d) for i, d in enumerate(digits[:12]))
+    return str((10 - total % 10) % 10)
+
+
+def normalize_isbn(value, strict=True):
+    """
+    ISBN-13 for an ISBN-10 or ISBN-13 in any common notation.
+
+    Raises ValueError for anything that isn't a valid ISBN, unless `strict` is
+    False, in which case the cleaned-up input is returned as is.
+    """
+    cleaned = ''.join(c for c in str(value or '') if c.isalnum()).upper()
+    if cleaned.startswith('ISBN'):
+        cleaned = cleaned[4:]
+    if len(cleaned) == 10 and cleaned[:9].isdigit() and cleaned[9] == isbn10_check_digit(cleaned):
+        body = '978' + cleaned[:9]
+        return body + isbn13_check_digit(body)
+    if len(cleaned) == 13 and cleaned.isdigit() and cleaned[12] == isbn13_check_digit(cleaned):
+        return cleaned
+    if strict:
+        raise ValueError(f"{value!r} is not a valid ISBN-10 or ISBN-13")
+    return cleaned
+
+
+class LRUCache:
+    """Thread-safe LRU with a per-entry time to live."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = LRUCache(
+    getattr(settings, 'WORKS_CACHE_SIZE', 10000),
+    getattr(settings, 'WORKS_CACHE_TTL', 300)
+)
+_MISSING = object()
+
+
+def get(isbn):
+    """The Work for a listing's ISBN, or None."""
+    if not isbn:
+        return None
+    work = _cache.get(isbn, _MISSING)
+    if work is _MISSING:
+        work = Work.objects(pk=isbn).first()
+        _cache.set(isbn, work)
+    return work
+
+
+def get_many(isbns):
+    """Works for several ISBNs with one query for the ones not cached."""
+    found = {}
+    missing = []
+    for isbn in set(filter(None, isbns)):
+        work = _cache.get(isbn, _MISSING)
+        if work is _MISSING:
+            missing.append(isbn)
+        else:
+            found[isbn] = work
+    if missing:
+        for work in Work.objects(pk__in=missing):
+            found[work.pk] = work
+        for isbn in missing:
+            found.setdefault(isbn, None)
+            _cache.set(isbn, found[isbn])
+    return found
+
+
+def invalidate(isbn):
+    _cache.delete(isbn)
+
+
+def fill_blanks_update(metadata, now):
+    """Pipeline update that creates the work or fills only its empty fields."""
+    values = {
+        field: {'$ifNull': [f'${field}', value]}
+        for field, value in metadata.items()
+        if value not in (None, '')
+    }
+    values['created_at'] = {'$ifNull': ['$created_at', now]}
+    values['updated_at'] = now
+    return [{'$set': values}]
+
+
+def ensure(isbn, metadata):
+    """
+    Make sure a work exists for `isbn`. Metadata only fills fields the work
+    doesn't have yet, so one listing can't overwrite what others show.
+    Returns the fields a new listing of the work copies (listing_fields).
+    """
+    work = Work._get_collection().find_one_and_update(
+        {'_id': isbn}, fill_blanks_update(metadata, timezone.now()), upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _sync_listings(work)
+    invalidate(isbn)
+    return listing_fields(work)
+
+
+def update_metadata(isbn, metadata, owner_id):
+    """
+    Apply an owner's edit to the work. Edits go through as is while the owner
+    has the only listing of it; once it is shared they only fill blanks.
+    """
+    if Book.objects(isbn=isbn, owner_id__ne=int(owner_id)).first() is not None:
+        ensure(isbn, metadata)
+        return
+    work = Work._get_collection().find_one_and_update(
+        {'_id': isbn},
+        {'$set': dict(metadata, updated_at=timezone.now()), '$setOnInsert': {'created_at': timezone.now()}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    _sync_listings(work)
+    invalidate(isbn)
+
+
+def sync_all_listings(batch_size=1000, log=None):
+    """Refresh the copied work fields on every listing, one work at a time. Returns the works done."""
+    synced = 0
+    operations = []
+    projection = {'title': 1, 'author': 1, 'publication_year': 1}
+    for work in Work._get_collection().find({}, projection, batch_size=batch_size):
+        operations.append(UpdateMany({'isbn': work['_id']}, {'$set': listing_fields(work)}))
+        if len(operations) >= batch_size:
+            Book._get_collection().bulk_write(operations, ordered=False)
+            synced += len(operations)
+            operations = []
+            if log:
+                log(f"{synced} works synced")
+    if operations:
+        Book._get_collection().bulk_write(operations, ordered=False)
+        synced += len(operations)
+    return synced
+
+
+def dedupe(book_collection, work_collection, batch_size=1000, log=None):
+    """
+    Move metadata from listings into works, oldest listing first so its values
+    win and later listings only fill blanks. Listing ISBNs are rewritten to the
+    normalized ISBN-13 and get their copy of the work fields (listing_fields). A listing whose owner already lists the same work under
+    another notation keeps its ISBN (and gets a work under it) and is returned
+    in `conflicts` for a manual merge.
+
+    Returns (moved, conflicts).
+    """
+    pending = {'$or': [{field: {'$exists': True}} for field in WORK_FIELDS]}
+    projection = dict.fromkeys(WORK_FIELDS + ['isbn'], 1)
+    unset = dict.fromkeys(WORK_FIELDS, '')
+    moved = 0
+    conflicts = []
+    last_id = None
+    while True:
+        query = dict(pending, _id={'$gt': last_id}) if last_id else pending
+        batch = list(book_collection.find(query, projection).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+        now = timezone.now()
+        keys = [normalize_isbn(doc.get('isbn'), strict=False) for doc in batch]
+        work_collection.bulk_write([
+            UpdateOne(
+                {'_id': key},
+                fill_blanks_update({field: doc.get(field) for field in WORK_FIELDS}, now),
+                upsert=True
+            )
+            for key, doc in zip(keys, batch)
+        ], ordered=False)
+
+        operations = [
+            UpdateOne({'_id': doc['_id']}, {'$set': {'isbn': key}, '$unset': unset})
+            for key, doc in zip(keys, batch)
+        ]
+        try:
+            book_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+            duplicates = [batch[error['index']] for error in e.details['writeErrors']]
+            work_collection.bulk_write([
+                UpdateOne(
+                    {'_id': doc['isbn']},
+                    fill_blanks_update({field: doc.get(field) for field in WORK_FIELDS}, now),
+                    upsert=True
+                )
+                for doc in duplicates
+            ], ordered=False)
+            book_collection.bulk_write([
+                UpdateOne({'_id': doc['_id']}, {'$unset': unset}) for doc in duplicates
+            ], ordered=False)
+            conflicts.extend(doc['_id'] for doc in duplicates)
+            keys.extend(doc['isbn'] for doc in duplicates)
+
+        book_collection.bulk_write([
+            UpdateMany({'isbn': work['_id']}, {'$set': listing_fields(work)})
+            for work in work_collection.find(
+                {'_id': {'$in': list(set(keys))}}, {'title': 1, 'author': 1, 'publication_year': 1}
+            )
+        ], ordered=False)
+
+        moved += len(batch)
+        if log:
+            log(f"{moved} listings moved")
+    return moved, conflicts
@@ -0,0 +1,23 @@
+"""
+gunicorn settings: gunicorn -c gunicorn.conf.py backend.asgi:application
+
+The app is loaded once in the master (preload_app) and forked into the
+workers, so a new worker serves its first request without importing Django,
+the apps and the URLconf again. MongoDB clients aren't fork-safe, so each
+worker opens its own in post_fork.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', str(multiprocessing.cpu_count())))
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+
+
+def post_fork(server, worker):
+    from backend import mongo
+
+    mongo.reconnect()
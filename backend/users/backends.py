@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from .hashing import hash_password, verify_password
+
+UserModel = get_user_model()
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend that checks passwords in the hashing pool (users/hashing.py)
+    instead of on the request thread. Unknown usernames still cost one hash,
+    and hashes made with other settings are upgraded on a successful login.
+
+    Raises HashingPoolSaturated when the pool is full; authenticate() lets it
+    through to the caller.
+    """
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            verify_password(password, None)
+            return None
+        verified, needs_update = verify_password(password, user.password)
+        if not verified or not self.user_can_authenticate(user):
+            return None
+        if needs_update:
+            user.password = hash_password(password)
+            user.save(update_fields=['password'])
+        return user
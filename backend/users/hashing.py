@@ -0,0 +1,127 @@
+import atexit
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, identify_hasher, make_password
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 hasher whose work factor comes from settings.PASSWORD_HASH_ITERATIONS.
+
+    Lowering or raising the setting takes effect on the next login: hashes with a
+    different iteration count are reported by must_update() and re-hashed.
+    """
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', PBKDF2PasswordHasher.iterations)
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when the hashing queue is full and the request should be shed."""
+
+
+def _init_worker():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    import django
+    django.setup()
+
+
+def _verify(password, encoded):
+    verified = check_password(password, encoded)
+    needs_update = False
+    if verified:
+        try:
+            needs_update = identify_hasher(encoded).must_update(encoded)
+        except ValueError:
+            pass
+    return verified, needs_update
+
+
+def _hash(password):
+    return make_password(password)
+
+
+class HashingPool:
+    """
+    Bounded process pool for password hashing.
+
+    At most `max_pending` hashes may be queued or running at once; callers beyond
+    that are rejected immediately instead of tying up a request thread. A slot is
+    held until its job is done, not until its caller stops waiting, so callers
+    that time out can't let the queue grow past the bound.
+    """
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        initializer=_init_worker
+                    )
+        return self._executor
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolSaturated()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Drop the job if it hasn't started; a running one keeps its slot until it ends
+            future.cancel()
+            logger.error("Password hashing timed out")
+            raise HashingPoolSaturated()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool(
+                    workers=getattr(settings, 'PASSWORD_HASH_WORKERS', os.cpu_count() or 1),
+                    max_pending=getattr(settings, 'PASSWORD_HASH_MAX_PENDING', 32),
+                    timeout=getattr(settings, 'PASSWORD_HASH_TIMEOUT', 5),
+                )
+                atexit.register(_pool.shutdown)
+    return _pool
+
+
+def verify_password(password, encoded):
+    """Return (verified, needs_update) for `password` against `encoded`."""
+    if not encoded:
+        # Hash anyway so unknown users cost the same as known ones.
+        get_pool().run(_hash, password)
+        return False, False
+    return get_pool().run(_verify, password, encoded)
+
+
+def hash_password(password):
+    return get_pool().run(_hash, password)
@@ -0,0 +1,78 @@
+import http.cookiejar
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test mutation latency against a running server, comparing a CSRF "
+        "fetch before every mutation with reusing one token"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000/api')
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--path', default='/auth/profile/update/', help="Mutation endpoint to exercise")
+        parser.add_argument('--method', default='PUT')
+        parser.add_argument('--body', default='{}')
+        parser.add_argument('--requests', type=int, default=200)
+
+    def _request(self, opener, url, method='GET', body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['X-CSRFToken'] = token
+        request = urllib.request.Request(url, data=body, headers=headers, method=method)
+        with opener.open(request) as response:
+            payload = response.read()
+            return response, json.loads(payload) if payload else {}
+
+    def _measure(self, label, mutate):
+        latencies = []
+        for _ in range(self.options['requests']):
+            started = time.perf_counter()
+            mutate()
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        self.stdout.write(
+            f"{label:<28} mean {statistics.mean(latencies):7.2f} ms  "
+            f"p50 {statistics.median(latencies):7.2f} ms  "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1]:7.2f} ms"
+        )
+        return statistics.mean(latencies)
+
+    def handle(self, *args, **options):
+        self.options = options
+        base = options['base_url'].rstrip('/')
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+        _, data = self._request(opener, f"{base}/auth/csrf/")
+        credentials = json.dumps({'username': options['username'], 'password': options['password']}).encode()
+        try:
+            response, data = self._request(opener, f"{base}/auth/login/", 'POST', credentials, data['csrfToken'])
+        except urllib.error.HTTPError as e:
+            raise CommandError(f"Login failed: {e.code}")
+        token = response.headers.get('X-CSRFToken') or data.get('csrfToken')
+
+        url = f"{base}{options['path']}"
+        body = options['body'].encode()
+
+        def fetch_then_mutate():
+            _, fresh = self._request(opener, f"{base}/auth/csrf/")
+            self._request(opener, url, options['method'], body, fresh['csrfToken'])
+
+        def reuse_token():
+            nonlocal token
+            response, _ = self._request(opener, url, options['method'], body, token)
+            token = response.headers.get('X-CSRFToken') or token
+
+        before = self._measure("fetch token per mutation", fetch_then_mutate)
+        after = self._measure("reuse issued token", reuse_token)
+        self.stdout.write(self.style.SUCCESS(
+            f"Mutation latency reduced by {before - after:.2f} ms ({(1 - after / before) * 100:.0f}%)"
+        ))
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.middleware.csrf import get_token
+
+CSRF_HINT_HEADER = 'X-CSRFToken'
+
+
+class CSRFTokenHintMiddleware:
+    """
+    Tell the client when its CSRF token changes.
+
+    Clients keep one token for many requests instead of fetching a fresh one
+    before each mutation. Whenever the token is issued or rotated (e.g. on login)
+    the new value is sent back in the X-CSRFToken response header so the client
+    can swap it in without an extra round trip.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        current = request.META.get('CSRF_COOKIE')
+        if current and current != request.COOKIES.get(settings.CSRF_COOKIE_NAME):
+            response[CSRF_HINT_HEADER] = get_token(request)
+        return response
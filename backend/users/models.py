@@ -17,6 +17,7 @@ class UserProfile(Document):
 
     meta = {
         'collection': 'user_profiles',
+        'auto_create_index': False,
         'indexes': [
             'user_id',
             'username',
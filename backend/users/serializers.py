@@ -4,6 +4,7 @@ from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from .models import UserProfile
 from django.db import transaction
+from .hashing import HashingPoolSaturated, hash_password
 
 class UserProfileSerializer(serializers.Serializer):
     id = serializers.CharField(source='_id', read_only=True)
@@ -48,20 +49,23 @@ class RegisterSerializer(serializers.Serializer):
 
     def create(self, validated_data):
         try:
+            # Remove password2 and location from the data
+            validated_data.pop('password2')
+            location = validated_data.pop('location', {})
+            # Hash in the worker pool before opening the transaction, so no
+            # database transaction waits on the pool
+            encoded_password = hash_password(validated_data.pop('password'))
+
             with transaction.atomic():
-                # Remove password2 and location from the data
-                validated_data.pop('password2')
-                location = validated_data.pop('location', {})
-                password = validated_data.pop('password')
-                
                 # Create Django user
-                user = User.objects.create_user(
-                    username=validated_data['username'],
-                    email=validated_data['email'],
-                    password=password,
+                user = User(
+                    username=User.normalize_username(validated_data['username']),
+                    email=User.objects.normalize_email(validated_data['email']),
+                    password=encoded_password,
                     first_name=validated_data.get('first_name', ''),
                     last_name=validated_data.get('last_name', '')
                 )
+                user.save()
 
                 # Create MongoDB UserProfile
                 try:
@@ -83,6 +87,8 @@ class RegisterSerializer(serializers.Serializer):
 
                 return user
 
+        except HashingPoolSaturated:
+            raise
         except Exception as e:
             # Clean up any partial data if needed
             username = validated_data.get('username')
@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from users import throttling
+from users.backends import PooledModelBackend
+
+
+class TokenBucketTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_bucket_refills_each_period(self):
+        bucket = throttling.TokenBucket('test', rate=1, capacity=2)
+        with mock.patch.object(throttling.time, 'time', return_value=100.5):
+            self.assertEqual([bucket.consume('a'), bucket.consume('a')], [0, 0])
+            self.assertEqual(bucket.consume('a'), 1.5)
+            self.assertEqual(bucket.consume('b'), 0)
+        with mock.patch.object(throttling.time, 'time', return_value=102.0):
+            self.assertEqual(bucket.consume('a'), 0)
+
+    def test_concurrent_attempts_spend_each_token_once(self):
+        bucket = throttling.TokenBucket('test', rate=0.01, capacity=5)
+        with mock.patch.object(throttling.time, 'time', return_value=100.0):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                waits = list(pool.map(lambda _: bucket.consume('a'), range(40)))
+        self.assertEqual(waits.count(0), 5)
+
+
+@override_settings(AUTH_RATE_LIMITS={'ip': (100, 100), 'username': (100, 100)})
+class LoginTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user('reader', password='secret-pass-1')
+
+    def login(self, password):
+        return APIClient().post('/api/auth/login/', {'username': 'reader', 'password': password}, format='json')
+
+    def test_wrong_password_signals_failure(self):
+        failed = []
+
+        def record(sender, credentials, **kwargs):
+            failed.append(credentials['username'])
+
+        user_login_failed.connect(record)
+        self.addCleanup(user_login_failed.disconnect, record)
+        self.assertEqual(self.login('wrong-pass-1').status_code, 401)
+        self.assertEqual(failed, ['reader'])
+
+    def test_inactive_user_is_rejected(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.login('secret-pass-1').status_code, 401)
+
+    def test_backend_checks_passwords_in_the_pool(self):
+        backend = PooledModelBackend()
+        self.assertEqual(backend.authenticate(None, username='reader', password='secret-pass-1'), self.user)
+        self.assertIsNone(backend.authenticate(None, username='reader', password='wrong-pass-1'))
+        self.assertIsNone(backend.authenticate(None, username='nobody', password='wrong-pass-1'))
@@ -0,0 +1,75 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class TokenBucket:
+    """
+    Token bucket stored in a Django cache.
+
+    The bucket holds `capacity` tokens and is refilled all at once every
+    capacity / rate seconds, so it allows `rate` tokens per second on average.
+    Each refill period is one cache counter taken with add() and incr(), which
+    are atomic in the shared backends: concurrent workers can't both spend the
+    last token. With the default local-memory cache the buckets are per
+    process; point AUTH_THROTTLE_CACHE at a shared backend (memcached, redis)
+    to share them across workers.
+    """
+    def __init__(self, scope, rate, capacity, cache_alias='default'):
+        self.scope = scope
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.cache = caches[cache_alias]
+
+    def _key(self, ident):
+        digest = hashlib.sha1(str(ident).encode('utf-8')).hexdigest()
+        return f"auth-bucket:{self.scope}:{digest}"
+
+    def consume(self, ident, tokens=1):
+        """Take `tokens` from the bucket; return seconds to wait, or 0 if allowed."""
+        period = self.capacity / self.rate
+        now = time.time()
+        refill = int(now // period)
+        key = f"{self._key(ident)}:{refill}"
+        timeout = int(period) + 1
+        if self.cache.add(key, tokens, timeout):
+            used = tokens
+        else:
+            try:
+                used = self.cache.incr(key, tokens)
+            except ValueError:
+                # Expired between add() and incr(): the period is over anyway
+                self.cache.set(key, tokens, timeout)
+                used = tokens
+        if used > self.capacity:
+            return (refill + 1) * period - now
+        return 0
+
+
+def get_client_ip(request):
+    if getattr(settings, 'AUTH_THROTTLE_TRUST_X_FORWARDED_FOR', False):
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _bucket(scope):
+    rate, capacity = settings.AUTH_RATE_LIMITS[scope]
+    return TokenBucket(scope, rate, capacity, getattr(settings, 'AUTH_THROTTLE_CACHE', 'default'))
+
+
+def check_auth_rate(request, username=None):
+    """
+    Charge the per-IP and per-username buckets for an auth attempt.
+
+    Returns the number of seconds the client should wait, or 0 if allowed.
+    """
+    wait = _bucket('ip').consume(get_client_ip(request))
+    if wait:
+        return wait
+    if username:
+        return _bucket('username').consume(username.lower())
+    return 0
@@ -1,8 +1,7 @@
 from rest_framework import generics, status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.contrib.auth import login, logout, authenticate
-from django.contrib.auth.models import User
+from django.contrib.auth import authenticate, login, logout
 from .models import UserProfile
 from .serializers import RegisterSerializer, UserProfileSerializer, LoginSerializer, UserUpdateSerializer
 from django.db.models import F, Q
@@ -10,7 +9,8 @@ from math import radians, cos, sin, asin, sqrt
 from django.middleware.csrf import get_token
 from django.http import JsonResponse
 import logging
-from django.db import transaction
+from .hashing import HashingPoolSaturated
+from .throttling import check_auth_rate
 
 logger = logging.getLogger(__name__)
 
@@ -20,11 +20,36 @@ class CSRFTokenView(APIView):
     def get(self, request):
         return JsonResponse({'csrfToken': get_token(request)})
 
+AUTH_BACKEND = 'users.backends.PooledModelBackend'
+
+
+def throttled_response(wait):
+    response = Response(
+        {'error': 'Too many attempts, please try again later'},
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = str(max(1, int(wait + 0.5)))
+    return response
+
+
+def overloaded_response():
+    response = Response(
+        {'error': 'Authentication service is busy, please retry'},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    response['Retry-After'] = '1'
+    return response
+
+
 class RegisterView(APIView):
     permission_classes = [permissions.AllowAny]
-    
-    @transaction.atomic
+
+    # Not atomic: the serializer hashes the password first, then opens its own transaction
     def post(self, request):
+        wait = check_auth_rate(request)
+        if wait:
+            return throttled_response(wait)
+
         serializer = RegisterSerializer(data=request.data)
         
         if not serializer.is_valid():
@@ -36,33 +61,29 @@ class RegisterView(APIView):
         try:
             # Create the user
             user = serializer.save()
-            
-            # Authenticate and login the user
-            auth_user = authenticate(
-                username=request.data['username'],
-                password=request.data['password']
-            )
-            
-            if auth_user:
-                login(request, auth_user)
-                
-                # Get the user profile
-                profile = UserProfile.objects.get(user_id=user.id)
-                
-                return Response({
-                    "detail": "Registration successful",
-                    "user": {
-                        "id": user.id,
-                        "username": user.username,
-                        "email": user.email,
-                        "first_name": user.first_name,
-                        "last_name": user.last_name,
-                        "profile_id": str(profile.id) if profile else None
-                    }
-                }, status=status.HTTP_201_CREATED)
-            else:
-                raise Exception("Failed to authenticate user after creation")
-                
+
+            # The password was just hashed, so log in without re-checking it
+            user.backend = AUTH_BACKEND
+            login(request, user)
+
+            # Get the user profile
+            profile = UserProfile.objects.get(user_id=user.id)
+
+            return Response({
+                "detail": "Registration successful",
+                "csrfToken": get_token(request),
+                "user": {
+                    "id": user.id,
+                    "username": user.username,
+                    "email": user.email,
+                    "first_name": user.first_name,
+                    "last_name": user.last_name,
+                    "profile_id": str(profile.id) if profile else None
+                }
+            }, status=status.HTTP_201_CREATED)
+
+        except HashingPoolSaturated:
+            return overloaded_response()
         except Exception as e:
             return Response(
                 {"detail": "Registration failed", "error": str(e)},
@@ -84,9 +105,14 @@ class LoginView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            user = authenticate(username=username, password=password)
-            
-            if user is not None and user.is_active:
+            wait = check_auth_rate(request, username)
+            if wait:
+                return throttled_response(wait)
+
+            # PooledModelBackend hashes off the request thread
+            user = authenticate(request, username=username, password=password)
+
+            if user is not None:
                 login(request, user)
                 
                 try:
@@ -102,6 +128,7 @@ class LoginView(APIView):
                     profile.save()
 
                 return Response({
+                    'csrfToken': get_token(request),
                     'user': {
                         'id': user.id,
                         'username': user.username,
@@ -117,6 +144,8 @@ class LoginView(APIView):
                     {'error': 'Invalid username or password'},
                     status=status.HTTP_401_UNAUTHORIZED
                 )
+        except HashingPoolSaturated:
+            return overloaded_response()
         except Exception as e:
             logger.error(f"Login error: {str(e)}")
             return Response(
@@ -11,13 +11,36 @@ const api = axios.create({
     withCredentials: true,
 });
 
-// Add request interceptor to get CSRF token
+// CSRF token, reused across requests. The backend sends a new one in the
+// X-CSRFToken response header (and in login/register bodies) when it rotates.
+let csrfToken = null;
+
+const readCsrfCookie = () => {
+    const match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+    return match ? decodeURIComponent(match[1]) : null;
+};
+
+const fetchCsrfToken = async () => {
+    const response = await axios.get(`${API_URL}/auth/csrf/`, { withCredentials: true });
+    csrfToken = response.data.csrfToken;
+    return csrfToken;
+};
+
+const rememberCsrfToken = (response) => {
+    const rotated = response.headers && response.headers['x-csrftoken'];
+    if (rotated) {
+        csrfToken = rotated;
+    } else if (response.data && response.data.csrfToken) {
+        csrfToken = response.data.csrfToken;
+    }
+};
+
+// Only non-GET requests need the token, and only fetch it when we have none
 api.interceptors.request.use(async (config) => {
-    // Only get CSRF token for non-GET methods
     if (config.method !== 'get') {
         try {
-            const response = await axios.get(`${API_URL}/auth/csrf/`, { withCredentials: true });
-            config.headers['X-CSRFToken'] = response.data.csrfToken;
+            const token = csrfToken || readCsrfCookie() || await fetchCsrfToken();
+            config.headers['X-CSRFToken'] = token;
         } catch (error) {
             console.error('Error fetching CSRF token:', error);
         }
@@ -25,6 +48,28 @@ api.interceptors.request.use(async (config) => {
     return config;
 });
 
+// Pick up rotated tokens; if the server rejects ours, fetch a fresh one and retry once
+api.interceptors.response.use(
+    (response) => {
+        rememberCsrfToken(response);
+        return response;
+    },
+    async (error) => {
+        const { config, response } = error;
+        if (response) {
+            rememberCsrfToken(response);
+        }
+        const csrfFailure = response && response.status === 403
+            && JSON.stringify(response.data || '').includes('CSRF');
+        if (csrfFailure && config && !config._csrfRetried) {
+            config._csrfRetried = true;
+            config.headers['X-CSRFToken'] = await fetchCsrfToken();
+            return api(config);
+        }
+        return Promise.reject(error);
+    }
+);
+
 // Book endpoints
 export const getBooks = () => api.get('/books/');
 export const getAvailableBooks = () => api.get('/books/available/');